@@ -19,6 +19,7 @@ import logging
 
 import mysite.base.views
 import mysite.base.controllers
+import mysite.profile.tasks
 from mysite.base.controllers import get_notification_from_request
 from mysite.profile.models import Person, Tag, TagType, Link_Project_Tag, Link_SF_Proj_Dude_FM, Link_Person_Tag, DataImportAttempt
 import mysite.account.forms
@@ -83,7 +84,8 @@ def edit_photo_do(request, mock=None):
                                        instance=person)
     if form.is_valid():
         person = form.save()
-        person.generate_thumbnail_from_photo()
+        mysite.profile.tasks.generate_photo_thumbnails.delay(
+            person_id=person.id)
 
         return HttpResponseRedirect(reverse(mysite.profile.views.display_person_web, kwargs={
             'user_to_display__username': request.user.username
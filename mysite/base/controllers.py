@@ -144,6 +144,51 @@ def cached_geocoding_in_json(address):
         cache.set(key_name, geocoded_in_json, cache_duration)
     return geocoded_in_json
 
+def geocoding_without_waiting(addresses):
+    """Return a dict mapping each address to what cached_geocoding_in_json
+    would say about it (decoded), out of the GeocodedAddress table: one
+    query, and never a request to the geocoder. Addresses we haven't
+    geocoded yet come back without coordinates, and get queued so that
+    they'll have them next time."""
+    import mysite.base.models
+    address2geocoded, new_addresses = (
+        mysite.base.models.GeocodedAddress.get_many(addresses))
+    if new_addresses:
+        import mysite.profile.tasks
+        mysite.profile.tasks.geocode_pending_addresses.delay()
+
+    ret = {}
+    for address, geocoded in address2geocoded.items():
+        ret[address] = {'is_inaccessible': (address == 'Inaccessible Island')}
+        ret[address].update(geocoded.as_dict())
+    return ret
+
+def seed_geocoded_addresses_from_cache(addresses):
+    """Copy what cached_geocoding_in_json already found out about these
+    addresses into the GeocodedAddress table, so they needn't wait their
+    turn with the geocoder. Returns how many it copied."""
+    import mysite.base.models
+    address2key = dict([(address, address2cache_key_name(address))
+                        for address in addresses])
+    key2json = cache.get_many(address2key.values())
+    address2geocoded, new_addresses = (
+        mysite.base.models.GeocodedAddress.get_many(addresses))
+    copied = 0
+    for address, geocoded in address2geocoded.items():
+        geocoded_in_json = key2json.get(address2key[address])
+        if not geocoded.is_pending() or geocoded_in_json is None:
+            continue
+        cached = simplejson.loads(geocoded_in_json)
+        if cached.get('latitude') is None:
+            continue
+        geocoded.latitude = cached['latitude']
+        geocoded.longitude = cached['longitude']
+        geocoded.suggested_zoom_level = cached.get('suggested_zoom_level')
+        geocoded.date_geocoded = datetime.datetime.utcnow()
+        geocoded.save()
+        copied += 1
+    return copied
+
 def get_uri_metadata_for_generating_absolute_links(request):
     data = {}
     colon_and_port_number = ':' + request.META['SERVER_PORT']
@@ -0,0 +1,80 @@
+### Geohashes: a point on the map, written as a string. Each character
+### halves the cell it's in five more times, alternating between longitude
+### and latitude, so a geohash's prefixes are the bigger cells it sits in.
+### See http://en.wikipedia.org/wiki/Geohash
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+BASE32_VALUES = dict([(character, value)
+                      for value, character in enumerate(BASE32)])
+
+def encode(latitude, longitude, precision):
+    """Return the geohash, precision characters long, of the cell that
+    the point is in."""
+    south, north = -90.0, 90.0
+    west, east = -180.0, 180.0
+    characters = []
+    value = 0
+    n_bits = 0
+    even_bit = True # Even bits are longitude, odd ones latitude.
+    while len(characters) < precision:
+        if even_bit:
+            middle = (west + east) / 2
+            if longitude >= middle:
+                value = value * 2 + 1
+                west = middle
+            else:
+                value = value * 2
+                east = middle
+        else:
+            middle = (south + north) / 2
+            if latitude >= middle:
+                value = value * 2 + 1
+                south = middle
+            else:
+                value = value * 2
+                north = middle
+        even_bit = not even_bit
+        n_bits += 1
+        if n_bits == 5:
+            characters.append(BASE32[value])
+            value = 0
+            n_bits = 0
+    return ''.join(characters)
+
+def decode_bounds(geohash):
+    """Return the (south, west, north, east) edges of a geohash's cell."""
+    south, north = -90.0, 90.0
+    west, east = -180.0, 180.0
+    even_bit = True
+    for character in geohash:
+        value = BASE32_VALUES[character]
+        for shift in (4, 3, 2, 1, 0):
+            bit = (value >> shift) & 1
+            if even_bit:
+                middle = (west + east) / 2
+                if bit:
+                    west = middle
+                else:
+                    east = middle
+            else:
+                middle = (south + north) / 2
+                if bit:
+                    south = middle
+                else:
+                    north = middle
+            even_bit = not even_bit
+    return south, west, north, east
+
+def decode(geohash):
+    """Return the (latitude, longitude) of the middle of a geohash's
+    cell."""
+    south, west, north, east = decode_bounds(geohash)
+    return (south + north) / 2, (west + east) / 2
+
+def cell_size(precision):
+    """Return the (height, width) in degrees of cells precision
+    characters long."""
+    n_bits = 5 * precision
+    longitude_bits = (n_bits + 1) // 2
+    latitude_bits = n_bits // 2
+    return 180.0 / (2 ** latitude_bits), 360.0 / (2 ** longitude_bits)
@@ -5,12 +5,15 @@ import os.path
 import shutil
 import tempfile
 import datetime
+import threading
 import dateutil.parser
 
 from django.http import HttpResponse
 import django.shortcuts
 from django.template import RequestContext
 import django.conf
+import django.db
+from django.db import transaction
 
 import mysite.base.decorators
 
@@ -65,3 +68,90 @@ def clear_static_cache(path):
 
     # 2. shutil.rmtree() the new path
     shutil.rmtree(new_temp_path)
+
+def insert_ignoring_duplicates(model, field_names, rows):
+    """Insert rows (sequences of values, in the order of field_names) into
+    model's table in one INSERT, skipping any whose unique keys are taken
+    already. Saves no instances, so sends no signals."""
+    if not rows:
+        return
+    qn = django.db.connection.ops.quote_name
+    if django.conf.settings.DATABASE_ENGINE == 'sqlite3':
+        insert = 'INSERT OR IGNORE'
+    else:
+        insert = 'INSERT IGNORE'
+    one_row = '(%s)' % ', '.join(['%s'] * len(field_names))
+    params = []
+    for row in rows:
+        params.extend(row)
+    cursor = django.db.connection.cursor()
+    cursor.execute('%s INTO %s (%s) VALUES %s' % (
+            insert, qn(model._meta.db_table),
+            ', '.join([qn(model._meta.get_field(name).column)
+                       for name in field_names]),
+            ', '.join([one_row] * len(rows))), params)
+    transaction.commit_unless_managed()
+
+class LRUCache(object):
+    '''A dictionary that forgets its least recently used keys once it holds
+    more than max_size of them. It is safe to share between threads.'''
+
+    # Each entry of self.key2link is [previous link, next link, key, value];
+    # self.root is the sentinel of a circular list, oldest first.
+    PREVIOUS, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.key2link = {}
+            self.root = []
+            self.root[:] = [self.root, self.root, None, None]
+        finally:
+            self.lock.release()
+
+    def get(self, key, default=None):
+        self.lock.acquire()
+        try:
+            link = self.key2link.get(key)
+            if link is None:
+                return default
+            self._unlink(link)
+            self._append(link)
+            return link[self.VALUE]
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        self.lock.acquire()
+        try:
+            link = self.key2link.get(key)
+            if link is not None:
+                self._unlink(link)
+            link = [None, None, key, value]
+            self.key2link[key] = link
+            self._append(link)
+            while len(self.key2link) > self.max_size:
+                oldest = self.root[self.NEXT]
+                self._unlink(oldest)
+                del self.key2link[oldest[self.KEY]]
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.key2link)
+
+    def _unlink(self, link):
+        link[self.PREVIOUS][self.NEXT] = link[self.NEXT]
+        link[self.NEXT][self.PREVIOUS] = link[self.PREVIOUS]
+
+    def _append(self, link):
+        last = self.root[self.PREVIOUS]
+        link[self.PREVIOUS] = last
+        link[self.NEXT] = self.root
+        last[self.NEXT] = link
+        self.root[self.PREVIOUS] = link
@@ -0,0 +1,90 @@
+import hashlib
+import StringIO
+
+import Image
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+### Scaled-down copies of uploaded images: people's photo thumbnails and
+### projects' icons.
+###
+### A model lists the derivatives it wants as (field name, width) pairs.
+### We decode the original once and resize that for every width, rather
+### than reading and decoding it again for each. Each derivative is stored
+### under the hash of its contents, so identical outputs (the same icon on
+### two projects, or a photo uploaded again) share one file, and
+### regenerating a derivative that hasn't changed writes nothing.
+###
+### Only rows of the same model and field share a file, though: each
+### field's derivatives get a directory of their own. When Django deletes a
+### FileField's file, it only checks that no other row of that model still
+### has it in that field, so a file shared any more widely could be deleted
+### out from under somebody else.
+###
+### Saving a new original queues a task to make its derivatives; the
+### backfill_image_derivatives command makes them for what's already there.
+
+# Where derivatives are stored, under MEDIA_ROOT.
+DERIVATIVE_DIRECTORY = 'images/derived/'
+
+def scale_to_widths(image_data, widths):
+    """Return a dict mapping each width to PNG data for the image scaled
+    to that width, keeping its aspect ratio."""
+    im = Image.open(StringIO.StringIO(image_data))
+    im.load()
+    w, h = im.size
+    width2data = {}
+    for width in widths:
+        if width in width2data:
+            continue
+        height = max(1, int((h * 1.0 / w) * width))
+        smaller = im.resize((width, height), Image.ANTIALIAS)
+        out = StringIO.StringIO()
+        smaller.save(out, format='PNG')
+        width2data[width] = out.getvalue()
+    return width2data
+
+def get_directory(model, field_name):
+    """Return the directory, under DERIVATIVE_DIRECTORY, for derivatives
+    stored in one field of one model."""
+    return '%s%s_%s/%s/' % (DERIVATIVE_DIRECTORY, model._meta.app_label,
+                            model._meta.object_name.lower(), field_name)
+
+def store(image_data, model, field_name):
+    """Save PNG data for model's field_name under the hash of its
+    contents, unless it's there already, and return its name in storage."""
+    name = (get_directory(model, field_name) +
+            hashlib.sha1(image_data).hexdigest() + '.png')
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(image_data))
+    return name
+
+def derive(instance, source_field_name, derivatives):
+    """Make the derivatives of instance's image in source_field_name, and
+    set them on instance. Returns a dict of the fields that changed, mapped
+    to their new names in storage."""
+    source = getattr(instance, source_field_name)
+    if not source:
+        return {}
+    source.file.seek(0)
+    image_data = source.file.read()
+    width2data = scale_to_widths(image_data,
+                                 [width for field_name, width in derivatives])
+
+    changes = {}
+    for field_name, width in derivatives:
+        name = store(width2data[width], instance.__class__, field_name)
+        if getattr(instance, field_name).name != name:
+            setattr(instance, field_name, name)
+            changes[field_name] = name
+    return changes
+
+def update(instance, source_field_name, derivatives):
+    """Make the derivatives and write them to instance's row, without
+    saving the rest of it (or sending any signals)."""
+    changes = derive(instance, source_field_name, derivatives)
+    if changes:
+        instance.__class__._default_manager.filter(pk=instance.pk).update(
+            **changes)
+    return changes
@@ -0,0 +1,45 @@
+
+from south.db import db
+from django.db import models
+from mysite.base.models import *
+
+class Migration:
+    
+    def forwards(self, orm):
+        
+        # Adding model 'GeocodedAddress'
+        db.create_table('base_geocodedaddress', (
+            ('id', orm['base.geocodedaddress:id']),
+            ('address_hash', orm['base.geocodedaddress:address_hash']),
+            ('address', orm['base.geocodedaddress:address']),
+            ('latitude', orm['base.geocodedaddress:latitude']),
+            ('longitude', orm['base.geocodedaddress:longitude']),
+            ('suggested_zoom_level', orm['base.geocodedaddress:suggested_zoom_level']),
+            ('date_requested', orm['base.geocodedaddress:date_requested']),
+            ('date_geocoded', orm['base.geocodedaddress:date_geocoded']),
+        ))
+        db.send_create_signal('base', ['GeocodedAddress'])
+        
+    
+    
+    def backwards(self, orm):
+        
+        # Deleting model 'GeocodedAddress'
+        db.delete_table('base_geocodedaddress')
+        
+    
+    
+    models = {
+        'base.geocodedaddress': {
+            'address': ('django.db.models.fields.TextField', [], {}),
+            'address_hash': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '40'}),
+            'date_geocoded': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'date_requested': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.utcnow'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'latitude': ('django.db.models.fields.FloatField', [], {'null': 'True'}),
+            'longitude': ('django.db.models.fields.FloatField', [], {'null': 'True'}),
+            'suggested_zoom_level': ('django.db.models.fields.IntegerField', [], {'null': 'True'})
+        }
+    }
+    
+    complete_apps = ['base']
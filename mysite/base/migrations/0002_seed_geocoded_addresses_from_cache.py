@@ -0,0 +1,46 @@
+
+from south.db import db
+from django.db import models
+from mysite.base.models import *
+
+class Migration:
+    
+    no_dry_run = True
+
+    depends_on = (('profile', '0087_add_recommended_bugs_fingerprint'),)
+
+    def forwards(self, orm):
+        "Start the geocode table off with everything the cache knows."
+        import mysite.base.controllers
+        import mysite.profile.models
+        import mysite.profile.tasks
+        addresses = set(mysite.profile.models.Person.objects.filter(
+                location_confirmed=True).exclude(
+                location_display_name='').values_list(
+                'location_display_name', flat=True))
+        copied = mysite.base.controllers.seed_geocoded_addresses_from_cache(
+            list(addresses))
+        print "Copied %d of %d addresses from the geocoding cache." % (
+            copied, len(addresses))
+        # The rest wait for the geocoder.
+        if copied < len(addresses):
+            mysite.profile.tasks.geocode_pending_addresses.delay()
+    
+    def backwards(self, orm):
+        "Write your backwards migration here"
+    
+    
+    models = {
+        'base.geocodedaddress': {
+            'address': ('django.db.models.fields.TextField', [], {}),
+            'address_hash': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '40'}),
+            'date_geocoded': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'date_requested': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.utcnow'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'latitude': ('django.db.models.fields.FloatField', [], {'null': 'True'}),
+            'longitude': ('django.db.models.fields.FloatField', [], {'null': 'True'}),
+            'suggested_zoom_level': ('django.db.models.fields.IntegerField', [], {'null': 'True'})
+        }
+    }
+    
+    complete_apps = ['base']
@@ -1,3 +1,98 @@
+import datetime
+import sha
+
 from django.db import models
 
-# Create your models here.
+import mysite.base.helpers
+
+class GeocodedAddress(models.Model):
+    '''Where the geocoder says an address is. A row gets made the first
+    time somebody asks about an address; the geocode_pending_addresses
+    task (in mysite.profile.tasks) asks the geocoder and fills it in.'''
+    # Addresses can be long, so we look them up by hash.
+    address_hash = models.CharField(max_length=40, unique=True)
+    address = models.TextField()
+    latitude = models.FloatField(null=True)
+    longitude = models.FloatField(null=True)
+    suggested_zoom_level = models.IntegerField(null=True)
+    date_requested = models.DateTimeField(default=datetime.datetime.utcnow)
+    # Null until we've asked the geocoder.
+    date_geocoded = models.DateTimeField(null=True)
+
+    # How long to wait before asking the geocoder about an address it
+    # couldn't find (or that we couldn't ask about) again.
+    RETRY_FAILURES_AFTER = datetime.timedelta(days=1)
+
+    @staticmethod
+    def hash_address(address):
+        return sha.sha(address.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def get_many(addresses):
+        """Return a dict mapping each address to its GeocodedAddress. Makes
+        rows for the ones we've never seen, and returns those as the
+        second value: a list of addresses we have to geocode. That's at
+        most three queries, however many addresses there are."""
+        hash2address = dict([(GeocodedAddress.hash_address(address), address)
+                             for address in addresses])
+        address2geocoded = {}
+        def look_up(address_hashes):
+            for geocoded in GeocodedAddress.objects.filter(
+                address_hash__in=address_hashes):
+                address2geocoded[hash2address[geocoded.address_hash]] = geocoded
+        look_up(hash2address.keys())
+
+        new_hashes = [address_hash
+                      for address_hash, address in hash2address.items()
+                      if address not in address2geocoded]
+        if new_hashes:
+            GeocodedAddress.insert_ignoring_duplicates(
+                [(address_hash, hash2address[address_hash])
+                 for address_hash in new_hashes])
+            look_up(new_hashes)
+        return address2geocoded, [hash2address[address_hash]
+                                  for address_hash in new_hashes]
+
+    @staticmethod
+    def insert_ignoring_duplicates(hashes_and_addresses, **fields):
+        """Make a row for each (address hash, address) in one INSERT,
+        skipping the ones somebody else has made in the meantime. Any
+        fields you pass are set on every row."""
+        fields.setdefault('date_requested', datetime.datetime.utcnow())
+        mysite.base.helpers.insert_ignoring_duplicates(
+            GeocodedAddress, ['address_hash', 'address'] + fields.keys(),
+            [[address_hash, address] + fields.values()
+             for address_hash, address in hashes_and_addresses])
+
+    @staticmethod
+    def get_pending():
+        retry_before = datetime.datetime.utcnow() - (
+            GeocodedAddress.RETRY_FAILURES_AFTER)
+        return GeocodedAddress.objects.filter(
+            models.Q(date_geocoded__isnull=True) |
+            models.Q(latitude__isnull=True, date_geocoded__lt=retry_before))
+
+    def is_pending(self):
+        return self.date_geocoded is None
+
+    def geocode(self):
+        """Ask the geocoder, and remember what it says."""
+        import mysite.base.controllers
+        try:
+            geocoded = mysite.base.controllers._geocode(self.address) or {}
+        except Exception:
+            geocoded = {}
+        self.latitude = geocoded.get('latitude')
+        self.longitude = geocoded.get('longitude')
+        self.suggested_zoom_level = geocoded.get('suggested_zoom_level')
+        self.date_geocoded = datetime.datetime.utcnow()
+        self.save()
+
+    def as_dict(self):
+        """What _geocode would have said, or {} if it couldn't say (or
+        hasn't been asked yet)."""
+        if self.latitude is None:
+            return {}
+        return {'suggested_zoom_level': self.suggested_zoom_level,
+                'latitude': self.latitude,
+                'longitude': self.longitude}
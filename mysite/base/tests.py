@@ -8,13 +8,25 @@ from django.core.servers.basehttp import AdminMediaHandler
 from StringIO import StringIO
 from django.test.client import Client
 import urllib
+import os
+import simplejson
 
+import Image
+
+from django.conf import settings
 from django.core.cache import cache
+import django.db
+from django.core.files.base import ContentFile
 
 import mock
 
 import mysite.base.helpers
 import mysite.base.controllers
+import mysite.base.models
+import mysite.base.geohash
+import mysite.base.image_derivatives
+import mysite.profile.models
+import mysite.profile.tasks
 import mysite.base.decorators
 import mysite.search.models
 import mysite.base.templatetags.base_extras
@@ -51,6 +63,10 @@ class TwillTests(django.test.TestCase):
     def setUp(self):
         self.real_get = django.core.cache.cache.get
         django.core.cache.cache.get = mock_get
+        # The test database starts every HitCountDependency over at version
+        # zero, so counts this process remembers from other tests would
+        # look current.
+        mysite.search.models.HitCountCache.recently_used.clear()
         from django.conf import settings
         self.old_dbe = settings.DEBUG_PROPAGATE_EXCEPTIONS
         settings.DEBUG_PROPAGATE_EXCEPTIONS = True
@@ -155,6 +171,84 @@ class GeocoderCanCache(django.test.TestCase):
         except AssertionError:
             raise AssertionError, "Geocoded location in json was not cached; it now equals " + json
 
+class GeocodingWithoutWaiting(TwillTests):
+
+    unicode_address = u'Bark\xe5ker, T\xf8nsberg, Vestfold, Norway'
+
+    @mock.patch('mysite.profile.tasks.geocode_pending_addresses.delay')
+    @mock.patch('mysite.base.controllers._geocode')
+    def test(self, mock_geocoder, mock_delay):
+        mock_geocoder.return_value = {'latitude': 59.3, 'longitude': 10.4,
+                                      'suggested_zoom_level': 6}
+        addresses = [self.unicode_address, 'Inaccessible Island']
+
+        # The first time, we don't know, and we don't wait to find out...
+        self.assertEqual(
+            mysite.base.controllers.geocoding_without_waiting(addresses),
+            {self.unicode_address: {'is_inaccessible': False},
+             'Inaccessible Island': {'is_inaccessible': True}})
+        self.assertFalse(mock_geocoder.called)
+        self.assert_(mock_delay.called)
+
+        # ...but the background task does find out...
+        mysite.profile.tasks.geocode_pending_addresses()
+        self.assertEqual(mock_geocoder.call_count, 2)
+
+        # ...so the next time, we know.
+        mock_delay.reset_mock()
+        address2geocoded = mysite.base.controllers.geocoding_without_waiting(
+            addresses)
+        self.assertEqual(address2geocoded[self.unicode_address],
+                         {'is_inaccessible': False, 'latitude': 59.3,
+                          'longitude': 10.4, 'suggested_zoom_level': 6})
+        self.assertFalse(mock_delay.called)
+
+        # There's nothing left to geocode.
+        mysite.profile.tasks.geocode_pending_addresses()
+        self.assertEqual(mock_geocoder.call_count, 2)
+
+    @mock.patch('mysite.profile.tasks.geocode_pending_addresses.delay')
+    def test_new_addresses_are_made_all_at_once(self, mock_delay):
+        GeocodedAddress = mysite.base.models.GeocodedAddress
+        GeocodedAddress.get_many([u'Oslo, Norway'])
+        addresses = [u'Oslo, Norway', u'Bergen, Norway', self.unicode_address,
+                     u'Troms\xf8, Norway']
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        try:
+            django.db.reset_queries()
+            address2geocoded, new_addresses = GeocodedAddress.get_many(
+                addresses)
+            self.assertEqual(len(django.db.connection.queries), 3)
+        finally:
+            settings.DEBUG = old_debug
+        self.assertEqual(sorted(address2geocoded.keys()), sorted(addresses))
+        self.assertEqual(sorted(new_addresses), sorted(addresses[1:]))
+        self.assertEqual(GeocodedAddress.objects.count(), 4)
+
+    @mock.patch('mysite.base.controllers._geocode')
+    @mock.patch('mysite.base.controllers.cache.get_many')
+    def test_seed_from_cache(self, mock_get_many, mock_geocoder):
+        mock_get_many.return_value = {
+            mysite.base.controllers.address2cache_key_name(
+                self.unicode_address): simplejson.dumps(
+                {'is_inaccessible': False, 'latitude': 59.3,
+                 'longitude': 10.4, 'suggested_zoom_level': 6})}
+        self.assertEqual(
+            mysite.base.controllers.seed_geocoded_addresses_from_cache(
+                [self.unicode_address, u'Nowhere in particular']), 1)
+
+        address2geocoded = mysite.base.controllers.geocoding_without_waiting(
+            [self.unicode_address])
+        self.assertEqual(address2geocoded[self.unicode_address],
+                         {'is_inaccessible': False, 'latitude': 59.3,
+                          'longitude': 10.4, 'suggested_zoom_level': 6})
+        self.assertFalse(mock_geocoder.called)
+        # What the cache didn't know still waits for the geocoder.
+        self.assertEqual([geocoded.address for geocoded in
+                          mysite.base.models.GeocodedAddress.get_pending()],
+                         [u'Nowhere in particular'])
+
 class TestUnicodifyDecorator(TwillTests):
     def test(self):
         utf8_data = u'\xc3\xa9'.encode('utf-8') # &eacute;
@@ -234,6 +328,28 @@ class CacheMethod(TwillTests):
         # Step 3: See if the cache has it now
         mock_cache.set.assert_called_with('doodles', '{"value": "1"}', 86400 * 10)
 
+class LRUCacheForgetsLeastRecentlyUsed(TwillTests):
+
+    def test_lru_cache(self):
+        lru = mysite.base.helpers.LRUCache(max_size=2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1) # Now 'b' is the oldest.
+        lru.set('c', 3)
+        self.assertEqual(len(lru), 2)
+        self.assertEqual(lru.get('b'), None)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('c'), 3)
+
+        lru.set('a', 4) # Replacing a value makes it the newest, too.
+        lru.set('d', 5)
+        self.assertEqual(lru.get('c', 'gone'), 'gone')
+        self.assertEqual(lru.get('a'), 4)
+
+        lru.clear()
+        self.assertEqual(len(lru), 0)
+        self.assertEqual(lru.get('a'), None)
+
 class EnhanceNextWithNewUserMetadata(TwillTests):
     def test_easy(self):
         sample_input = '/'
@@ -253,4 +369,81 @@ class EnhanceNextWithNewUserMetadata(TwillTests):
         got = mysite.base.templatetags.base_extras.enhance_next_to_annotate_it_with_newuser_is_true(sample_input)
         self.assertEqual(wanted, got)
 
+class Geohash(django.test.TestCase):
+    def test_encode(self):
+        # The example from http://en.wikipedia.org/wiki/Geohash
+        self.assertEqual(mysite.base.geohash.encode(57.64911, 10.40744, 11),
+                         'u4pruydqqvj')
+
+    def test_decode_bounds(self):
+        self.assertEqual(mysite.base.geohash.decode_bounds('u'),
+                         (45.0, 0.0, 90.0, 45.0))
+        south, west, north, east = mysite.base.geohash.decode_bounds(
+            'u4pruydqqvj')
+        self.assert_(south <= 57.64911 <= north)
+        self.assert_(west <= 10.40744 <= east)
+
+    def test_prefixes_are_the_cells_it_is_in(self):
+        geohash = mysite.base.geohash.encode(-33.9, 151.2, 8)
+        for precision in range(1, 8):
+            self.assertEqual(geohash[:precision], mysite.base.geohash.encode(
+                    -33.9, 151.2, precision))
+
+class ImageDerivatives(TwillTests):
+    def icon_data(self, filename):
+        return open(os.path.join(os.path.dirname(__file__), '..', 'static',
+                                 filename)).read()
+
+    def test_every_size_from_one_decode(self):
+        image_data = self.icon_data(
+            'images/icons/test-project-icon-64px-by-18px.png')
+        real_open = Image.open
+        opened = []
+        def counting_open(*args, **kwargs):
+            opened.append(args)
+            return real_open(*args, **kwargs)
+        Image.open = counting_open
+        try:
+            width2data = mysite.base.image_derivatives.scale_to_widths(
+                image_data, [64, 40, 20, 40])
+        finally:
+            Image.open = real_open
+        self.assertEqual(len(opened), 1)
+        self.assertEqual(sorted(width2data.keys()), [20, 40, 64])
+        smaller = Image.open(StringIO(width2data[40]))
+        self.assertEqual(smaller.size, (40, 11))
+
+    def test_identical_icons_share_files(self):
+        image_data = self.icon_data('sample-photo.png')
+        projects = []
+        for name in ('Twin', 'Other twin'):
+            project = mysite.search.models.Project.create_dummy(name=name)
+            project.icon_raw.save('', ContentFile(image_data))
+            project.update_scaled_icons_from_self_icon()
+            projects.append(
+                mysite.search.models.Project.objects.get(id=project.id))
+        twin, other_twin = projects
+        self.assertEqual(twin.icon_smaller_for_badge.width, 40)
+        self.assertEqual(twin.icon_for_search_result.width, 20)
+        for field_name, width in mysite.search.models.Project.ICON_DERIVATIVES:
+            self.assertEqual(getattr(twin, field_name).name,
+                             getattr(other_twin, field_name).name)
+
+        # Nothing changed, so there's nothing to write.
+        self.assertEqual(mysite.base.image_derivatives.update(
+                twin, 'icon_raw',
+                mysite.search.models.Project.ICON_DERIVATIVES), {})
+
+    def test_fields_keep_their_own_files(self):
+        image_data = self.icon_data('sample-photo.png')
+        project_icon = mysite.base.image_derivatives.store(
+            image_data, mysite.search.models.Project, 'icon_smaller_for_badge')
+        photo_thumbnail = mysite.base.image_derivatives.store(
+            image_data, mysite.profile.models.Person, 'photo_thumbnail')
+        self.assertNotEqual(project_icon, photo_thumbnail)
+        self.assert_(project_icon.startswith(
+                'images/derived/search_project/icon_smaller_for_badge/'))
+        self.assert_(photo_thumbnail.startswith(
+                'images/derived/profile_person/photo_thumbnail/'))
+
 # vim: set ai et ts=4 sw=4 nu:
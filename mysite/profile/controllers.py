@@ -3,8 +3,11 @@ import sha
 from itertools import izip, cycle, islice
 
 import pygeoip
+import simplejson
 
 from django.conf import settings
+import django.core.cache
+from django.db.models import Min, Max
 
 import mysite.search.controllers
 import mysite.search.models
@@ -39,51 +42,65 @@ class RecommendBugs(object):
         return prefix + '_' + sha.sha(repr(suffix_input)).hexdigest()
 
     def recommend(self):
+        bug_ids = self._recommend_as_list()
+        id2bug = mysite.search.models.Bug.all_bugs.in_bulk(bug_ids)
         ret = []
-        for bug_id in self._recommend_as_list():
-            try:
-                bug = mysite.search.models.Bug.all_bugs.get(pk=bug_id)
-            except mysite.search.models.Bug.DoesNotExist:
+        for bug_id in bug_ids:
+            if bug_id not in id2bug:
                 logging.info("WTF, bug missing. Whatever.")
                 continue
-            ret.append(bug)
+            ret.append(id2bug[bug_id])
         return ret
 
     @mysite.base.decorators.cache_method('get_cache_key')
     def _recommend_as_list(self):
         return list(self._recommend_as_generator())
+
+    def get_candidate_ids(self, term):
+        """Return the ids of the first n bugs this term finds, best first.
+
+        Round-robin never needs more than n from any one term: every bug
+        it takes from a term's list, it either recommends or skips
+        because it already recommended it, and it stops after n."""
+        bugs = mysite.search.controllers.order_bugs(
+            mysite.search.controllers.Query(terms=[term]).get_bugs_unordered())
+        return list(bugs.values_list('id', flat=True)[:self.n])
     
     def _recommend_as_generator(self):
         '''Input: A list of terms, like ['Python', 'C#'], designed for use in the search engine.
 
-        I am a generator that yields Bug objects.
+        I am a generator that yields Bug ids.
         I yield up to n Bugs in a round-robin fashion.
         I don't yield a Bug more than once.'''
         
         distinct_ids = set()
 
-        lists_of_bugs = [
-            mysite.search.controllers.order_bugs(
-                mysite.search.controllers.Query(terms=[t]).get_bugs_unordered())
-            for t in self.terms]
+        lists_of_bug_ids = [self.get_candidate_ids(t) for t in self.terms]
         number_emitted = 0
 
-        for bug in roundrobin(*lists_of_bugs):
+        for bug_id in roundrobin(*lists_of_bug_ids):
             if number_emitted >= self.n:
                 raise StopIteration
-            if bug.id in distinct_ids:
+            if bug_id in distinct_ids:
                 continue
             # otherwise...
             number_emitted += 1
-            distinct_ids.add(bug.id)
-            yield bug.id
+            distinct_ids.add(bug_id)
+            yield bug_id
 
 class PeopleMatcher(object):
-    def get_cache_key(self, *args, **kwargs):
-        keys = (mysite.search.models.Epoch.get_for_model(
-            mysite.profile.models.Link_Person_Tag),
-                args)
-        return sha.sha(repr(keys)).hexdigest()
+    '''Who lists a tag, by (tag type, lowercased tag text), sorted by
+    name. Each of those has its own cache entry; when a Link_Person_Tag
+    comes or goes, update_link_person_tag_cache refreshes only the entry
+    for its tag, so everybody else's (the mentor lists on project pages,
+    say) stay cached.'''
+
+    # As long as cache_method keeps what it caches.
+    CACHE_TIMEOUT = 864000
+
+    def get_cache_key(self, property, value):
+        key = (unicode(property), unicode(value).lower())
+        return 'people_matching_' + sha.sha(repr(key)).hexdigest()
 
     def people_matching(self, property, value):
         return mysite.profile.models.Person.objects.filter(
@@ -91,14 +108,44 @@ class PeopleMatcher(object):
 
     @mysite.base.decorators.cache_method('get_cache_key')
     def _people_matching_ids(self, property, value):
-        links = mysite.profile.models.Link_Person_Tag.objects.filter(
-            tag__tag_type__name=property, tag__text__iexact=value)
-        peeps = [l.person for l in links]
-        sorted_peeps = sorted(set(peeps), key = lambda thing: (thing.user.first_name, thing.user.last_name))
-        return [person.id for person in sorted_peeps]
+        return self.get_ids_from_database(property, value)
+
+    def get_ids_from_database(self, property, value):
+        person_ids = mysite.profile.models.Link_Person_Tag.objects.filter(
+            tag__tag_type__name=property, tag__text__iexact=value).order_by(
+            'person__user__first_name', 'person__user__last_name',
+            'person').values_list('person', flat=True)
+        # Somebody can list Python and python both.
+        seen = set()
+        ret = []
+        for person_id in person_ids:
+            if person_id not in seen:
+                seen.add(person_id)
+                ret.append(person_id)
+        return ret
+
+    def refresh(self, property, value):
+        """Look up who lists this tag again, and cache that."""
+        django.core.cache.cache.set(
+            self.get_cache_key(property, value),
+            simplejson.dumps({'value': self.get_ids_from_database(
+                        property, value)}),
+            self.CACHE_TIMEOUT)
 
 _pm = PeopleMatcher()
 people_matching = _pm.people_matching
+refresh_people_matching = _pm.refresh
+
+def get_person_id_chunks(chunk_size):
+    """Return (start, stop) pk ranges that between them cover every
+    Person, in order."""
+    bounds = mysite.profile.models.Person.objects.aggregate(
+        Min('id'), Max('id'))
+    if bounds['id__min'] is None:
+        return []
+    return [(start, start + chunk_size)
+            for start in range(bounds['id__min'], bounds['id__max'] + 1,
+                               chunk_size)]
 
 geoip_database = None
 def get_geoip_guess_for_ip(ip_as_string):
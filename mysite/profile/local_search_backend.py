@@ -0,0 +1,302 @@
+import cPickle as pickle
+import fcntl
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+
+from haystack.backends import BaseSearchBackend, BaseSearchQuery
+from haystack.models import SearchResult
+
+### A Haystack backend that keeps the index in memory, for when running
+### Solr is more trouble than it's worth: a small deployment, a laptop, a
+### benchmark run. Turn it on with
+###
+###     HAYSTACK_SEARCH_ENGINE = 'mysite.profile.local_search'
+###     LOCAL_SEARCH_INDEX_PATH = '/some/where/people.index'
+###
+### People search only ever asks for exact matches on PersonIndex's
+### *_lowercase_exact fields, so that's all this does: for each such field,
+### a dict from value to the set of documents that have it. Filters can be
+### ANDed, ORed and negated; anything but an exact match (or __in) raises
+### NotImplementedError.
+###
+### Every change gets written to LOCAL_SEARCH_INDEX_PATH, under a lock, so
+### the web processes and the celery workers all see the same index. Each
+### process notices when another one wrote the file, and reads it back in.
+
+BACKEND_NAME = 'local'
+
+DEFAULT_INDEX_PATH = os.path.join(tempfile.gettempdir(),
+                                  'openhatch_local_search.index')
+
+def get_identifier(obj_or_string):
+    if isinstance(obj_or_string, basestring):
+        return obj_or_string
+    return u'%s.%s.%s' % (obj_or_string._meta.app_label,
+                          obj_or_string._meta.module_name,
+                          obj_or_string._get_pk_val())
+
+def is_indexed_field(field_name):
+    return field_name.endswith('_exact')
+
+def as_values(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return list(value)
+    return [value]
+
+class ExactMatchIndex(object):
+    '''Documents, and for each field, which documents have which values.'''
+
+    def __init__(self):
+        self.documents = {} # identifier -> {field name: [values]}
+        self.field2value2identifiers = {}
+
+    def add(self, identifier, fields):
+        self.remove(identifier)
+        document = {}
+        for field_name, value in fields.items():
+            if not is_indexed_field(field_name):
+                continue
+            values = as_values(value)
+            document[field_name] = values
+            value2identifiers = self.field2value2identifiers.setdefault(
+                field_name, {})
+            for value in values:
+                value2identifiers.setdefault(value, set()).add(identifier)
+        self.documents[identifier] = document
+
+    def remove(self, identifier):
+        document = self.documents.pop(identifier, None)
+        if document is None:
+            return
+        for field_name, values in document.items():
+            value2identifiers = self.field2value2identifiers[field_name]
+            for value in values:
+                identifiers = value2identifiers.get(value)
+                if identifiers is None:
+                    continue
+                identifiers.discard(identifier)
+                if not identifiers:
+                    del value2identifiers[value]
+
+    def lookup(self, field_name, value):
+        return self.field2value2identifiers.get(field_name, {}).get(
+            value, set())
+
+    def everything(self):
+        return set(self.documents)
+
+    def evaluate(self, node):
+        """Return the set of identifiers matching a tree of Haystack
+        filters. An empty tree matches everything."""
+        if node is None or not node.children:
+            matches = self.everything()
+        else:
+            matches = None
+            for child in node.children:
+                if hasattr(child, 'children'):
+                    child_matches = self.evaluate(child)
+                else:
+                    child_matches = self.evaluate_filter(child)
+                if matches is None:
+                    matches = child_matches
+                elif getattr(node, 'connector', 'AND') == 'OR':
+                    matches = matches | child_matches
+                else:
+                    matches = matches & child_matches
+        if getattr(node, 'negated', False):
+            matches = self.everything() - matches
+        return matches
+
+    def evaluate_filter(self, leaf):
+        if isinstance(leaf, tuple):
+            expression, value = leaf
+            parts = expression.split('__')
+            if len(parts) > 1 and parts[-1] in ('exact', 'in'):
+                field_name, filter_type = '__'.join(parts[:-1]), parts[-1]
+            else:
+                field_name, filter_type = expression, 'exact'
+        else:
+            # Older Haystacks hand us QueryFilter objects.
+            field_name, filter_type, value = (
+                leaf.field, leaf.filter_type, leaf.value)
+
+        if not is_indexed_field(field_name):
+            raise NotImplementedError, (
+                "The local search backend only indexes *_exact fields, "
+                "not %s." % field_name)
+        if filter_type == 'exact':
+            return set(self.lookup(field_name, value))
+        if filter_type == 'in':
+            matches = set()
+            for one_value in value:
+                matches.update(self.lookup(field_name, one_value))
+            return matches
+        raise NotImplementedError, (
+            "The local search backend only does exact matches, not %s." %
+            filter_type)
+
+class IndexFile(object):
+    '''An ExactMatchIndex, kept in sync with a file on disk.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.index = ExactMatchIndex()
+        self.loaded_version = None
+
+    def get_version(self):
+        # Every write renames a new file into place, so the inode changes
+        # even when two writes land within the mtime's resolution.
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime)
+
+    def reload_if_stale(self):
+        version = self.get_version()
+        if version == self.loaded_version:
+            return
+        if version is None:
+            self.index = ExactMatchIndex()
+        else:
+            in_file = open(self.path, 'rb')
+            try:
+                self.index = pickle.load(in_file)
+            finally:
+                in_file.close()
+        self.loaded_version = version
+
+    def evaluate(self, node):
+        """Return a dict mapping the identifier of each document that
+        matches a tree of filters to its fields; see
+        ExactMatchIndex.evaluate."""
+        self.lock.acquire()
+        try:
+            self.reload_if_stale()
+            documents = self.index.documents
+            return dict([(identifier, dict(documents[identifier]))
+                         for identifier in self.index.evaluate(node)])
+        finally:
+            self.lock.release()
+
+    def change(self, function):
+        """Call function with the index, then write the index out. Other
+        processes wait while we do."""
+        self.lock.acquire()
+        lock_file = open(self.path + '.lock', 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.reload_if_stale()
+            function(self.index)
+            temporary_path = self.path + '.tmp'
+            out = open(temporary_path, 'wb')
+            try:
+                pickle.dump(self.index, out, pickle.HIGHEST_PROTOCOL)
+            finally:
+                out.close()
+            os.rename(temporary_path, self.path)
+            self.loaded_version = self.get_version()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+            self.lock.release()
+
+# One per path, so every backend in this process shares what it's read.
+path2index_file = {}
+path2index_file_lock = threading.Lock()
+
+def get_index_file(path):
+    path2index_file_lock.acquire()
+    try:
+        if path not in path2index_file:
+            path2index_file[path] = IndexFile(path)
+        return path2index_file[path]
+    finally:
+        path2index_file_lock.release()
+
+class SearchBackend(BaseSearchBackend):
+    def __init__(self, site=None, path=None):
+        super(SearchBackend, self).__init__(site)
+        if path is None:
+            path = getattr(settings, 'LOCAL_SEARCH_INDEX_PATH',
+                           DEFAULT_INDEX_PATH)
+        self.index_file = get_index_file(path)
+
+    def update(self, index, iterable, commit=True):
+        prepared = [(get_identifier(obj), index.prepare(obj))
+                    for obj in iterable]
+        def add_all(exact_match_index):
+            for identifier, fields in prepared:
+                exact_match_index.add(identifier, fields)
+        self.index_file.change(add_all)
+
+    def remove(self, obj_or_string, commit=True):
+        identifier = get_identifier(obj_or_string)
+        self.index_file.change(lambda index: index.remove(identifier))
+
+    def clear(self, models=[], commit=True):
+        prefixes = [u'%s.%s.' % (model._meta.app_label,
+                                 model._meta.module_name)
+                    for model in models]
+        def clear(index):
+            for identifier in list(index.documents):
+                if not prefixes or [prefix for prefix in prefixes
+                                    if identifier.startswith(prefix)]:
+                    index.remove(identifier)
+        self.index_file.change(clear)
+
+    def search(self, query_string, sort_by=None, start_offset=0,
+               end_offset=None, **kwargs):
+        """query_string is the tree of filters SearchQuery.build_query
+        hands us, not a string."""
+        matches = self.index_file.evaluate(query_string)
+        results = []
+        for identifier in sorted(matches, key=identifier2sort_key)[
+            start_offset:end_offset]:
+            app_label, model_name, pk = identifier.split('.')
+            # Hand back the fields, the way Solr hands back stored ones.
+            fields = dict([(str(field_name), values) for field_name, values
+                           in matches[identifier].items()])
+            results.append(SearchResult(app_label, model_name, pk, 1.0,
+                                        **fields))
+        return {'results': results, 'hits': len(matches)}
+
+    def prep_value(self, value):
+        return value
+
+    def more_like_this(self, model_instance, additional_query_string=None,
+                       **kwargs):
+        raise NotImplementedError, (
+            "The local search backend doesn't do more_like_this.")
+
+def identifier2sort_key(identifier):
+    app_label, model_name, pk = identifier.split('.')
+    return (app_label, model_name, int(pk))
+
+class SearchQuery(BaseSearchQuery):
+    def __init__(self, site=None, backend=None):
+        super(SearchQuery, self).__init__(site, backend)
+        if backend is not None:
+            self.backend = backend
+        else:
+            self.backend = SearchBackend(site=site)
+
+    def build_query(self):
+        return self.query_filter
+
+    def clean(self, query_fragment):
+        return query_fragment
+
+    def run(self, spelling_query=None):
+        kwargs = {'start_offset': self.start_offset}
+        if self.end_offset is not None:
+            kwargs['end_offset'] = self.end_offset
+        results = self.backend.search(self.build_query(), **kwargs)
+        self._results = results.get('results', [])
+        self._hit_count = results.get('hits', 0)
@@ -0,0 +1,64 @@
+import logging
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+import mysite.base.image_derivatives
+import mysite.profile.models
+import mysite.search.models
+
+### Make the photo thumbnails and project icons for images that were
+### uploaded before we had the derivative pipeline, or whose derivatives
+### went missing. Derivatives are stored by content hash, so running this
+### again only writes the ones that come out different. (That includes
+### rows still pointing into the shared directory derivatives used before
+### each field got one of its own; this moves them over.)
+
+def get_kinds():
+    """Return (model, source field, derivatives) for each kind of image."""
+    return [(mysite.profile.models.Person, 'photo',
+             mysite.profile.models.Person.PHOTO_DERIVATIVES),
+            (mysite.search.models.Project, 'icon_raw',
+             mysite.search.models.Project.ICON_DERIVATIVES)]
+
+def backfill(model, source_field_name, derivatives, missing_only=False):
+    """Make the derivatives for every row with an image, in primary key
+    order. Returns how many rows we looked at, how many changed, and how
+    many had images we couldn't read."""
+    instances = model._default_manager.exclude(
+        **{source_field_name: ''}).exclude(
+        **{source_field_name + '__isnull': True}).order_by('pk')
+    n_seen = n_changed = n_failed = 0
+    for instance in instances.iterator():
+        if missing_only and all([getattr(instance, field_name)
+                                 for field_name, width in derivatives]):
+            continue
+        n_seen += 1
+        try:
+            changes = mysite.base.image_derivatives.update(
+                instance, source_field_name, derivatives)
+        except (IOError, OSError), e:
+            logging.warning("Couldn't make derivatives of %s %d: %s" % (
+                model.__name__, instance.pk, e))
+            n_failed += 1
+            continue
+        if changes:
+            n_changed += 1
+    return n_seen, n_changed, n_failed
+
+class Command(NoArgsCommand):
+    help = "Make the scaled-down copies of every photo and project icon."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--missing-only', action='store_true', default=False,
+                    help="Skip images that already have all their "
+                    "derivatives."),
+    )
+
+    def handle_noargs(self, **options):
+        for model, source_field_name, derivatives in get_kinds():
+            n_seen, n_changed, n_failed = backfill(
+                model, source_field_name, derivatives,
+                missing_only=options['missing_only'])
+            print "%s: looked at %d, updated %d, couldn't read %d." % (
+                model.__name__, n_seen, n_changed, n_failed)
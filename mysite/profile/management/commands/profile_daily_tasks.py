@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 
+import mysite.profile.people_map
 import mysite.profile.tasks
 
 class Command(BaseCommand):
@@ -8,4 +9,9 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         # Garbage collect forwarders
         mysite.profile.tasks.GarbageCollectForwarders.apply()
+        # The people map's cell counts get updated as people move; this
+        # corrects any that have drifted.
+        mysite.profile.people_map.rebuild()
+        # Which tags and projects the people page suggests searching for
+        mysite.profile.tasks.refresh_popularity_rankings()
 
@@ -3,6 +3,7 @@ import logging
 
 from django.core.management.base import BaseCommand
 
+import mysite.profile.recommendation_cache
 import mysite.profile.tasks
 import mysite.search.models
 import mysite.search.tasks
@@ -22,8 +23,10 @@ class Command(BaseCommand):
     help = "Run this once hourly for the OpenHatch profile app."
 
     def handle(self, *args, **options):
-        mysite.profile.tasks.sync_bug_epoch_from_model_then_fill_recommended_bugs_cache()
-        mysite.profile.tasks.fill_recommended_bugs_cache()
+        mysite.profile.tasks.sync_bug_epoch_from_model()
+        # Fill the cache here rather than in a celery worker: a worker
+        # can't fork the pool of processes that fill() spreads people over.
+        mysite.profile.recommendation_cache.fill()
 
         # Every 4 hours, clear search cache
         if (datetime.datetime.utcnow().hour % 4) == 0:
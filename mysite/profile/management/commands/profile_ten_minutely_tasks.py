@@ -5,9 +5,18 @@ from django.core.management.base import BaseCommand
 
 import staticgenerator
 
+import mysite.profile.reindex_queue
+import mysite.profile.tasks
+
 class Command(BaseCommand):
     help = "Run this once every 10 minutes for the OpenHatch profile app."
 
     def handle(self, *args, **options):
         # Every 10 minutes, refresh /+projects/
         staticgenerator.quick_publish('/+projects/')
+        # Flushes normally get scheduled as people ask to be re-indexed;
+        # this catches anyone whose flush got lost.
+        mysite.profile.reindex_queue.flush()
+        # Likewise for geocoding, and this retries the addresses the
+        # geocoder couldn't find last time.
+        mysite.profile.tasks.geocode_pending_addresses()
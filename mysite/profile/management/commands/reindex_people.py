@@ -0,0 +1,109 @@
+import logging
+import os
+from optparse import make_option
+
+import simplejson
+
+import django.db
+from django.core.management.base import NoArgsCommand, CommandError
+
+import mysite.profile.controllers
+import mysite.profile.models
+import mysite.profile.search_indexes
+
+### Rebuild the people search index from scratch.
+###
+### People get split into chunks by primary key. A pool of processes takes
+### a chunk at a time; each chunk costs a handful of queries (see
+### mysite.profile.search_indexes.prefetch_index_data) and one update to
+### the search backend. As chunks finish, we write down which ones are
+### done in a checkpoint file, so if the run dies, --resume picks up where
+### it left off.
+
+def reindex_chunk(chunk):
+    start, stop = chunk
+    Person = mysite.profile.models.Person
+    people = list(Person.objects.filter(id__gte=start, id__lt=stop))
+    if people:
+        mysite.profile.search_indexes.prefetch_index_data(people)
+        index = mysite.profile.search_indexes.PersonIndex(Person)
+        index.backend.update(index, people)
+    return chunk, len(people)
+
+def read_checkpoint(path, chunk_size):
+    """Return the set of chunk starts an earlier run finished."""
+    if not os.path.exists(path):
+        return set()
+    checkpoint = simplejson.load(open(path))
+    if checkpoint['chunk_size'] != chunk_size:
+        raise CommandError, (
+            "%s was written with --chunk-size=%d; resume with that." % (
+                path, checkpoint['chunk_size']))
+    return set(checkpoint['done'])
+
+def write_checkpoint(path, chunk_size, done):
+    # Write it all out, then move it into place, so that dying halfway
+    # through leaves the old checkpoint rather than half a new one.
+    temporary_path = path + '.tmp'
+    out = open(temporary_path, 'w')
+    simplejson.dump({'chunk_size': chunk_size, 'done': sorted(done)}, out)
+    out.close()
+    os.rename(temporary_path, path)
+
+class Command(NoArgsCommand):
+    help = "Re-index every Person for the people search, in parallel."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--chunk-size', type='int', default=500,
+                    help='How many primary keys each chunk covers.'),
+        make_option('--processes', type='int', default=4,
+                    help='How many chunks to work on at once.'),
+        make_option('--checkpoint', default='reindex_people.checkpoint',
+                    help='Where to write down which chunks are done.'),
+        make_option('--resume', action='store_true', default=False,
+                    help='Skip the chunks the checkpoint says are done.'),
+    )
+
+    def handle_noargs(self, **options):
+        chunk_size = options['chunk_size']
+        checkpoint = options['checkpoint']
+        if options['resume']:
+            done = read_checkpoint(checkpoint, chunk_size)
+        else:
+            done = set()
+        chunks = [chunk for chunk in mysite.profile.controllers.get_person_id_chunks(chunk_size)
+                  if chunk[0] not in done]
+        logging.info("Re-indexing people: %d chunks to go, %d done." % (
+            len(chunks), len(done)))
+
+        if options['processes'] > 1:
+            import multiprocessing
+            # Each worker has to open its own database connection; one we
+            # already had open would end up shared between them.
+            django.db.connection.close()
+            pool = multiprocessing.Pool(options['processes'])
+            results = pool.imap_unordered(reindex_chunk, chunks)
+        else:
+            pool = None
+            results = (reindex_chunk(chunk) for chunk in chunks)
+
+        n_people = 0
+        try:
+            for chunk, n in results:
+                done.add(chunk[0])
+                n_people += n
+                write_checkpoint(checkpoint, chunk_size, done)
+                logging.info("Re-indexed people %d through %d." % (
+                    chunk[0], chunk[1] - 1))
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        # All done; the next run starts over.
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        print "Re-indexed %d people." % n_people
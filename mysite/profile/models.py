@@ -1,10 +1,12 @@
 # vim: set ai ts=4 sw=4 et:
 
-from mysite.search.models import Project, Bug, get_image_data_scaled
+from mysite.search.models import Project, Bug
 import mysite.customs.models
 from mysite.customs import ohloh
 import mysite.profile.controllers
 import mysite.base.unicode_sanity
+import mysite.base.models
+import mysite.base.image_derivatives
 
 import django
 from django.db import models
@@ -15,7 +17,7 @@ from django.contrib.auth import SESSION_KEY, BACKEND_SESSION_KEY, load_backend
 from django.core.urlresolvers import reverse
 from django.core.cache import cache
 import django.db.models.query
-from django.db.models import Q
+from django.db.models import Q, Count
 
 import datetime
 import sys
@@ -119,9 +121,8 @@ class Person(models.Model):
         return Person.objects.filter(Q(location_confirmed=False) | Q(location_display_name=''))
 
     def reindex_for_person_search(self):
-        import mysite.profile.tasks
-        task = mysite.profile.tasks.ReindexPerson()
-        task.delay(person_id=self.id)
+        import mysite.profile.reindex_queue
+        mysite.profile.reindex_queue.request_reindex(self.id)
 
     def get_public_location_or_default(self):
         if self.location_is_public():
@@ -221,30 +222,29 @@ class Person(models.Model):
     @staticmethod
     def only_terms_with_results(terms):
         # Remove terms whose hit counts are zero.
-        terms_with_results = [] 
-        for term in terms:
-            query = mysite.search.controllers.Query(terms=[term])
-            hit_count = query.get_or_create_cached_hit_count()
-            if hit_count != 0:
-                terms_with_results.append(term)
-        return terms_with_results
+        return mysite.search.controllers.get_terms_with_results(terms)
 
     def get_recommended_search_terms(self):
         # {{{
         terms = []
         
         # Add terms based on languages in citations
-        citations = self.get_published_citations_flat()
+        citations = Citation.untrashed.filter(
+            portfolio_entry__person=self,
+            portfolio_entry__is_published=True, is_published=True)
         for c in citations:
             terms.extend(c.get_languages_as_list())
 
         # Add terms based on projects in citations
         terms.extend(
-                [pfe.project.name for pfe in self.get_published_portfolio_entries()
-                    if pfe.project.name and pfe.project.name.strip()])
+                [name for name in self.get_published_portfolio_entries(
+                    ).values_list('project__name', flat=True)
+                    if name and name.strip()])
 
         # Add terms based on tags 
-        terms.extend([tag.text for tag in self.get_tags_for_recommendations()])
+        terms.extend(Link_Person_Tag.objects.filter(person=self).exclude(
+                tag__tag_type__name='understands_not').values_list(
+                'tag__text', flat=True))
 
         # Remove duplicates
         terms = sorted(set(terms), key=lambda s: s.lower())
@@ -317,39 +317,30 @@ class Person(models.Model):
     def get_full_name_or_username(self):
         return self.get_full_name() or self.user.username
 
+    # The thumbnails we make of a person's photo, and how wide they are.
+    PHOTO_DERIVATIVES = (('photo_thumbnail', 40),
+                         ('photo_thumbnail_30px_wide', 30),
+                         ('photo_thumbnail_20px_wide', 20))
+
     def generate_thumbnail_from_photo(self):
-        if self.photo:
-            width = 40
-            self.photo.file.seek(0) 
-            scaled_down = get_image_data_scaled(self.photo.file.read(), width)
-            self.photo_thumbnail.save('', ContentFile(scaled_down))
-
-            width = 30
-            self.photo.file.seek(0) 
-            scaled_down = get_image_data_scaled(self.photo.file.read(), width)
-            self.photo_thumbnail_30px_wide.save('', ContentFile(scaled_down))
-
-            width = 20
-            self.photo.file.seek(0) 
-            scaled_down = get_image_data_scaled(self.photo.file.read(), width)
-            self.photo_thumbnail_20px_wide.save('', ContentFile(scaled_down))
+        mysite.base.image_derivatives.update(self, 'photo',
+                                             Person.PHOTO_DERIVATIVES)
 
     def get_collaborators_for_landing_page(self, n=9):
-        projects = set([e.project for e in self.get_published_portfolio_entries()])
-        infinity = 10000
-        collaborator_lists = []
-        for project in projects:
-            people = project.get_n_other_contributors_than(n=infinity, person=self)
-            people = random.sample(people, min(n, len(people)))
-            collaborator_lists.append(people)
-        round_robin = mysite.profile.controllers.roundrobin(*collaborator_lists)
-        collaborators = set() 
-        while len(collaborators) < n:
+        project_ids = set(self.get_published_portfolio_entries().values_list(
+                'project', flat=True))
+        project_id2person_ids = PortfolioEntry.sample_contributors(
+            project_ids, n, excluding=self)
+        round_robin = mysite.profile.controllers.roundrobin(
+            *project_id2person_ids.values())
+        collaborator_ids = set()
+        while len(collaborator_ids) < n:
             try:
-                collaborators.add(round_robin.next())
+                collaborator_ids.add(round_robin.next())
             except StopIteration:
                 break
-        collaborators = list(collaborators)
+        collaborators = list(Person.objects.filter(
+                id__in=collaborator_ids).select_related('user'))
         random.shuffle(collaborators) # don't forget, this has a side effect and returns None
         return collaborators
 
@@ -435,11 +426,8 @@ def update_the_project_cached_contributor_count(sender, instance, **kwargs):
     instance.project.update_cached_contributor_count_and_save()
 
 def update_the_person_index(sender, instance, **kwargs):
-    person = instance.person
-    # Enqueue a background task to re-index the person
-    import mysite.profile.tasks
-    task = mysite.profile.tasks.ReindexPerson()
-    task.delay(person_id=person.id)
+    # Ask for the person to be re-indexed, soon
+    instance.person.reindex_for_person_search()
 
 models.signals.pre_save.connect(reject_when_query_is_only_whitespace, sender=DataImportAttempt)
 
@@ -575,6 +563,64 @@ class PortfolioEntry(models.Model):
         return Citation.untrashed.filter(portfolio_entry=self,
                 is_published=True)
 
+    @staticmethod
+    def sample_contributors(project_ids, n, excluding=None):
+        """Return a dict mapping each project id to the ids of up to n
+        random people with published portfolio entries about it, people
+        with photos first.
+
+        The database does the sampling, so big projects cost no more than
+        small ones; it's one query, however many projects there are."""
+        project_ids = list(project_ids)
+        if not project_ids:
+            return {}
+        qn = django.db.connection.ops.quote_name
+        entry_table = qn(PortfolioEntry._meta.db_table)
+        person_table = qn(Person._meta.db_table)
+        photo = '%s.%s' % (person_table, qn('photo'))
+        one_project = (
+            "SELECT * FROM (SELECT DISTINCT %(entry)s.%(project)s, "
+            "%(entry)s.%(person)s, "
+            "CASE WHEN %(photo)s IS NULL OR %(photo)s = '' THEN 1 ELSE 0 END "
+            "AS %(no_photo)s "
+            "FROM %(entry)s INNER JOIN %(person_table)s "
+            "ON %(entry)s.%(person)s = %(person_table)s.%(id)s "
+            "WHERE %(entry)s.%(project)s = %%s AND %(entry)s.%(person)s <> %%s "
+            "AND %(entry)s.%(is_published)s = %%s "
+            "AND %(entry)s.%(is_deleted)s = %%s "
+            "ORDER BY %(no_photo)s, %(random)s LIMIT %(n)d) AS " % {
+                'entry': entry_table, 'person_table': person_table,
+                'photo': photo, 'id': qn('id'),
+                'project': qn('project_id'), 'person': qn('person_id'),
+                'is_published': qn('is_published'),
+                'is_deleted': qn('is_deleted'), 'no_photo': qn('no_photo'),
+                'random': django.db.connection.ops.random_function_sql(),
+                'n': n})
+        if excluding is None:
+            excluding_id = 0 # No Person has that id.
+        else:
+            excluding_id = excluding.id
+
+        selects = []
+        params = []
+        for i, project_id in enumerate(project_ids):
+            selects.append(one_project + qn('sample_%d' % i))
+            params.extend([project_id, excluding_id, True, False])
+        cursor = django.db.connection.cursor()
+        cursor.execute(' UNION ALL '.join(selects), params)
+
+        project_id2rows = dict([(project_id, []) for project_id in project_ids])
+        for project_id, person_id, no_photo in cursor.fetchall():
+            project_id2rows[project_id].append((no_photo, person_id))
+        project_id2person_ids = {}
+        for project_id, rows in project_id2rows.items():
+            # The rows come back in a random order already; this puts the
+            # people with photos first without changing it otherwise.
+            rows.sort(key=lambda row: row[0])
+            project_id2person_ids[project_id] = [
+                person_id for no_photo, person_id in rows]
+        return project_id2person_ids
+
     @staticmethod
     def create_dummy(**kwargs):
         data = {'project': Project.create_dummy(),
@@ -763,10 +809,162 @@ class Forwarder(models.Model):
                 lines.append(line)
         return lines
         
+class PersonReindexRequest(models.Model):
+    """Someone's search index entry is out of date. There's at most one of
+    these per Person; see mysite.profile.reindex_queue."""
+    person = models.ForeignKey(Person, unique=True)
+    # How many times we were asked before we got around to it.
+    times_requested = models.IntegerField(default=1)
+    date_requested = models.DateTimeField(default=datetime.datetime.utcnow)
+
+class PersonMapLocation(models.Model):
+    """Where a person with a public, geocoded location shows up on the
+    people map; see mysite.profile.people_map."""
+    person = models.ForeignKey(Person, unique=True)
+    geohash = models.CharField(max_length=12, db_index=True)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+
+class PeopleMapCell(models.Model):
+    """How many people are in one geohash cell of the people map. There's
+    a row for each cell, at every precision, that anyone has been in."""
+    # Its length is the precision.
+    geohash = models.CharField(max_length=12, unique=True)
+    precision = models.IntegerField(db_index=True)
+    count = models.IntegerField(default=0)
+    # Add these up as we go, so we can put a cluster at the middle of the
+    # people in it rather than at the middle of the cell.
+    latitude_sum = models.FloatField(default=0)
+    longitude_sum = models.FloatField(default=0)
+    # The middle of the cell, for finding the cells in a viewport.
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+
+    def as_dict(self):
+        return {'geohash': self.geohash,
+                'count': self.count,
+                'latitude': self.latitude_sum / self.count,
+                'longitude': self.longitude_sum / self.count}
+
+class PopularityRanking(models.Model):
+    """How many people list a tag, or have contributed to a project, for
+    the suggestions on the people page. The refresh_popularity_rankings
+    task counts them again every so often."""
+    kind = models.CharField(max_length=20, db_index=True) # 'tag' or 'project'
+    name = models.CharField(max_length=255)
+    people_count = models.IntegerField()
+
+    # How many of each kind to keep.
+    LENGTH = 100
+
+    @staticmethod
+    def count_tags():
+        """Return a dict mapping each tag (lowercased) to how many people
+        list it, counting people once per tag type they list it under."""
+        # Tags differing only in case are different rows, so the database
+        # groups by the lowercased text. That's not something the ORM can
+        # say, so it's one query of our own.
+        qn = django.db.connection.ops.quote_name
+        link_table = qn(Link_Person_Tag._meta.db_table)
+        tag_table = qn(Tag._meta.db_table)
+        lower_text = 'LOWER(%s.%s)' % (tag_table, qn('text'))
+        cursor = django.db.connection.cursor()
+        cursor.execute(
+            "SELECT %(lower_text)s, COUNT(DISTINCT %(link)s.%(person)s) "
+            "FROM %(link)s INNER JOIN %(tag)s "
+            "ON %(link)s.%(tag_id)s = %(tag)s.%(id)s "
+            "GROUP BY %(lower_text)s, %(tag)s.%(tag_type)s" % {
+                'lower_text': lower_text, 'link': link_table,
+                'tag': tag_table, 'person': qn('person_id'),
+                'tag_id': qn('tag_id'), 'id': qn('id'),
+                'tag_type': qn('tag_type_id')})
+        tag2count = collections.defaultdict(int)
+        for text, people_count in cursor.fetchall():
+            tag2count[text] += people_count
+        return tag2count
+
+    @staticmethod
+    def count_projects():
+        """Return a dict mapping each project name to how many people have
+        published a portfolio entry about it."""
+        return dict([(row['project__name'], row['people_count'])
+                     for row in PortfolioEntry.published_ones.values(
+                    'project__name').annotate(
+                    people_count=Count('person', distinct=True)).order_by()])
+
+    @staticmethod
+    def refresh(kind, name2count):
+        """Keep the LENGTH most popular names. We change the rows in
+        place, so nobody ever sees an empty ranking."""
+        top = sorted(name2count.items(),
+                     key=lambda item: (-item[1], item[0]))[
+            :PopularityRanking.LENGTH]
+        name2id = dict(PopularityRanking.objects.filter(
+                kind=kind).values_list('name', 'id'))
+        for name, count in top:
+            if name in name2id:
+                PopularityRanking.objects.filter(
+                    id=name2id.pop(name)).update(people_count=count)
+            else:
+                PopularityRanking.objects.create(kind=kind, name=name,
+                                                 people_count=count)
+        PopularityRanking.objects.filter(id__in=name2id.values()).delete()
+
+    @staticmethod
+    def refresh_all():
+        PopularityRanking.refresh('tag', PopularityRanking.count_tags())
+        PopularityRanking.refresh('project',
+                                  PopularityRanking.count_projects())
+
+    @staticmethod
+    def get_top(kind, n):
+        """Return the n most popular names of this kind, most popular
+        first. Profile migration 0089 counts them the first time."""
+        return list(PopularityRanking.objects.filter(kind=kind).order_by(
+                '-people_count', 'name').values_list('name', flat=True)[:n])
+
+class RecommendedBugsFingerprint(models.Model):
+    """What we last filled a person's recommended bugs from: the cache key
+    of their RecommendBugs, which covers their search terms and the bug
+    epoch. If it hasn't moved, their recommendations are still good."""
+    person = models.ForeignKey(Person, unique=True)
+    fingerprint = models.CharField(max_length=100)
+    date_filled = models.DateTimeField(auto_now=True)
+
+def remember_how_person_location_was_loaded(sender, instance, **kwargs):
+    instance._loaded_location = (instance.location_confirmed,
+                                 instance.location_display_name)
+
+def update_people_map_when_location_changes(sender, instance, created=False,
+                                            raw=False, **kwargs):
+    if raw:
+        return
+    location = (instance.location_confirmed, instance.location_display_name)
+    if created or location != getattr(instance, '_loaded_location', None):
+        import mysite.profile.people_map
+        mysite.profile.people_map.place_person(instance)
+        instance._loaded_location = location
+
+def take_person_off_the_people_map(sender, instance, **kwargs):
+    import mysite.profile.people_map
+    mysite.profile.people_map.remove_person(instance.id)
+
+def update_people_map_when_address_is_geocoded(sender, instance, **kwargs):
+    if instance.latitude is None:
+        return
+    import mysite.profile.people_map
+    mysite.profile.people_map.place_people_at(instance.address)
+
 def update_link_person_tag_cache(sender, instance, **kwargs):
     from mysite.profile.tasks import update_person_tag_cache
     update_person_tag_cache.delay(person__pk=instance.person.pk)
-    mysite.search.models.Epoch.bump_for_model(Link_Person_Tag)
+    try:
+        tag = instance.tag
+    except Tag.DoesNotExist:
+        # The tag's being deleted, too; its cache entry will just expire.
+        return
+    mysite.profile.controllers.refresh_people_matching(
+        tag.tag_type.name, tag.text)
 
 def update_pf_cache(sender, instance, **kwargs):
     from mysite.profile.tasks import update_someones_pf_cache
@@ -785,4 +983,10 @@ models.signals.post_delete.connect(update_link_person_tag_cache, sender=Link_Per
 models.signals.post_save.connect(update_pf_cache, sender=PortfolioEntry)
 models.signals.post_delete.connect(update_pf_cache, sender=PortfolioEntry)
 
+models.signals.post_init.connect(remember_how_person_location_was_loaded, sender=Person)
+models.signals.post_save.connect(update_people_map_when_location_changes, sender=Person)
+models.signals.pre_delete.connect(take_person_off_the_people_map, sender=Person)
+models.signals.post_save.connect(update_people_map_when_address_is_geocoded,
+                                 sender=mysite.base.models.GeocodedAddress)
+
 # vim: set nu:
@@ -0,0 +1,296 @@
+import math
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+
+import mysite.base.geohash
+import mysite.base.models
+import mysite.profile.models
+
+### The people map, clustered by geohash.
+###
+### Everybody with a public, geocoded location gets a PersonMapLocation,
+### and counts towards a PeopleMapCell for each prefix of their geohash. So
+### the clusters at any zoom level are already counted: showing a viewport
+### is one query for the cells in it. When someone's location changes we
+### take them out of their old cells and add them to their new ones; when
+### the geocoder finds an address, everybody there goes on the map.
+###
+### The same geohashes make a grid for finding people near a point: the
+### cells around it are a handful of prefixes, and PersonMapLocation's
+### geohash column is indexed, so only people in those cells get looked at.
+
+# Cells as small as about 40 by 20 meters.
+MAX_PRECISION = getattr(settings, 'PEOPLE_MAP_MAX_PRECISION', 8)
+
+# Don't send back more than this many clusters at once.
+MAX_CLUSTERS = 1000
+
+EARTH_RADIUS_IN_KM = 6371.0
+KM_PER_DEGREE_OF_LATITUDE = math.pi * EARTH_RADIUS_IN_KM / 180
+
+def zoom2precision(zoom):
+    """Return the geohash precision whose cells come out about 32 to 64
+    pixels wide at a Google Maps zoom level."""
+    # At zoom level z, the world is 256 * 2**z pixels wide.
+    for precision in range(1, MAX_PRECISION + 1):
+        height, width = mysite.base.geohash.cell_size(precision)
+        if 256 * (2 ** zoom) * width / 360.0 <= 64:
+            return precision
+    return MAX_PRECISION
+
+def add_to_cells(geohash, latitude, longitude, sign=1):
+    PeopleMapCell = mysite.profile.models.PeopleMapCell
+    for precision in range(1, len(geohash) + 1):
+        prefix = geohash[:precision]
+        changes = {'count': F('count') + sign,
+                   'latitude_sum': F('latitude_sum') + sign * latitude,
+                   'longitude_sum': F('longitude_sum') + sign * longitude}
+        if PeopleMapCell.objects.filter(geohash=prefix).update(**changes):
+            continue
+        if sign < 0:
+            continue # Already gone; nothing to take them out of.
+        cell_latitude, cell_longitude = mysite.base.geohash.decode(prefix)
+        try:
+            PeopleMapCell.objects.create(
+                geohash=prefix, precision=precision, count=1,
+                latitude_sum=latitude, longitude_sum=longitude,
+                latitude=cell_latitude, longitude=cell_longitude)
+        except IntegrityError:
+            # Somebody else just moved into this cell, too.
+            PeopleMapCell.objects.filter(geohash=prefix).update(**changes)
+
+def remove_person(person_id):
+    PersonMapLocation = mysite.profile.models.PersonMapLocation
+    for location in PersonMapLocation.objects.filter(person__id=person_id):
+        add_to_cells(location.geohash, location.latitude, location.longitude,
+                     sign=-1)
+        location.delete()
+
+def place_person(person):
+    """Put the person where their location says they are, if anywhere,
+    and update the counts of the cells they left and joined."""
+    position = None
+    new_addresses = []
+    if person.location_is_public():
+        address = person.location_display_name
+        address2geocoded, new_addresses = (
+            mysite.base.models.GeocodedAddress.get_many([address]))
+        geocoded = address2geocoded[address]
+        if geocoded.latitude is not None:
+            position = geocoded.latitude, geocoded.longitude
+    move_person(person, position)
+    if new_addresses:
+        # Once the geocoder finds it, place_people_at puts them on the map.
+        queue_geocoding()
+
+def queue_geocoding():
+    import mysite.profile.tasks
+    mysite.profile.tasks.geocode_pending_addresses.delay()
+
+def move_person(person, position):
+    PersonMapLocation = mysite.profile.models.PersonMapLocation
+    existing = list(PersonMapLocation.objects.filter(person__id=person.id))
+    if existing and position == (existing[0].latitude,
+                                 existing[0].longitude):
+        return
+    remove_person(person.id)
+    if position is None:
+        return
+    latitude, longitude = position
+    geohash = mysite.base.geohash.encode(latitude, longitude, MAX_PRECISION)
+    PersonMapLocation.objects.create(person=person, geohash=geohash,
+                                     latitude=latitude, longitude=longitude)
+    add_to_cells(geohash, latitude, longitude)
+
+def place_people_at(address):
+    """The geocoder just told us where address is; put everybody who
+    lives there on the map."""
+    for person in mysite.profile.models.Person.objects.filter(
+        location_confirmed=True, location_display_name=address):
+        place_person(person)
+
+def rebuild():
+    """Count every cell again from scratch, in case the incremental
+    updates have drifted, and fix whatever's off in place. The map keeps
+    showing everybody while we work."""
+    Person = mysite.profile.models.Person
+
+    person_id2address = dict(
+        Person.objects.filter(location_confirmed=True).exclude(
+            location_display_name='').values_list(
+            'id', 'location_display_name'))
+    address2geocoded, new_addresses = (
+        mysite.base.models.GeocodedAddress.get_many(
+            list(set(person_id2address.values()))))
+
+    person_id2position = {}
+    for person_id, address in person_id2address.items():
+        geocoded = address2geocoded[address]
+        if geocoded.latitude is not None:
+            person_id2position[person_id] = (geocoded.latitude,
+                                             geocoded.longitude)
+    fix_locations_and_cells(person_id2position)
+    if new_addresses:
+        queue_geocoding()
+
+# Sums of coordinates that are this close are the same sum, added up in a
+# different order.
+SUM_TOLERANCE = 1e-6
+
+@transaction.commit_on_success
+def fix_locations_and_cells(person_id2position):
+    """Make the PersonMapLocations and PeopleMapCells agree with where
+    person_id2position says everybody is, changing only the rows that are
+    wrong. Cells change by the difference between what they say and what
+    we counted, as add_to_cells does, so a move that lands while we're at
+    it still counts."""
+    PersonMapLocation = mysite.profile.models.PersonMapLocation
+    PeopleMapCell = mysite.profile.models.PeopleMapCell
+
+    person_id2location = dict([(location.person_id, location) for location in
+                               PersonMapLocation.objects.all()])
+    for person_id, location in person_id2location.items():
+        if person_id not in person_id2position:
+            location.delete()
+    geohash2totals = {}
+    for person_id, (latitude, longitude) in person_id2position.items():
+        geohash = mysite.base.geohash.encode(latitude, longitude,
+                                             MAX_PRECISION)
+        location = person_id2location.get(person_id)
+        if location is None:
+            PersonMapLocation.objects.create(
+                person_id=person_id, geohash=geohash, latitude=latitude,
+                longitude=longitude)
+        elif (location.geohash, location.latitude, location.longitude) != (
+            geohash, latitude, longitude):
+            PersonMapLocation.objects.filter(id=location.id).update(
+                geohash=geohash, latitude=latitude, longitude=longitude)
+        for precision in range(1, MAX_PRECISION + 1):
+            totals = geohash2totals.setdefault(geohash[:precision],
+                                               [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += latitude
+            totals[2] += longitude
+
+    for cell in PeopleMapCell.objects.all():
+        count, latitude_sum, longitude_sum = geohash2totals.pop(
+            cell.geohash, (0, 0.0, 0.0))
+        if (count == cell.count and
+            abs(latitude_sum - cell.latitude_sum) < SUM_TOLERANCE and
+            abs(longitude_sum - cell.longitude_sum) < SUM_TOLERANCE):
+            continue
+        PeopleMapCell.objects.filter(id=cell.id).update(
+            count=F('count') + (count - cell.count),
+            latitude_sum=F('latitude_sum') + (latitude_sum -
+                                              cell.latitude_sum),
+            longitude_sum=F('longitude_sum') + (longitude_sum -
+                                                cell.longitude_sum))
+    for geohash, (count, latitude_sum, longitude_sum) in (
+        geohash2totals.items()):
+        cell_latitude, cell_longitude = mysite.base.geohash.decode(geohash)
+        PeopleMapCell.objects.create(
+            geohash=geohash, precision=len(geohash), count=count,
+            latitude_sum=latitude_sum, longitude_sum=longitude_sum,
+            latitude=cell_latitude, longitude=cell_longitude)
+    # Nobody left in these.
+    PeopleMapCell.objects.filter(count__lte=0).delete()
+
+def get_clusters(zoom, south, west, north, east):
+    """Return the clusters of people in a viewport at a zoom level,
+    biggest first, as dicts of geohash, count, latitude and longitude."""
+    precision = zoom2precision(zoom)
+    height, width = mysite.base.geohash.cell_size(precision)
+    # A cell whose middle is just outside the viewport can still have
+    # people inside it.
+    cells = mysite.profile.models.PeopleMapCell.objects.filter(
+        precision=precision, count__gt=0,
+        latitude__gte=south - height / 2, latitude__lte=north + height / 2)
+    if west <= east:
+        cells = cells.filter(longitude__gte=west - width / 2,
+                             longitude__lte=east + width / 2)
+    else:
+        # The viewport straddles the 180th meridian.
+        cells = cells.filter(Q(longitude__gte=west - width / 2) |
+                             Q(longitude__lte=east + width / 2))
+    return [cell.as_dict() for cell in cells.order_by('-count')[:MAX_CLUSTERS]]
+
+def distance_in_km(latitude, longitude, other_latitude, other_longitude):
+    """The great-circle distance between two points, by the haversine
+    formula."""
+    latitude, longitude, other_latitude, other_longitude = map(
+        math.radians, (latitude, longitude, other_latitude, other_longitude))
+    a = (math.sin((other_latitude - latitude) / 2) ** 2 +
+         math.cos(latitude) * math.cos(other_latitude) *
+         math.sin((other_longitude - longitude) / 2) ** 2)
+    return 2 * EARTH_RADIUS_IN_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def normalize_longitude(longitude):
+    return ((longitude + 180) % 360) - 180
+
+def get_prefixes_covering(latitude, longitude, km):
+    """Return geohash prefixes whose cells, between them, cover everywhere
+    within km of the point. Returns [''] when that's a good part of the
+    world anyway."""
+    latitude_span = km / KM_PER_DEGREE_OF_LATITUDE
+    south, north = latitude - latitude_span, latitude + latitude_span
+    if south <= -90 or north >= 90:
+        return ['']
+    # Degrees of longitude are shortest on the edge nearer the pole.
+    longitude_span = latitude_span / math.cos(math.radians(
+        max(abs(south), abs(north))))
+    if longitude_span >= 180:
+        return ['']
+
+    # Use the smallest cells that are still as big as the radius, so that
+    # it takes at most three by three of them.
+    precision = 0
+    for candidate in range(1, MAX_PRECISION + 1):
+        height, width = mysite.base.geohash.cell_size(candidate)
+        if height < latitude_span or width < longitude_span:
+            break
+        precision = candidate
+    if not precision:
+        return ['']
+
+    # Step across the bounding box no more than a cell at a time, so we
+    # land in every cell it touches.
+    height, width = mysite.base.geohash.cell_size(precision)
+    west, east = longitude - longitude_span, longitude + longitude_span
+    prefixes = set()
+    row_latitude = south
+    while True:
+        column_longitude = west
+        while True:
+            prefixes.add(mysite.base.geohash.encode(
+                row_latitude, normalize_longitude(column_longitude),
+                precision))
+            if column_longitude >= east:
+                break
+            column_longitude = min(column_longitude + width, east)
+        if row_latitude >= north:
+            break
+        row_latitude = min(row_latitude + height, north)
+    return sorted(prefixes)
+
+def people_near(latitude, longitude, km):
+    """Return a (distance in km, person id) pair for everybody on the map
+    within km of the point, nearest first."""
+    locations = mysite.profile.models.PersonMapLocation.objects.all()
+    prefixes = get_prefixes_covering(latitude, longitude, km)
+    if prefixes != ['']:
+        in_a_nearby_cell = Q(geohash__startswith=prefixes[0])
+        for prefix in prefixes[1:]:
+            in_a_nearby_cell |= Q(geohash__startswith=prefix)
+        locations = locations.filter(in_a_nearby_cell)
+
+    nearby = []
+    for person_id, person_latitude, person_longitude in locations.values_list(
+        'person', 'latitude', 'longitude'):
+        distance = distance_in_km(latitude, longitude,
+                                  person_latitude, person_longitude)
+        if distance <= km:
+            nearby.append((distance, person_id))
+    nearby.sort()
+    return nearby
@@ -0,0 +1,128 @@
+import logging
+import time
+
+from django.conf import settings
+import django.core.cache
+import django.db
+
+import mysite.profile.controllers
+import mysite.profile.models
+
+### Keeping everybody's recommended bugs in the cache.
+###
+### A person's recommendations depend on their search terms and the bug
+### epoch, and RecommendBugs' cache key is made of exactly those. So we
+### write down the key we last filled each person's cache under, as their
+### RecommendedBugsFingerprint; on the next run, only people whose key has
+### moved, or whose entry the cache has since dropped, get their
+### recommendations worked out again. People are handed out in chunks of
+### primary keys to a pool of processes.
+
+# How many chunks to work on at once.
+PROCESSES = getattr(settings, 'RECOMMENDED_BUGS_FILL_PROCESSES', 4)
+
+# How many primary keys each chunk covers.
+CHUNK_SIZE = getattr(settings, 'RECOMMENDED_BUGS_FILL_CHUNK_SIZE', 500)
+
+# How many bugs we recommend to each person.
+N_BUGS = 5
+
+def get_recommender(person):
+    return mysite.profile.controllers.RecommendBugs(
+        person.get_recommended_search_terms(), n=N_BUGS)
+
+def save_fingerprint(person_id, fingerprint):
+    Fingerprint = mysite.profile.models.RecommendedBugsFingerprint
+    if not Fingerprint.objects.filter(person__id=person_id).update(
+        fingerprint=fingerprint):
+        Fingerprint.objects.create(person_id=person_id,
+                                   fingerprint=fingerprint)
+
+def fill_person(person):
+    """Fill one person's cache, whether or not it needs it."""
+    recommender = get_recommender(person)
+    recommender.recommend()
+    save_fingerprint(person.id, recommender.get_cache_key())
+
+def fill_chunk(chunk):
+    """Fill the cache for the people in a (start, stop) range of primary
+    keys whose fingerprints have moved, or whose entries the cache has
+    dropped. Returns the chunk, how many people are in it, how many of
+    them we filled, and how long it took."""
+    started = time.time()
+    start, stop = chunk
+    people = list(mysite.profile.models.Person.objects.filter(
+            id__gte=start, id__lt=stop).order_by('id'))
+    person_id2fingerprint = dict(
+        mysite.profile.models.RecommendedBugsFingerprint.objects.filter(
+            person__id__gte=start, person__id__lt=stop).values_list(
+            'person', 'fingerprint'))
+    recommenders = [get_recommender(person) for person in people]
+    fingerprints = [recommender.get_cache_key()
+                    for recommender in recommenders]
+    # One round trip to find out which entries the cache still has.
+    cached = django.core.cache.cache.get_many(fingerprints)
+    filled = 0
+    for person, recommender, fingerprint in zip(people, recommenders,
+                                                fingerprints):
+        if (person_id2fingerprint.get(person.id) == fingerprint and
+            cached.get(fingerprint) is not None):
+            continue
+        recommender.recommend()
+        save_fingerprint(person.id, fingerprint)
+        filled += 1
+    return chunk, len(people), filled, time.time() - started
+
+def fill(processes=None, chunk_size=None):
+    """Fill the cache for everybody who needs it. Returns a dict of
+    stats about the run, which we also log."""
+    if processes is None:
+        processes = PROCESSES
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE
+    started = time.time()
+    chunks = mysite.profile.controllers.get_person_id_chunks(chunk_size)
+
+    if processes > 1:
+        import multiprocessing
+        if multiprocessing.current_process().daemon:
+            # We're inside a celery worker, which isn't allowed children
+            # of its own.
+            processes = 1
+    if processes > 1:
+        # Each worker has to open its own database connection; one we
+        # already had open would end up shared between them.
+        django.db.connection.close()
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(fill_chunk, chunks)
+    else:
+        pool = None
+        results = (fill_chunk(chunk) for chunk in chunks)
+
+    stats = {'processes': processes, 'chunks': len(chunks), 'people': 0,
+             'filled': 0, 'slowest_chunk_seconds': 0.0,
+             'chunk_seconds': 0.0}
+    try:
+        for chunk, n_people, n_filled, seconds in results:
+            stats['people'] += n_people
+            stats['filled'] += n_filled
+            stats['chunk_seconds'] += seconds
+            stats['slowest_chunk_seconds'] = max(
+                stats['slowest_chunk_seconds'], seconds)
+            logging.info("Recommended bugs for %d of people %d through %d "
+                         "in %.2fs." % (n_filled, chunk[0], chunk[1] - 1,
+                                        seconds))
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    stats['seconds'] = time.time() - started
+    logging.info("Filled the recommended bugs cache for %(filled)d of "
+                 "%(people)d people in %(seconds).2fs, with %(processes)d "
+                 "processes (%(chunks)d chunks; %(chunk_seconds).2fs of "
+                 "work, slowest chunk %(slowest_chunk_seconds).2fs)." % stats)
+    return stats
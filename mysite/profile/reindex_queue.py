@@ -0,0 +1,145 @@
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+
+import mysite.profile.models
+import mysite.profile.search_indexes
+
+### Re-indexing people for the people search, a bunch at a time.
+###
+### Lots of things make a person's index entry stale: editing their info,
+### every PortfolioEntry an Ohloh import creates, saving a project they want
+### to help. Rather than talk to Solr each time, we write down that the
+### person needs re-indexing (once; asking again just counts the request)
+### and schedule a flush DELAY seconds out. By then the import is usually
+### done, and the flush sends everyone pending to Solr in batches.
+
+# Seconds to wait for more requests before flushing.
+DELAY = getattr(settings, 'PERSON_REINDEX_DELAY', 10)
+
+# People per Solr update.
+BATCH_SIZE = getattr(settings, 'PERSON_REINDEX_BATCH_SIZE', 100)
+
+class ReindexQueueMetrics(object):
+    '''What flushes in this process have done, so we can tell whether
+    the queue is earning its keep.'''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.people_indexed = 0
+        self.batches = 0
+        self.batch_seconds = 0.0
+        self.longest_batch_seconds = 0.0
+        self.longest_wait = datetime.timedelta(0)
+
+    def record_flush(self, requests, longest_wait):
+        self.requests += requests
+        self.longest_wait = max(self.longest_wait, longest_wait)
+
+    def record_batch(self, n_people, seconds):
+        self.people_indexed += n_people
+        self.batches += 1
+        self.batch_seconds += seconds
+        self.longest_batch_seconds = max(self.longest_batch_seconds, seconds)
+
+    def coalescing_ratio(self):
+        """How many requests each Solr update of a person stood in for."""
+        if not self.people_indexed:
+            return 0.0
+        return float(self.requests) / self.people_indexed
+
+    def mean_batch_seconds(self):
+        if not self.batches:
+            return 0.0
+        return self.batch_seconds / self.batches
+
+    def as_dict(self):
+        return {'requests': self.requests,
+                'people_indexed': self.people_indexed,
+                'coalescing_ratio': self.coalescing_ratio(),
+                'batches': self.batches,
+                'mean_batch_seconds': self.mean_batch_seconds(),
+                'longest_batch_seconds': self.longest_batch_seconds,
+                'longest_wait_seconds': total_seconds(self.longest_wait)}
+
+metrics = ReindexQueueMetrics()
+
+def total_seconds(delta):
+    return delta.days * 24 * 3600 + delta.seconds + delta.microseconds / 1e6
+
+def request_reindex(person_id):
+    """Make sure the person gets re-indexed within about DELAY seconds."""
+    PersonReindexRequest = mysite.profile.models.PersonReindexRequest
+    bumped = PersonReindexRequest.objects.filter(person__id=person_id).update(
+        times_requested=F('times_requested') + 1)
+    if bumped:
+        # Whoever asked first scheduled a flush; it will pick this up.
+        return
+    try:
+        PersonReindexRequest.objects.create(person_id=person_id)
+    except IntegrityError:
+        # Someone else asked at the same moment, and beat us to it.
+        PersonReindexRequest.objects.filter(person__id=person_id).update(
+            times_requested=F('times_requested') + 1)
+        return
+    import mysite.profile.tasks
+    mysite.profile.tasks.FlushPersonReindexQueue.apply_async(countdown=DELAY)
+
+def flush(batch_size=None):
+    """Re-index everyone who's waiting. Returns this flush's numbers, or
+    None if nobody was waiting."""
+    if batch_size is None:
+        batch_size = BATCH_SIZE
+    PersonReindexRequest = mysite.profile.models.PersonReindexRequest
+    Person = mysite.profile.models.Person
+
+    pending = list(PersonReindexRequest.objects.order_by('id').values_list(
+        'id', 'person', 'times_requested', 'date_requested'))
+    if not pending:
+        return None
+    # Take them off the queue before reading the people, so that a change
+    # made while we work asks for another flush instead of getting lost.
+    PersonReindexRequest.objects.filter(
+        id__in=[request_id for request_id, _, _, _ in pending]).delete()
+
+    person_ids = [person_id for _, person_id, _, _ in pending]
+    requests = sum([times for _, _, times, _ in pending])
+    longest_wait = datetime.datetime.utcnow() - min(
+        [date for _, _, _, date in pending])
+    metrics.record_flush(requests, longest_wait)
+
+    id2person = Person.objects.in_bulk(person_ids)
+    index = mysite.profile.search_indexes.PersonIndex(Person)
+    batch_seconds = []
+    for start in range(0, len(person_ids), batch_size):
+        batch = person_ids[start:start + batch_size]
+        started = time.time()
+        people = [id2person[person_id] for person_id in batch
+                  if person_id in id2person]
+        if people:
+            mysite.profile.search_indexes.prefetch_index_data(people)
+            index.backend.update(index, people)
+        for person_id in batch:
+            if person_id not in id2person:
+                # They deleted their account while they waited.
+                index.remove_object(Person(id=person_id))
+        seconds = time.time() - started
+        metrics.record_batch(len(batch), seconds)
+        batch_seconds.append(seconds)
+
+    stats = {'requests': requests,
+             'people_indexed': len(person_ids),
+             'coalescing_ratio': float(requests) / len(person_ids),
+             'batches': len(batch_seconds),
+             'mean_batch_seconds': sum(batch_seconds) / len(batch_seconds),
+             'longest_wait_seconds': total_seconds(longest_wait)}
+    logging.info("Flushed the person reindex queue: %s; since startup: %s" % (
+        stats, metrics.as_dict()))
+    return stats
@@ -2,10 +2,46 @@ from haystack import indexes
 from haystack import site
 import mysite.profile.models
 from django.db.models import Q
+import collections
+
+def prefetch_index_data(people):
+    """Work out what PersonIndex needs for all these people at once: three
+    queries, rather than three per person. PersonIndex uses what this
+    leaves on each Person instead of asking the database again."""
+    id2person = dict([(person.id, person) for person in people])
+    ids = id2person.keys()
+    for person in people:
+        person.prefetched_tags_as_dict = collections.defaultdict(set)
+        person.prefetched_wanna_help_project_names = []
+        person.prefetched_project_names = []
+    if not ids:
+        return
+
+    for person_id, tag_type_name, text in (
+        mysite.profile.models.Link_Person_Tag.objects.filter(
+            person__in=ids).values_list(
+            'person', 'tag__tag_type__name', 'tag__text')):
+        id2person[person_id].prefetched_tags_as_dict[tag_type_name].add(
+            text.lower())
+
+    for person_id, name in mysite.profile.models.Person.objects.filter(
+        id__in=ids).values_list('id', 'projects_i_wanna_help__name'):
+        if name is not None: # People who don't want to help with anything
+            id2person[person_id].prefetched_wanna_help_project_names.append(
+                name)
+
+    for person_id, name in (
+        mysite.profile.models.PortfolioEntry.published_ones.filter(
+            person__in=ids).values_list(
+            'person', 'project__name').order_by().distinct()):
+        id2person[person_id].prefetched_project_names.append(name)
 
 class PersonIndex(indexes.SearchIndex):
     def _pull_lowercase_tag_texts(self, tag_type_name, person_instance):
-        return person_instance.get_tags_as_dict().get(tag_type_name, [])
+        tags = getattr(person_instance, 'prefetched_tags_as_dict', None)
+        if tags is None:
+            tags = person_instance.get_tags_as_dict()
+        return tags.get(tag_type_name, [])
 
     null_document = indexes.CharField(document=True)
     def prepare_null_document(self, person_instance):
@@ -33,13 +69,19 @@ class PersonIndex(indexes.SearchIndex):
 
     all_wanna_help_projects_lowercase_exact = indexes.MultiValueField() # should be type="string"
     def prepare_all_wanna_help_projects_lowercase_exact(self, person_instance):
-        return list(map(lambda x: x.name.lower(),
-                        person_instance.projects_i_wanna_help.all()))
+        names = getattr(person_instance,
+                        'prefetched_wanna_help_project_names', None)
+        if names is None:
+            names = [project.name for project in
+                     person_instance.projects_i_wanna_help.all()]
+        return list(map(lambda x: x.lower(), names))
 
     all_public_projects_lowercase_exact = indexes.MultiValueField() # NOTE: Hack the xml to make type="string"
     def prepare_all_public_projects_lowercase_exact(self, person_instance):
-        return list(map(lambda x: x.lower(),
-                        person_instance.get_list_of_all_project_names()))
+        names = getattr(person_instance, 'prefetched_project_names', None)
+        if names is None:
+            names = person_instance.get_list_of_all_project_names()
+        return list(map(lambda x: x.lower(), names))
 
     def get_queryset(self):
         everybody = mysite.profile.models.Person.objects.all()
@@ -19,6 +19,7 @@ import random
 import traceback
 import mysite.profile.search_indexes
 import mysite.profile.controllers
+import mysite.profile.recommendation_cache
 import shutil
 import staticgenerator
 import mysite.customs.bitbucket
@@ -321,6 +322,11 @@ class ReindexPerson(Task):
         pi = mysite.profile.search_indexes.PersonIndex(person)
         pi.update_object(person)
 
+class FlushPersonReindexQueue(Task):
+    def run(self, **kwargs):
+        import mysite.profile.reindex_queue
+        return mysite.profile.reindex_queue.flush()
+
 class GarbageCollectForwarders(Task):
     def run(self, **kwargs):
         logger = self.get_logger(**kwargs)
@@ -383,6 +389,7 @@ try:
     celery.registry.tasks.register(RegeneratePostfixAliasesForForwarder)
     celery.registry.tasks.register(FetchPersonDataFromOhloh)
     celery.registry.tasks.register(ReindexPerson)
+    celery.registry.tasks.register(FlushPersonReindexQueue)
     celery.registry.tasks.register(GarbageCollectForwarders)
 except celery.registry.AlreadyRegistered:
     pass
@@ -405,21 +412,42 @@ def update_someones_pf_cache(person__pk):
     # This getter will populate the cache
     return person.get_names_of_nonarchived_projects()
 
+@task
+def generate_photo_thumbnails(person_id):
+    """Make the thumbnails of someone's photo, after they upload it."""
+    person = mysite.profile.models.Person.objects.get(id=person_id)
+    person.generate_thumbnail_from_photo()
+
+@task
+def geocode_pending_addresses():
+    """Geocode the addresses people have asked about since we last ran, so
+    the people map never has to wait on the geocoder."""
+    import mysite.base.models
+    for geocoded in mysite.base.models.GeocodedAddress.get_pending():
+        geocoded.geocode()
+
+@task
+def refresh_popularity_rankings():
+    """Count how many people list each tag and have contributed to each
+    project, for the suggestions on the people page."""
+    mysite.profile.models.PopularityRanking.refresh_all()
+
+@task
 def fill_recommended_bugs_cache():
-    logging.info("Filling recommended bugs cache for all people.")
-    for person in mysite.profile.models.Person.objects.all():
-        fill_one_person_recommend_bugs_cache.apply(person_id=person.id)
-    logging.info("Finished filling recommended bugs cache for all people.")
+    """Fill the recommended bugs cache for everybody whose search terms,
+    or the bugs, have changed since we last did."""
+    return mysite.profile.recommendation_cache.fill()
 
 @task
 def fill_one_person_recommend_bugs_cache(person_id):
     p = mysite.profile.models.Person.objects.get(id=person_id)
     logging.info("Recommending bugs for %s" % p)
-    suggested_searches = p.get_recommended_search_terms() # expensive?
-    recommender = mysite.profile.controllers.RecommendBugs(suggested_searches, n=5) # cache fill prep...
-    recommender.recommend() # cache fill do it.
+    mysite.profile.recommendation_cache.fill_person(p)
 
-def sync_bug_epoch_from_model_then_fill_recommended_bugs_cache():
+def sync_bug_epoch_from_model():
+    """Bump the Bug model's epoch if some bug is newer than it. Returns
+    whether it did. (The profile_hourly_tasks command fills the
+    recommended bugs cache right after.)"""
     logging.info("Syncing bug epoch...")
     # Find the highest bug object modified date
     from django.db.models import Max
@@ -428,12 +456,14 @@ def sync_bug_epoch_from_model_then_fill_recommended_bugs_cache():
     epoch = mysite.search.models.Epoch.get_for_model(
         mysite.search.models.Bug)
     # if the epoch is lower, then set the epoch to that value
+    bumped = False
     if highest_bug_mtime.timetuple() > epoch:
         mysite.search.models.Epoch.bump_for_model(
             mysite.search.models.Bug)
-        logging.info("Whee! Bumped the epoch. Guess I'll fill the cache.")
-        fill_recommended_bugs_cache.apply()
+        logging.info("Whee! Bumped the epoch.")
+        bumped = True
     logging.info("Done syncing bug epoch.")
+    return bumped
 
 @task
 def clear_people_page_cache(*args, **kwargs):
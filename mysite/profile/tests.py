@@ -10,6 +10,11 @@ import mysite.project.views
 import mysite.profile.views
 import mysite.profile.models
 import mysite.profile.controllers
+import mysite.profile.people_map
+import mysite.profile.recommendation_cache
+import mysite.profile.reindex_queue
+import mysite.profile.search_indexes
+import mysite.base.controllers
 
 from mysite.profile import views
 
@@ -29,6 +34,7 @@ import tasks
 import mock
 import UserList
 
+import django.db
 import django.test
 from django.test.client import Client
 from django.core import management, serializers
@@ -824,6 +830,86 @@ class BugsAreRecommended(TwillTests):
         recommended = list(recommender.recommend())
         self.assertNotEqual(recommended[0], recommended[1])
 
+    def test_only_the_first_n_per_term_are_needed(self):
+        """Round-robin over each term's first n bugs picks the same bugs as
+        round-robin over all of them."""
+        def every_bug_id(term):
+            return [bug.id for bug in mysite.search.controllers.order_bugs(
+                mysite.search.controllers.Query(
+                            terms=[term]).get_bugs_unordered())]
+        for terms in (['Python', 'C#'], ['Python', 'Python', 'C#'],
+                      ['C#', 'Python']):
+            for n in range(1, 5):
+                expected = []
+                for bug_id in mysite.profile.controllers.roundrobin(
+                    *[every_bug_id(term) for term in terms]):
+                    if len(expected) == n:
+                        break
+                    if bug_id not in expected:
+                        expected.append(bug_id)
+                recommender = mysite.profile.controllers.RecommendBugs(
+                    terms, n=n)
+                for term in terms:
+                    self.assert_(len(recommender.get_candidate_ids(term)) <= n)
+                self.assertEqual(
+                    [bug.id for bug in recommender.recommend()], expected)
+
+class FillRecommendedBugsCache(TwillTests):
+    fixtures = ['user-paulproteus', 'person-paulproteus',
+                'user-barry', 'person-barry']
+
+    username2terms = {}
+
+    # Stands in for memcached: what the recommendations would have cached.
+    cached = {}
+
+    def get_terms(person):
+        return FillRecommendedBugsCache.username2terms[person.user.username]
+
+    def recommend(recommender):
+        FillRecommendedBugsCache.cached[recommender.get_cache_key()] = '[]'
+        return []
+
+    def get_many(keys):
+        return dict([(key, FillRecommendedBugsCache.cached[key])
+                     for key in keys if key in FillRecommendedBugsCache.cached])
+
+    def fill(self):
+        stats = mysite.profile.recommendation_cache.fill(processes=1,
+                                                         chunk_size=1)
+        self.assertEqual(stats['people'], 2)
+        return stats['filled']
+
+    @mock.patch('mysite.profile.models.Person.get_recommended_search_terms',
+                get_terms)
+    @mock.patch('mysite.profile.controllers.RecommendBugs.recommend',
+                recommend)
+    @mock.patch('django.core.cache.cache.get_many', get_many)
+    def test_only_people_whose_inputs_moved_are_filled(self):
+        self.username2terms.update({'paulproteus': ['Python'],
+                                    'barry': ['C#']})
+        self.cached.clear()
+
+        # The first time, everybody gets filled, a chunk at a time.
+        self.assertEqual(self.fill(), 2)
+
+        # Nothing changed, so nobody needs it again.
+        self.assertEqual(self.fill(), 0)
+
+        # Only the person whose terms changed gets filled.
+        self.username2terms['paulproteus'] = ['Python', 'Django']
+        self.assertEqual(self.fill(), 1)
+
+        # New bugs mean new recommendations for everybody.
+        mysite.search.models.Epoch.bump_for_model(mysite.search.models.Bug)
+        self.assertEqual(self.fill(), 2)
+
+        # If the cache lets go of them, they get filled again, even though
+        # nothing else changed.
+        self.cached.clear()
+        self.assertEqual(self.fill(), 2)
+        self.assertEqual(self.fill(), 0)
+
 class PersonInfoLinksToSearch(TwillTests):
     fixtures = ['user-paulproteus', 'person-paulproteus']
     
@@ -1267,6 +1353,81 @@ class OtherContributors(TwillTests):
                 [paulproteus]
                 )
 
+class CollaboratorsForLandingPage(TwillTests):
+    fixtures = ['user-paulproteus', 'user-barry', 'person-barry', 'person-paulproteus']
+
+    def count_queries(self, function):
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        try:
+            django.db.reset_queries()
+            value = function()
+            return value, len(django.db.connection.queries)
+        finally:
+            settings.DEBUG = old_debug
+
+    def add_contributors(self, project, how_many, with_photos=False):
+        people = []
+        for i in range(how_many):
+            user = User.objects.create(
+                username='%s-contributor-%d-%s' % (project.name, i,
+                                                   with_photos))
+            person = user.get_profile()
+            if with_photos:
+                Person.objects.filter(id=person.id).update(
+                    photo='static/sample-photo.png')
+            PortfolioEntry.objects.create(person=person, project=project,
+                                          is_published=True)
+            people.append(person)
+        return people
+
+    def test_each_project_is_sampled_in_the_database(self):
+        paul = Person.objects.get(user__username='paulproteus')
+        barry = Person.objects.get(user__username='barry')
+        big = Project.create_dummy(name='Big')
+        small = Project.create_dummy(name='Small')
+        for project in (big, small):
+            PortfolioEntry.objects.create(person=paul, project=project,
+                                          is_published=True)
+        PortfolioEntry.objects.create(person=barry, project=small,
+                                      is_published=True)
+        self.add_contributors(big, 12)
+        photogenic = self.add_contributors(big, 3, with_photos=True)
+        # Unpublished entries don't count.
+        PortfolioEntry.objects.create(person=self.add_contributors(
+                Project.create_dummy(name='Elsewhere'), 1)[0], project=big)
+
+        sample = PortfolioEntry.sample_contributors([big.id, small.id], 5,
+                                                    excluding=paul)
+        self.assertEqual(sample[small.id], [barry.id])
+        self.assertEqual(len(sample[big.id]), 5)
+        self.assertEqual(set(sample[big.id][:3]),
+                         set([person.id for person in photogenic]))
+
+        collaborators = paul.get_collaborators_for_landing_page(n=9)
+        self.assertEqual(len(collaborators), 9)
+        self.assert_(barry in collaborators)
+        self.assert_(paul not in collaborators)
+
+    def test_more_projects_take_no_more_queries(self):
+        paul = Person.objects.get(user__username='paulproteus')
+        first = Project.create_dummy(name='First')
+        PortfolioEntry.objects.create(person=paul, project=first,
+                                      is_published=True)
+        self.add_contributors(first, 3)
+        _, queries_for_one = self.count_queries(
+            paul.get_collaborators_for_landing_page)
+
+        for name in ('Second', 'Third', 'Fourth'):
+            project = Project.create_dummy(name=name)
+            PortfolioEntry.objects.create(person=paul, project=project,
+                                          is_published=True)
+            self.add_contributors(project, 3)
+        collaborators, queries_for_four = self.count_queries(
+            paul.get_collaborators_for_landing_page)
+        self.assertEqual(len(collaborators), 9)
+        self.assertEqual(queries_for_four, queries_for_one)
+
 class UserGetsHisQueuedMessages(TwillTests):
     fixtures = ['user-paulproteus', 'person-paulproteus']
     
@@ -2006,6 +2167,43 @@ class EmailForwarderResolver(TwillTests):
         # this one isn't in the table at all
         test_possible_forwarder_address("oranges", True, False, False)
 
+class PeopleMatcherRefreshesOnlyTheTagThatChanged(TwillTests):
+    fixtures = ['user-paulproteus', 'person-paulproteus',
+                'user-barry', 'person-barry']
+
+    def people_matching_sets(self, mock_set):
+        return [(args[0], simplejson.loads(args[1])['value'])
+                for args, kwargs in mock_set.call_args_list
+                if args[0].startswith('people_matching_')]
+
+    @mock.patch('django.core.cache.cache.set')
+    def test(self, mock_set):
+        paul = Person.objects.get(user__username='paulproteus')
+        barry = Person.objects.get(user__username='barry')
+        can_mentor, _ = TagType.objects.get_or_create(name='can_mentor')
+        python = Tag.objects.create(tag_type=can_mentor, text=u'Python')
+        django_tag = Tag.objects.create(tag_type=can_mentor, text=u'Django')
+        Link_Person_Tag.objects.create(person=barry, tag=python)
+        Link_Person_Tag.objects.create(person=barry, tag=django_tag)
+
+        matcher = mysite.profile.controllers.PeopleMatcher()
+        python_key = matcher.get_cache_key('can_mentor', u'python')
+        self.assertEqual(matcher.get_cache_key('can_mentor', 'PYTHON'),
+                         python_key)
+
+        # Adding a link refreshes its tag's entry, and nobody else's...
+        mock_set.reset_mock()
+        link = Link_Person_Tag.objects.create(person=paul, tag=python)
+        # ...sorted by name: Asheesh comes before Barry.
+        self.assertEqual(self.people_matching_sets(mock_set),
+                         [(python_key, [paul.id, barry.id])])
+
+        # Likewise for taking one away.
+        mock_set.reset_mock()
+        link.delete()
+        self.assertEqual(self.people_matching_sets(mock_set),
+                         [(python_key, [barry.id])])
+
 class PersonTagCache(TwillTests):
     fixtures = ['user-paulproteus', 'person-paulproteus']
 
@@ -2157,12 +2355,424 @@ class FixAllTagsQueryWhenHaystackReturnsHalfPeople(TwillTests):
 class PersonCanReindexHimself(TwillTests):
     fixtures = ['user-paulproteus', 'person-paulproteus']
 
-    @mock.patch('mysite.profile.tasks.ReindexPerson.delay')
-    def test(self, mock_delay):
+    @mock.patch('mysite.profile.tasks.FlushPersonReindexQueue.apply_async')
+    def test(self, mock_apply_async):
         p = Person.objects.get(user__username='paulproteus')
         p.reindex_for_person_search()
-        self.assertEqual(mock_delay.call_args,
-                         ( (), {'person_id': p.id}))
+        self.assertEqual(mock_apply_async.call_args,
+                         ( (), {'countdown':
+                                    mysite.profile.reindex_queue.DELAY}))
+        self.assert_(mysite.profile.models.PersonReindexRequest.objects.get(
+                person=p))
+
+class PersonReindexQueueCoalescesRequests(TwillTests):
+    fixtures = ['user-paulproteus', 'person-paulproteus',
+                'user-barry', 'person-barry']
+
+    @mock.patch('mysite.profile.search_indexes.PersonIndex')
+    @mock.patch('mysite.profile.tasks.FlushPersonReindexQueue.apply_async')
+    def test(self, mock_apply_async, mock_person_index):
+        paul = Person.objects.get(user__username='paulproteus')
+        barry = Person.objects.get(user__username='barry')
+        for i in range(3):
+            paul.reindex_for_person_search()
+        barry.reindex_for_person_search()
+        # One flush for each person who wasn't waiting already...
+        self.assertEqual(mock_apply_async.call_count, 2)
+
+        # ...and the first one to run does everybody.
+        stats = mysite.profile.reindex_queue.flush(batch_size=1)
+        update = mock_person_index.return_value.backend.update
+        self.assertEqual([args[1] for args, kwargs in update.call_args_list],
+                         [[paul], [barry]])
+        self.assertEqual(stats['requests'], 4)
+        self.assertEqual(stats['people_indexed'], 2)
+        self.assertEqual(stats['coalescing_ratio'], 2.0)
+        self.assertEqual(stats['batches'], 2)
+
+        self.assertFalse(mysite.profile.models.PersonReindexRequest.objects.all())
+        self.assertEqual(mysite.profile.reindex_queue.flush(), None)
+
+class PrefetchedIndexDataAgreesWithPerPersonQueries(TwillTests):
+    fixtures = ['user-paulproteus', 'person-paulproteus',
+                'user-barry', 'person-barry']
+
+    def test(self):
+        paul = Person.objects.get(user__username='paulproteus')
+        understands, _ = TagType.objects.get_or_create(name='understands')
+        can_mentor, _ = TagType.objects.get_or_create(name='can_mentor')
+        for tag_type, text in [(understands, u'Python'),
+                               (understands, u'python'),
+                               (can_mentor, u'Django')]:
+            tag = Tag.objects.create(tag_type=tag_type, text=text)
+            Link_Person_Tag.objects.create(person=paul, tag=tag)
+        PortfolioEntry.create_dummy(person=paul, is_published=True,
+                                    project=Project.create_dummy(name=u'Miro'))
+        PortfolioEntry.create_dummy(person=paul, is_published=False)
+        Project.create_dummy(name=u'Exaile').people_who_wanna_help.add(paul)
+
+        index = mysite.profile.search_indexes.PersonIndex(Person)
+        field_names = [name for name in index.fields if name != 'null_document']
+        def prepare(person):
+            return dict([(name, sorted(getattr(index, 'prepare_' + name)(person)))
+                         for name in field_names])
+
+        people = list(Person.objects.all())
+        expected = [prepare(person) for person in people]
+        mysite.profile.search_indexes.prefetch_index_data(people)
+        self.assertEqual([prepare(person) for person in people], expected)
+        self.assertEqual(expected[[p.id for p in people].index(paul.id)][
+                'all_public_projects_lowercase_exact'], [u'miro'])
+
+class ReindexPeopleCommand(TwillTests):
+    fixtures = ['user-paulproteus', 'person-paulproteus',
+                'user-barry', 'person-barry']
+
+    @mock.patch('mysite.profile.search_indexes.PersonIndex')
+    def test_resumes_from_checkpoint(self, mock_person_index):
+        import tempfile
+        import os
+        import simplejson
+        checkpoint = tempfile.mktemp()
+        update = mock_person_index.return_value.backend.update
+        paul = Person.objects.get(user__username='paulproteus')
+        barry = Person.objects.get(user__username='barry')
+
+        # Say an earlier run got through paul's chunk before it died.
+        simplejson.dump({'chunk_size': 1, 'done': [paul.id]},
+                        open(checkpoint, 'w'))
+        management.call_command('reindex_people', chunk_size=1, processes=1,
+                                checkpoint=checkpoint, resume=True)
+        self.assertEqual([args[1] for args, kwargs in update.call_args_list],
+                         [[barry]])
+        # A finished run leaves no checkpoint behind.
+        self.assertFalse(os.path.exists(checkpoint))
+
+class LocalSearchBackend(TwillTests):
+    fixtures = ['user-paulproteus', 'person-paulproteus',
+                'user-barry', 'person-barry']
+
+    def setUp(self):
+        TwillTests.setUp(self)
+        import tempfile
+        import mysite.profile.local_search_backend
+        self.path = tempfile.mktemp()
+        self.backend = mysite.profile.local_search_backend.SearchBackend(
+            path=self.path)
+
+    def tearDown(self):
+        import os
+        for path in (self.path, self.path + '.lock'):
+            if os.path.exists(path):
+                os.remove(path)
+        TwillTests.tearDown(self)
+
+    def search(self, **kwargs):
+        import haystack.query
+        import mysite.profile.local_search_backend
+        query = mysite.profile.local_search_backend.SearchQuery(
+            backend=self.backend)
+        results = haystack.query.SearchQuerySet(query=query).all().filter(
+            **kwargs)
+        return mysite.base.controllers.haystack_results2db_objects(results)
+
+    def use_this_backend_in_the_views(self):
+        """Make the people search views ask self.backend. Returns the real
+        SearchQuerySet, for putting back afterwards."""
+        import haystack.query
+        import mysite.profile.local_search_backend
+        def make_search_query_set():
+            return haystack.query.SearchQuerySet(
+                query=mysite.profile.local_search_backend.SearchQuery(
+                    backend=self.backend))
+        real_search_query_set = mysite.profile.views.haystack.query.SearchQuerySet
+        mysite.profile.views.haystack.query.SearchQuerySet = make_search_query_set
+        return real_search_query_set
+
+    def test(self):
+        paul = Person.objects.get(user__username='paulproteus')
+        barry = Person.objects.get(user__username='barry')
+        can_mentor, _ = TagType.objects.get_or_create(name='can_mentor')
+        for person in (paul, barry):
+            Link_Person_Tag.objects.create(person=person, tag=Tag.objects.create(
+                    tag_type=can_mentor, text=u'Python'))
+        Project.create_dummy(name=u'Exaile').people_who_wanna_help.add(paul)
+
+        index = mysite.profile.search_indexes.PersonIndex(Person)
+        self.backend.update(index, [paul, barry])
+        self.assertEqual(
+            set(self.search(can_mentor_lowercase_exact=u'python')),
+            set([paul, barry]))
+        self.assertEqual(
+            self.search(can_mentor_lowercase_exact=u'python',
+                        all_wanna_help_projects_lowercase_exact=u'exaile'),
+            [paul])
+
+        # Another process (or a restart) reads it back from the file.
+        import mysite.profile.local_search_backend
+        index_file = mysite.profile.local_search_backend.IndexFile(self.path)
+        self.assertEqual(len(index_file.evaluate(None)), 2)
+
+        self.backend.remove(paul)
+        self.assertEqual(self.search(can_mentor_lowercase_exact=u'python'),
+                         [barry])
+
+    def test_people_search_asks_the_backend_once(self):
+        import haystack.query
+        import mysite.profile.local_search_backend
+        paul = Person.objects.get(user__username='paulproteus')
+        barry = Person.objects.get(user__username='barry')
+        can_mentor, _ = TagType.objects.get_or_create(name='can_mentor')
+        can_pitch_in, _ = TagType.objects.get_or_create(name='can_pitch_in')
+        for person, tag_type, text in [(paul, can_mentor, u'Python'),
+                                       (paul, can_pitch_in, u'Python'),
+                                       (barry, can_pitch_in, u'python')]:
+            Link_Person_Tag.objects.create(person=person, tag=Tag.objects.create(
+                    tag_type=tag_type, text=text))
+        Project.create_dummy(name=u'Exaile', language=u'Python')
+        PortfolioEntry.create_dummy(person=paul, is_published=True,
+                                    project=Project.objects.get(name=u'Exaile'))
+        index = mysite.profile.search_indexes.PersonIndex(Person)
+        self.backend.update(index, [paul, barry])
+
+        searches = []
+        real_search = self.backend.search
+        def search(*args, **kwargs):
+            searches.append(args)
+            return real_search(*args, **kwargs)
+        self.backend.search = search
+        real_search_query_set = self.use_this_backend_in_the_views()
+        try:
+            people, extra_data = mysite.profile.views.all_tags_query2mappable_orm_people(
+                {'q': u'Python'})
+            self.assertEqual(len(searches), 1)
+            self.assertEqual(people, [barry, paul])
+            self.assertEqual(people[0].reasons, ['can pitch in with'])
+            self.assertEqual(people[1].reasons, ['can mentor in',
+                                                 'can pitch in with'])
+            self.assertEqual(extra_data[
+                    'suggestions_for_searches_regarding_people_who_can_pitch_in'],
+                             [{'query': u'python', 'count': 2}])
+
+            searches[:] = []
+            people, extra_data = mysite.profile.views.project_query2mappable_orm_people(
+                {'q': u'exaile', 'query_type': 'project'})
+            self.assertEqual(len(searches), 1)
+            self.assertEqual(people, [paul])
+            self.assertEqual(extra_data[
+                    'suggestions_for_searches_regarding_people_who_can_pitch_in'],
+                             [{'query': u'Python', 'count': 2,
+                               'summary_addendum': ", Exaile's primary language"}])
+            self.assertEqual(extra_data[
+                    'suggestions_for_searches_regarding_people_who_can_mentor'],
+                             [{'query': u'Python', 'count': 1,
+                               'summary_addendum': ", Exaile's primary language"}])
+        finally:
+            mysite.profile.views.haystack.query.SearchQuerySet = real_search_query_set
+
+    def test_project_search_suggests_people_who_can_mentor_in_it(self):
+        paul = Person.objects.get(user__username='paulproteus')
+        barry = Person.objects.get(user__username='barry')
+        exaile = Project.create_dummy(name=u'Exaile', language=u'Python')
+        can_mentor, _ = TagType.objects.get_or_create(name='can_mentor')
+        can_pitch_in, _ = TagType.objects.get_or_create(name='can_pitch_in')
+        for person, tag_type in [(paul, can_mentor), (barry, can_pitch_in)]:
+            Link_Person_Tag.objects.create(person=person, tag=Tag.objects.create(
+                    tag_type=tag_type, text=u'Exaile'))
+            PortfolioEntry.create_dummy(person=person, is_published=True,
+                                        project=exaile)
+        index = mysite.profile.search_indexes.PersonIndex(Person)
+        self.backend.update(index, [paul, barry])
+
+        real_search_query_set = self.use_this_backend_in_the_views()
+        try:
+            people, extra_data = mysite.profile.views.project_query2mappable_orm_people(
+                {'q': u'Exaile', 'query_type': 'project'})
+        finally:
+            mysite.profile.views.haystack.query.SearchQuerySet = real_search_query_set
+        self.assertEqual(people, [barry, paul])
+        self.assertEqual(extra_data[
+                'suggestions_for_searches_regarding_people_who_can_mentor'],
+                         [{'query': u'exaile', 'count': 1}])
+        self.assertEqual(extra_data[
+                'suggestions_for_searches_regarding_people_who_can_pitch_in'],
+                         [{'query': u'exaile', 'count': 1}])
+
+class PeopleMapTest(TwillTests):
+    """Paul and Barry, ready to be put on the people map."""
+    fixtures = ['user-paulproteus', 'person-paulproteus',
+                'user-barry', 'person-barry']
+
+    @mock.patch('mysite.base.controllers._geocode')
+    def move(self, username, address, latitude, longitude, mock_geocoder):
+        """Confirm that somebody lives at address, which the geocoder
+        will say is at (latitude, longitude)."""
+        mock_geocoder.return_value = {'latitude': latitude,
+                                      'longitude': longitude,
+                                      'suggested_zoom_level': 4}
+        person = Person.objects.get(user__username=username)
+        person.location_confirmed = True
+        person.location_display_name = address
+        person.save()
+
+    def move_to_norway(self):
+        self.move('paulproteus', 'Oslo, Norway', 59.9, 10.7)
+        self.move('barry', 'Bergen, Norway', 60.4, 5.3)
+
+class PeopleMapClusters(PeopleMapTest):
+
+    def get_clusters(self, zoom, south, west, north, east):
+        response = Client().get('/people/map/clusters/', {
+                'zoom': zoom, 'south': south, 'west': west,
+                'north': north, 'east': east})
+        return simplejson.loads(response.content)['clusters']
+
+    def test(self):
+        self.move_to_norway()
+
+        # Zoomed out, Norway is one cluster.
+        clusters = self.get_clusters(3, 50, 0, 70, 20)
+        self.assertEqual([cluster['count'] for cluster in clusters], [2])
+        self.assertAlmostEqual(clusters[0]['latitude'], 60.15)
+        # Zoomed in, Oslo and Bergen come apart.
+        self.assertEqual(len(self.get_clusters(10, 50, 0, 70, 20)), 2)
+        # Nobody in the viewport, nothing to show.
+        self.assertEqual(self.get_clusters(3, -50, 100, -10, 170), [])
+
+        # Barry moves; only his cells change.
+        self.move('barry', 'Sydney, Australia', -33.9, 151.2)
+        self.assertEqual([cluster['count'] for cluster in
+                          self.get_clusters(3, 50, 0, 70, 20)], [1])
+        self.assertEqual([cluster['count'] for cluster in
+                          self.get_clusters(3, -50, 100, -10, 170)], [1])
+
+        # Counting from scratch agrees with the counts we kept.
+        PeopleMapCell = mysite.profile.models.PeopleMapCell
+        counts = list(PeopleMapCell.objects.filter(
+            count__gt=0).order_by('geohash').values_list('geohash', 'count'))
+        mysite.profile.people_map.rebuild()
+        self.assertEqual(counts, list(
+            PeopleMapCell.objects.order_by(
+                'geohash').values_list('geohash', 'count')))
+
+        # If they've drifted, rebuilding fixes the cells that are wrong and
+        # leaves the rest of the rows alone.
+        cell_ids = sorted(PeopleMapCell.objects.values_list('id', flat=True))
+        PeopleMapCell.objects.filter(geohash='u').update(count=99)
+        mysite.profile.models.PersonMapLocation.objects.filter(
+            person__user__username='barry').delete()
+        mysite.profile.people_map.rebuild()
+        self.assertEqual(counts, list(
+            PeopleMapCell.objects.order_by(
+                'geohash').values_list('geohash', 'count')))
+        self.assertEqual(cell_ids, sorted(
+                PeopleMapCell.objects.values_list('id', flat=True)))
+        self.assertEqual(mysite.profile.models.PersonMapLocation.objects.count(),
+                         2)
+
+    def test_people_page_leaves_everybody_to_the_clusters(self):
+        self.move_to_norway()
+        response = Client().get('/people/')
+        context = response.context[0]
+        self.assert_(context['map_shows_clusters'])
+        self.assertEqual(list(context['people']), [])
+        self.assertEqual(context['everybody_count'], 2)
+        self.assertEqual(simplejson.loads(context['person_id2data_as_json']),
+                         {})
+        self.assertContains(response, '/people/map/clusters/')
+        self.assertNotContains(response, 'Oslo, Norway')
+
+    def test_bad_request(self):
+        response = Client().get('/people/map/clusters/', {'zoom': 'far'})
+        self.assertEqual(response.status_code, 400)
+
+class PeopleNearACenter(PeopleMapTest):
+    def setUp(self):
+        PeopleMapTest.setUp(self)
+        self.move_to_norway()
+        self.paul = Person.objects.get(user__username='paulproteus')
+        self.barry = Person.objects.get(user__username='barry')
+
+    def test(self):
+        # Bergen is about 300 km from Oslo.
+        self.assertEqual(
+            [person_id for distance, person_id in
+             mysite.profile.people_map.people_near(59.9, 10.7, 100)],
+            [self.paul.id])
+        self.assertEqual(
+            [person_id for distance, person_id in
+             mysite.profile.people_map.people_near(60.4, 5.3, 400)],
+            [self.barry.id, self.paul.id])
+
+    @mock.patch('mysite.profile.views.PEOPLE_NEAR_PAGE_SIZE', 1)
+    def test_view_pages_by_distance(self):
+        GET_data = {'center': 'Oslo, Norway', 'within': '400'}
+        response = Client().get('/people/', GET_data)
+        context = response.context[0]
+        self.assertEqual(list(context['people']), [self.paul])
+        self.assertEqual(context['nearby_count'], 2)
+        self.assertFalse(context.get('previous_page_url'))
+        self.assert_(context['next_page_url'])
+
+        response = Client().get('/people/', dict(GET_data, page='2'))
+        context = response.context[0]
+        self.assertEqual(list(context['people']), [self.barry])
+        self.assert_(context['previous_page_url'])
+        self.assertFalse(context.get('next_page_url'))
+
+class PopularityRankings(TwillTests):
+    fixtures = ['user-paulproteus', 'person-paulproteus',
+                'user-barry', 'person-barry']
+
+    def test(self):
+        PopularityRanking = mysite.profile.models.PopularityRanking
+        paul = Person.objects.get(user__username='paulproteus')
+        barry = Person.objects.get(user__username='barry')
+        understands, _ = TagType.objects.get_or_create(name='understands')
+        can_mentor, _ = TagType.objects.get_or_create(name='can_mentor')
+        for person, tag_type, text in [(paul, understands, u'Python'),
+                                       (barry, understands, u'python'),
+                                       (paul, can_mentor, u'Python'),
+                                       (paul, understands, u'PYTHON'),
+                                       (paul, understands, u'Django')]:
+            tag, _ = Tag.objects.get_or_create(tag_type=tag_type, text=text)
+            Link_Person_Tag.objects.create(person=person, tag=tag)
+        exaile, _ = Project.objects.get_or_create(name='Exaile')
+        banshee, _ = Project.objects.get_or_create(name='Banshee')
+        for person, project, is_published in [(paul, exaile, True),
+                                              (barry, exaile, True),
+                                              (paul, banshee, True),
+                                              (barry, banshee, False)]:
+            PortfolioEntry.objects.create(person=person, project=project,
+                                          is_published=is_published)
+
+        # Counted the way Tag.get_people_by_tag_name would count them: once
+        # for each tag type a person lists the tag under, however they
+        # spell it.
+        self.assertEqual(dict(PopularityRanking.count_tags()),
+                         {u'python': 3, u'django': 1})
+        self.assertEqual(PopularityRanking.count_projects(),
+                         {u'Exaile': 2, u'Banshee': 1})
+
+        mysite.profile.tasks.refresh_popularity_rankings()
+        self.assertEqual(PopularityRanking.get_top('tag', 6),
+                         [u'python', u'django'])
+        self.assertEqual(PopularityRanking.get_top('project', 1), [u'Exaile'])
+
+        # Refreshing keeps one row per name.
+        PortfolioEntry.objects.filter(project=exaile).update(is_deleted=True)
+        mysite.profile.tasks.refresh_popularity_rankings()
+        self.assertEqual(PopularityRanking.get_top('project', 6),
+                         [u'Banshee'])
+        self.assertEqual(PopularityRanking.objects.filter(
+                kind='project').count(), 1)
+
+    @mock.patch('mysite.profile.models.PopularityRanking.count_projects')
+    def test_people_page_never_counts(self, mock_count_projects):
+        # Counting is for the migration and the scheduled task.
+        response = Client().get('/people/')
+        self.assertEqual(response.context[0]['suggestions'][0]['values'], [])
+        self.assertFalse(mock_count_projects.called)
 
 class PersonCanSetHisExpandNextStepsOption(TwillTests):
     fixtures = ['user-paulproteus', 'person-paulproteus']
@@ -2221,11 +2831,20 @@ class BugModificationTimeVersusEpoch(TwillTests):
         epoch_at_start = mysite.search.models.Epoch.get_for_model(
             mysite.search.models.Bug)
         b = mysite.search.models.Bug.create_dummy_with_project()
-        mysite.profile.tasks.sync_bug_epoch_from_model_then_fill_recommended_bugs_cache()
+        self.assert_(mysite.profile.tasks.sync_bug_epoch_from_model())
         new_epoch = mysite.search.models.Epoch.get_for_model(
             mysite.search.models.Bug)
         self.assert_(new_epoch > epoch_at_start)
-        self.assert_(mock_thing.called)
+        # The hourly command fills the cache itself, just once.
+        self.assertFalse(mock_thing.called)
+
+    @mock.patch('mysite.profile.recommendation_cache.fill')
+    @mock.patch('mysite.profile.tasks.fill_recommended_bugs_cache.delay')
+    def test_hourly_tasks_fill_once(self, mock_delay, mock_fill):
+        mysite.search.models.Bug.create_dummy_with_project()
+        management.call_command('profile_hourly_tasks')
+        self.assertEqual(mock_fill.call_count, 1)
+        self.assertFalse(mock_delay.called)
 
 class SaveReordering(TwillTests):
     fixtures = ['user-paulproteus', 'person-paulproteus']
@@ -29,11 +29,12 @@ import haystack.query
 import mysite.base.controllers
 import mysite.base.unicode_sanity
 import mysite.profile.controllers
+import mysite.profile.people_map
 import mysite.base.helpers
 from mysite.profile.models import \
         Person, Tag, TagType, \
         Link_Project_Tag, Link_Person_Tag, \
-        DataImportAttempt, PortfolioEntry, Citation
+        DataImportAttempt, PortfolioEntry, Citation, PopularityRanking
 from mysite.search.models import Project
 from mysite.base.decorators import view
 import mysite.profile.forms
@@ -314,9 +315,8 @@ def edit_person_info_do(request):
 
     person.save()
 
-    # Enqueue a background task to re-index the person
-    task = mysite.profile.tasks.ReindexPerson()
-    task.delay(person_id=person.id)
+    # Ask for the person to be re-indexed, soon
+    person.reindex_for_person_search()
 
     if errors_occurred:
         return edit_info(request,
@@ -375,57 +375,83 @@ def tag_type_query2mappable_orm_people(tag_type_short_name, parsed_query):
 
     return mappable_people, {}
 
+# How many hits to ask the search backend for at first. If there turn out
+# to be more, we go back once for the rest.
+PEOPLE_SEARCH_FIRST_HITS = 500
+
+def people_matching_any(clauses):
+    """Ask the search backend, in one query, for the people who match any
+    of the (field name, value) clauses. Returns a dict mapping each
+    matching Person to the set of clauses they match, worked out from the
+    stored fields the backend sends back with each hit."""
+    if not clauses:
+        return {}
+    results = haystack.query.SearchQuerySet().all()
+    field_name, value = clauses[0]
+    results = results.filter(**{field_name: value})
+    for field_name, value in clauses[1:]:
+        results = results.filter_or(**{field_name: value})
+
+    hits = results[:PEOPLE_SEARCH_FIRST_HITS]
+    hit_count = results.count()
+    if hit_count > len(hits):
+        hits = results[:hit_count]
+
+    pk2clauses = {}
+    for hit in hits:
+        if hit is None:
+            continue
+        matched = set()
+        for field_name, value in clauses:
+            stored = getattr(hit, field_name, None) or []
+            if isinstance(stored, basestring):
+                stored = [stored]
+            if value in stored:
+                matched.add((field_name, value))
+        pk2clauses[int(hit.pk)] = matched
+
+    # One query for all of them (and their Users, which we sort by).
+    people = Person.objects.filter(id__in=pk2clauses.keys()).select_related(
+        'user')
+    return dict([(person, pk2clauses[person.id]) for person in people])
+
 def all_tags_query2mappable_orm_people(parsed_query):
-    # do three queries...
-    # the values are set()s containing ID numbers of Django ORM Person objects
     queries_in_order = ['can_mentor_lowercase_exact',
                         'can_pitch_in_lowercase_exact',
                         'understands_lowercase_exact']
-    query2results = {queries_in_order[0]: set(),
-                     queries_in_order[1]: set(),
-                     queries_in_order[2]: set()}
-    for query in query2results:
-        # ask haystack...
-        mappable_people_from_haystack = haystack.query.SearchQuerySet().all()
-        mappable_people_from_haystack = mappable_people_from_haystack.filter(**{query: parsed_query['q'].lower()})
-        
-        results = mysite.base.controllers.haystack_results2db_objects(
-            mappable_people_from_haystack)
-        query2results[query] = results
-
-        ### mappable_people
-        mappable_people_set = set()
-        for result_set in query2results.values():
-            mappable_people_set.update(result_set)
+    q = parsed_query['q'].lower()
+    person2clauses = people_matching_any(
+        [(query, q) for query in queries_in_order])
 
-        ### and sort it the way everyone expects
-        mappable_people = sorted(mappable_people_set, key=lambda p: p.user.username.lower())
+    ### and sort it the way everyone expects
+    mappable_people = sorted(person2clauses, key=lambda p: p.user.username.lower())
 
-        ### Justify your existence time: Why is each person a valid match?
-        for person in mappable_people:
-            person.reasons = [query for query in queries_in_order
-                              if person in query2results[query]]
+    ### Justify your existence time: Why is each person a valid match?
+    query2count = collections.defaultdict(int)
+    for person in mappable_people:
+        person.reasons = [query for query in queries_in_order
+                          if (query, q) in person2clauses[person]]
+        for query in person.reasons:
+            query2count[query] += 1
 
-            # now we have to clean this up. First, remove teh _lowercase_exact from the end
-            person.reasons = [ s.replace('_lowercase_exact', '') for s in person.reasons]
-            # then make it the human readable form as said by the TagType dict
-            person.reasons = [TagType.short_name2long_name[s] for s in person.reasons]
+        # now we have to clean this up. First, remove teh _lowercase_exact from the end
+        person.reasons = [ s.replace('_lowercase_exact', '') for s in person.reasons]
+        # then make it the human readable form as said by the TagType dict
+        person.reasons = [TagType.short_name2long_name[s] for s in person.reasons]
 
     extra_data = {}
     ## How many possible mentors
     extra_data['suggestions_for_searches_regarding_people_who_can_mentor'] = []
-    mentor_people = query2results['can_mentor_lowercase_exact']
-    if mentor_people:
+    if query2count['can_mentor_lowercase_exact']:
         extra_data['suggestions_for_searches_regarding_people_who_can_mentor'].append(
-            {'query': parsed_query['q'].lower(),
-             'count': len(mentor_people)})
+            {'query': q,
+             'count': query2count['can_mentor_lowercase_exact']})
 
     extra_data['suggestions_for_searches_regarding_people_who_can_pitch_in'] = []
     ## Does this relate to people who can pitch in?
-    can_pitch_in_people = query2results['can_pitch_in_lowercase_exact']
-    if can_pitch_in_people:
+    if query2count['can_pitch_in_lowercase_exact']:
         extra_data['suggestions_for_searches_regarding_people_who_can_pitch_in'].append(
-            {'query': parsed_query['q'].lower(), 'count': len(can_pitch_in_people)})
+            {'query': q, 'count': query2count['can_pitch_in_lowercase_exact']})
 
     return mappable_people, extra_data
 
@@ -460,61 +486,75 @@ def people_who_want_to_help(parsed_query):
 
 def project_query2mappable_orm_people(parsed_query):
     assert parsed_query['query_type'] == 'project'
-    
-    mappable_people_from_haystack = haystack.query.SearchQuerySet().all()
-    haystack_field_name = 'all_public_projects_lowercase_exact'
-    mappable_people_from_haystack = mappable_people_from_haystack.filter(
-        **{haystack_field_name: parsed_query['q'].lower()})
-    mappable_people = set(
-        mysite.base.controllers.haystack_results2db_objects(mappable_people_from_haystack))
-    
+    q = parsed_query['q'].lower()
+    orm_projects = Project.objects.filter(name__iexact=parsed_query['q'])
+
+    # One query finds the people who worked on the project, and also the
+    # ones who can mentor or pitch in with it or its language, for the
+    # suggestions.
+    clauses = [('all_public_projects_lowercase_exact', q),
+               ('can_mentor_lowercase_exact', q),
+               ('can_pitch_in_lowercase_exact', q)]
+    for orm_project in orm_projects:
+        language = orm_project.language.lower()
+        if language:
+            clauses.append(('can_pitch_in_lowercase_exact', language))
+            clauses.append(('can_mentor_lowercase_exact', language))
+    person2clauses = people_matching_any(clauses)
+
+    def count(*wanted_clauses):
+        return len([person for person, matched in person2clauses.items()
+                    if set(wanted_clauses).issubset(matched)])
+
+    mappable_people = [person for person, matched in person2clauses.items()
+                       if ('all_public_projects_lowercase_exact', q) in matched]
     mappable_people = list(
         sorted(mappable_people,
                key=lambda x: x.user.username))
     
     extra_data = {}
 
-    mentor_people = mappable_people_from_haystack.filter(**{'can_mentor_lowercase_exact': parsed_query['q'].lower()})
-    can_pitch_in_people = mappable_people_from_haystack.filter(**{'can_pitch_in_lowercase_exact': parsed_query['q'].lower()})
+    mentor_count = count(('all_public_projects_lowercase_exact', q),
+                         ('can_mentor_lowercase_exact', q))
+    can_pitch_in_count = count(('all_public_projects_lowercase_exact', q),
+                               ('can_pitch_in_lowercase_exact', q))
 
     extra_data['suggestions_for_searches_regarding_people_who_can_mentor'] = []
     extra_data['suggestions_for_searches_regarding_people_who_can_pitch_in'] = []
 
     ## How many possible mentors
-    if mentor_people:
+    if mentor_count:
         extra_data['suggestions_for_searches_regarding_people_who_can_mentor'].append(
-            {'query': parsed_query['q'].lower(),
-             'count': len(mentor_people)})
+            {'query': q,
+             'count': mentor_count})
 
     ## Does this relate to people who can pitch in?
-    if can_pitch_in_people:
+    if can_pitch_in_count:
         extra_data['suggestions_for_searches_regarding_people_who_can_pitch_in'].append(
-            {'query': parsed_query['q'].lower(), 'count': len(can_pitch_in_people)})
+            {'query': q, 'count': can_pitch_in_count})
     
-    orm_projects = Project.objects.filter(name__iexact=parsed_query['q'])
-
     ## populate suggestions_for_searches_regarding_people_who_can_pitch_in
     ## that expects a {'query': X, 'count': Y} dict
     suggestions_for_searches_regarding_people_who_can_pitch_in = []
     for orm_project in orm_projects:
-        people_who_can_pitch_in_with_project_language = haystack.query.SearchQuerySet(
-            ).all().filter(can_pitch_in_lowercase_exact=orm_project.language.lower())
-        if people_who_can_pitch_in_with_project_language:
+        n = count(('can_pitch_in_lowercase_exact',
+                   orm_project.language.lower()))
+        if n:
             suggestions_for_searches_regarding_people_who_can_pitch_in.append(
                 {'query': orm_project.language,
-                 'count': len(people_who_can_pitch_in_with_project_language),
+                 'count': n,
                  'summary_addendum': ", %s's primary language" % orm_project.name})
 
 
     # Suggestions for possible mentors
     suggestions_for_searches_regarding_people_who_can_mentor = []
     for orm_project in orm_projects:
-        people_who_could_mentor_in_the_project_language = haystack.query.SearchQuerySet(
-            ).all().filter(can_mentor_lowercase_exact=orm_project.language.lower())
-        if people_who_could_mentor_in_the_project_language:
+        n = count(('can_mentor_lowercase_exact',
+                   orm_project.language.lower()))
+        if n:
             suggestions_for_searches_regarding_people_who_can_mentor.append(
                 {'query': orm_project.language,
-                 'count': len(people_who_could_mentor_in_the_project_language),
+                 'count': n,
                  'summary_addendum': ", %s's primary language" % orm_project.name})
 
     extra_data['suggestions_for_searches_regarding_people_who_can_pitch_in'
@@ -525,6 +565,39 @@ def project_query2mappable_orm_people(parsed_query):
 
     return mappable_people, extra_data
 
+# How many people to show at a time when showing the ones near somewhere.
+PEOPLE_NEAR_PAGE_SIZE = 50
+
+def page_of_people_near(everybody, nearby, page):
+    """Given the (distance, person id) pairs people_map.people_near found,
+    return the page'th PEOPLE_NEAR_PAGE_SIZE of them that are also in
+    everybody (None means everybody at all), nearest first, and how many
+    there are on all the pages."""
+    if everybody is None:
+        ranked = nearby
+    else:
+        id2person = dict([(person.id, person) for person in everybody])
+        ranked = [(distance, person_id) for distance, person_id in nearby
+                  if person_id in id2person]
+    start = (page - 1) * PEOPLE_NEAR_PAGE_SIZE
+    ranked_page = ranked[start:start + PEOPLE_NEAR_PAGE_SIZE]
+    if everybody is None:
+        id2person = Person.objects.select_related('user').in_bulk(
+            [person_id for distance, person_id in ranked_page])
+
+    people = []
+    for distance, person_id in ranked_page:
+        if person_id in id2person:
+            person = id2person[person_id]
+            person.distance_in_km = distance
+            people.append(person)
+    return people, len(ranked)
+
+def get_page_url(request, page):
+    GET_data = request.GET.copy()
+    GET_data['page'] = str(page)
+    return '?' + GET_data.urlencode()
+
 @view
 def people(request):
     """Display a list of people."""
@@ -548,6 +621,22 @@ def people(request):
                     projects_that_match_q_exactly.append(project)
         data['projects_that_match_q_exactly'] = projects_that_match_q_exactly
 
+    # If they asked for people within some distance of the center, find
+    # them on the map's grid before anything else.
+    center = request.GET.get('center', '')
+    nearby = None
+    try:
+        within = float(request.GET.get('within', ''))
+    except ValueError:
+        within = None
+    if center and within is not None and within > 0:
+        center_geocoded = mysite.base.controllers.geocoding_without_waiting(
+            [center])[center]
+        if 'latitude' in center_geocoded:
+            nearby = mysite.profile.people_map.people_near(
+                center_geocoded['latitude'], center_geocoded['longitude'],
+                within)
+
     # Get the list of people to display.
 
     if parsed_query['q'].strip():
@@ -555,8 +644,31 @@ def people(request):
         everybody, extra_data = query2results(parsed_query)
         data.update(extra_data)
 
+    elif nearby is None:
+        # Everybody is too many to list, or to put on the map one by one.
+        # The map asks people_map_clusters about whatever part of the
+        # world it's showing.
+        everybody = []
+        data['map_shows_clusters'] = True
+        data['everybody_count'] = Person.objects.count()
+
     else:
-        everybody = Person.objects.all().order_by('user__username')
+        everybody = None
+
+    if nearby is not None:
+        try:
+            page = max(1, int(request.GET.get('page', 1)))
+        except ValueError:
+            page = 1
+        everybody, data['nearby_count'] = page_of_people_near(
+            everybody, nearby, page)
+        data['within'] = request.GET['within']
+        data['first_nearby'] = (page - 1) * PEOPLE_NEAR_PAGE_SIZE + 1
+        data['last_nearby'] = data['first_nearby'] + len(everybody) - 1
+        if page > 1:
+            data['previous_page_url'] = get_page_url(request, page - 1)
+        if data['last_nearby'] < data['nearby_count']:
+            data['next_page_url'] = get_page_url(request, page + 1)
 
     # filter by query, if it is set
     data['people'] = everybody
@@ -569,57 +681,41 @@ def people(request):
     data['person_id2data_as_json'] = simplejson.dumps(person_id2data)
     data['test_js'] = request.GET.get('test', None)
     data['num_of_persons_with_locations'] = len(person_id2data)
-    if request.GET.get('center', False):
-        data['center_json'] = mysite.base.controllers.cached_geocoding_in_json(
-            request.GET.get('center', ''))
-        # the below is true when we fail to geocode the center that we got from GET
-        if data['center_json'] == 'null':
-            data['geocode_failed'] = True;
+    # Everyone's location, and the ?center=, come out of one query; none
+    # of them waits on the geocoder.
+    addresses = set([person_data['location']
+                     for person_data in person_id2data.values()])
+    if center:
+        addresses.add(center)
+    address2geocoded = mysite.base.controllers.geocoding_without_waiting(
+        list(addresses))
+
+    if center:
+        # If we haven't geocoded the center yet, we show everybody; it'll
+        # be ready next time.
+        if 'latitude' in address2geocoded[center]:
+            data['center_json'] = simplejson.dumps(address2geocoded[center])
         data['center_name'] = request.GET.get('center', '')
         data['center_name_json'] = simplejson.dumps(request.GET.get('center', ''))
 
     data['show_everybody_javascript_boolean'] = simplejson.dumps(not data.get('center_json', False))
 
     data['person_id2lat_long_as_json'] = simplejson.dumps(
-        dict( (person_id, simplejson.loads(mysite.base.controllers.cached_geocoding_in_json(person_id2data[person_id]['location'])))
+        dict( (person_id, address2geocoded[person_id2data[person_id]['location']])
               for person_id in person_id2data))
 
+    # Of the people we list, the ones without a public location.
     data['inaccessible_islander_ids'] = simplejson.dumps(
-                list(
-                    Person.inaccessible_islanders().values_list('id', flat=True)
-                )
-            )
+        [person_id for person_id in person_id2data
+         if address2geocoded[person_id2data[person_id]['location']][
+                'is_inaccessible']])
 
     suggestion_count = 6
 
-    cache_timespan = 86400 * 7
-    #if settings.DEBUG:
-    #    cache_timespan = 0
-
-    key_name = 'most_popular_projects_last_flushed_on_20100325'
-    popular_projects = cache.get(key_name)
-    if popular_projects is None:
-        projects = Project.objects.all()
-        popular_projects = sorted(projects, key=lambda proj: len(proj.get_contributors())*(-1))[:suggestion_count]
-        #extract just the names from the projects
-        popular_projects = [project.name for project in popular_projects]
-        # cache it for a week
-        cache.set(key_name, popular_projects, cache_timespan)
-
-    key_name = 'most_popular_tags'
-    popular_tags = cache.get(key_name)
-    if popular_tags is None:
-        # to get the most popular tags:
-            # get all tags
-            # order them by the number of people that list them
-            # remove duplicates
-        tags = Tag.objects.all()
-        #lowercase them all and then remove duplicates
-        tags_with_no_duplicates = list(set(map(lambda tag: tag.name.lower(), tags)))
-        #take the popular ones
-        popular_tags = sorted(tags_with_no_duplicates, key=lambda tag_name: len(Tag.get_people_by_tag_name(tag_name))*(-1))[:suggestion_count]
-        # cache it for a week
-        cache.set(key_name, popular_tags, cache_timespan)
+    # These get counted every so often by the
+    # refresh_popularity_rankings task.
+    popular_projects = PopularityRanking.get_top('project', suggestion_count)
+    popular_tags = PopularityRanking.get_top('tag', suggestion_count)
 
     # Populate matching_project_suggestions
     # (unless query is icanhelp, in which case it's not relevant enough)
@@ -681,6 +777,22 @@ def people(request):
 
     return (request, 'profile/search_people.html', data)
 
+def people_map_clusters(request):
+    """JSON for the people map: the clusters of people in the viewport
+    given by ?south=&west=&north=&east=, at zoom level ?zoom=."""
+    try:
+        zoom = int(request.GET['zoom'])
+        south, west, north, east = [float(request.GET[edge])
+                                    for edge in ('south', 'west',
+                                                 'north', 'east')]
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest(
+            "Pass zoom, south, west, north and east.")
+    clusters = mysite.profile.people_map.get_clusters(
+        zoom, south, west, north, east)
+    json = simplejson.dumps({'clusters': clusters})
+    return HttpResponse(json, mimetype='application/json')
+
 def gimme_json_for_portfolio(request):
     "Get JSON used to live-update the portfolio editor."
     """JSON includes:
@@ -7,6 +7,7 @@ import django.template
 import mysite.base.decorators
 import mysite.profile.views
 import mysite.project.forms
+import mysite.search.tasks
 
 from django.http import HttpResponse, HttpResponseRedirect, \
         HttpResponsePermanentRedirect, HttpResponseServerError, HttpResponseBadRequest
@@ -322,7 +323,8 @@ def edit_project(request, project__name):
         form = mysite.project.forms.ProjectForm(request.POST, request.FILES, instance=project)
         if form.is_valid():
             project = form.save()
-            project.update_scaled_icons_from_self_icon()
+            mysite.search.tasks.generate_project_icons.delay(
+                project_id=project.id)
 
             import logging
 
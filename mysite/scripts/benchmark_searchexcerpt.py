@@ -0,0 +1,122 @@
+#!../../bin/python
+
+# Compare the searchexcerpt and highlight template tags with the way they
+# worked before they cached their compiled regexes and stopped splitting
+# the whole text into words. Checks that both give the same answers, then
+# times them on long, made-up bug descriptions.
+#
+# Run it like: DJANGO_SETTINGS_MODULE=mysite.settings python benchmark_searchexcerpt.py
+
+import re
+import random
+import timeit
+from itertools import ifilter
+
+import mysite.search.templatetags.search as tags
+
+def old_searchexcerpt(text, phrases, context_words=10, ignore_case=True, word_boundary=True):
+    # Brian Beck's original, minus the settings lookups.
+    if isinstance(phrases, basestring):
+        phrases = [phrases]
+    phrases = map(re.escape, phrases)
+    flags = ignore_case and re.I or 0
+    exprs = [re.compile(r"^%s$" % p, flags) for p in phrases]
+    whitespace = re.compile(r'\s+')
+
+    re_template = word_boundary and r"\b(%s)\b" or r"(%s)"
+    pieces = re.compile(re_template % "|".join(phrases), flags).split(text)
+    matches = {}
+    word_lists = []
+    index = {}
+    for i, piece in enumerate(pieces):
+        word_lists.append(whitespace.split(piece))
+        if i % 2:
+            index[i] = expr = ifilter(lambda e: e.match(piece), exprs).next()
+            matches.setdefault(expr, []).append(i)
+
+    def merge(lists):
+        merged = []
+        for words in lists:
+            if merged:
+                merged[-1] += words[0]
+                del words[0]
+            merged.extend(words)
+        return merged
+
+    i = 0
+    merged = []
+    # The original walked these in dict order; sorted is what it meant.
+    for j in sorted(map(min, matches.itervalues())):
+        merged.append(merge(word_lists[i:j]))
+        merged.append(word_lists[j])
+        i = j + 1
+    merged.append(merge(word_lists[i:]))
+
+    output = []
+    for i, words in enumerate(merged):
+        omit = None
+        if i == len(merged) - 1:
+            omit = slice(max(1, 2 - i) * context_words + 1, None)
+        elif i == 0:
+            omit = slice(-context_words - 1)
+        elif not i % 2:
+            omit = slice(context_words + 1, -context_words - 1)
+        if omit and words[omit]:
+            words[omit] = ["..."]
+        output.append(" ".join(words))
+
+    return dict(original=text, excerpt="".join(output), hits=len(index))
+
+def old_highlight(text, phrases, ignore_case=True, word_boundary=True, class_name='highlight'):
+    phrases = map(re.escape, phrases)
+    flags = ignore_case and re.I or 0
+    re_template = word_boundary and r"\b(%s)\b" or r"(%s)"
+    expr = re.compile(re_template % "|".join(phrases), flags)
+    template = '<span class="%s">%%s</span>' % class_name
+    matches = []
+
+    def replace(match):
+        matches.append(match)
+        return template % match.group(0)
+
+    highlighted = expr.sub(replace, tags.cgi.escape(text))
+    return dict(original=text, highlighted=highlighted, hits=len(matches))
+
+VOCABULARY = ['python', 'Python', 'c++', 'the', 'bug', 'crash', 'when',
+              'firefox', 'window', 'a', 'of', 'segfault', 'GTK', 'gtk-doc',
+              '(python)', 'mozilla', 'x86_64']
+SEPARATORS = [' ', ' ', ' ', '  ', '\n', '\t', ' \n ', ', ']
+
+def make_description(n_words, rng):
+    return ''.join([rng.choice(VOCABULARY) + rng.choice(SEPARATORS)
+                    for i in range(n_words)])
+
+def check_agreement(rng, trials=2000):
+    for trial in range(trials):
+        text = make_description(rng.randint(0, 80), rng)
+        phrases = rng.sample(VOCABULARY, rng.randint(1, 3))
+        context_words = rng.randint(0, 4)
+        old = old_searchexcerpt(text, phrases, context_words)
+        new = tags.searchexcerpt(text, phrases, context_words, True, True)
+        assert old == new, (text, phrases, context_words, old, new)
+        assert (old_highlight(text, phrases) ==
+                tags.highlight(text, phrases, True, True, 'highlight'))
+
+def main():
+    rng = random.Random(0)
+    check_agreement(rng)
+    print "Old and new agree."
+
+    phrases = ['segfault', 'firefox']
+    for n_words in (100, 1000, 10000):
+        text = make_description(n_words, rng)
+        for name, function in [
+            ('old searchexcerpt', lambda: old_searchexcerpt(text, phrases)),
+            ('new searchexcerpt', lambda: tags.searchexcerpt(text, phrases)),
+            ('old highlight', lambda: old_highlight(text, phrases)),
+            ('new highlight', lambda: tags.highlight(text, phrases))]:
+            seconds = min(timeit.Timer(function).repeat(3, 100)) / 100
+            print "%-20s %6d words: %8.1f usec" % (name, n_words, seconds * 1e6)
+
+if __name__ == '__main__':
+    main()
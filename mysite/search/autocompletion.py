@@ -0,0 +1,94 @@
+import bisect
+import datetime
+import logging
+import threading
+
+import mysite.search.models
+
+### Autocompletion for the search box.
+###
+### Every keystroke asks for suggestions, so we keep the project names and
+### languages in memory, sorted and lowercased, and find the ones starting
+### with what the user typed by binary search. Saving a Project tells this
+### process to rebuild right away, and bumps an Epoch so that other processes
+### notice within REFRESH_INTERVAL.
+
+EPOCH_NAME = u'search.AutocompletionIndex'
+
+class PrefixIndex(object):
+    '''A sorted array of strings, case-folded, for finding the ones that
+    start with some prefix. It never changes once built, so any number of
+    threads can read it.'''
+
+    def __init__(self, strings):
+        self.entries = sorted(set([(s.lower(), s) for s in strings if s]))
+
+    def starting_with(self, prefix, limit):
+        prefix = prefix.lower()
+        ret = []
+        # (prefix,) sorts right before every (prefix..., string) entry.
+        i = bisect.bisect_left(self.entries, (prefix,))
+        while i < len(self.entries) and len(ret) < limit:
+            folded, string = self.entries[i]
+            if not folded.startswith(prefix):
+                break
+            ret.append(string)
+            i += 1
+        return ret
+
+class AutocompletionIndex(object):
+    '''Project names and languages, as PrefixIndexes.'''
+
+    # How often to ask the Epoch whether another process changed a Project.
+    REFRESH_INTERVAL = datetime.timedelta(seconds=60)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.project_names = PrefixIndex([])
+        self.languages = PrefixIndex([])
+        self.epoch = None
+        self.built_at = None
+        self.checked_at = None
+
+    def rebuild_on_next_use(self):
+        self.built_at = None
+
+    def is_fresh(self, epoch):
+        if self.built_at is None or epoch != self.epoch:
+            return False
+        # Same trick as mysite.search.engines.BugIndex.is_fresh: a bump in
+        # the second we built could hide another bump in that second.
+        return tuple(epoch)[:6] < self.built_at.timetuple()[:6]
+
+    def refresh(self):
+        now = datetime.datetime.now()
+        if (self.built_at is not None and
+            now - self.checked_at < self.REFRESH_INTERVAL):
+            return
+        self.lock.acquire()
+        try:
+            epoch = mysite.search.models.Epoch.get_for_string(EPOCH_NAME)
+            self.checked_at = now
+            if self.is_fresh(epoch):
+                return
+            logging.info("Building the autocompletion index.")
+            rows = list(mysite.search.models.Project.objects.values_list(
+                'name', 'language'))
+            # Swap in whole new PrefixIndexes, so that readers see either
+            # the old ones or the new ones, never half of each.
+            self.project_names = PrefixIndex([name for name, _ in rows])
+            self.languages = PrefixIndex([language for _, language in rows])
+            self.epoch = epoch
+            self.built_at = now
+        finally:
+            self.lock.release()
+
+    def project_names_starting_with(self, prefix, limit):
+        self.refresh()
+        return self.project_names.starting_with(prefix, limit)
+
+    def languages_starting_with(self, prefix, limit):
+        self.refresh()
+        return self.languages.starting_with(prefix, limit)
+
+autocompletion_index = AutocompletionIndex()
@@ -0,0 +1,5 @@
+### A benchmark for bug search. See the search_benchmark management command:
+###
+###     ./bin/mysite search_benchmark --bugs=100000 --projects=2000
+###
+### corpus makes up projects and bugs; stages times the parts of a search.
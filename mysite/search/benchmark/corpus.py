@@ -0,0 +1,162 @@
+import bisect
+import datetime
+import logging
+import random
+
+from django.db import connection, models, transaction
+
+import mysite.search.models
+
+### A made-up corpus of projects and bugs, shaped roughly like ours: a few
+### languages and projects have most of the bugs, and a few words show up in
+### most bug descriptions while most words are rare.
+###
+### Bug.create_dummy() is fine for a test that needs ten bugs, but saving a
+### million bugs one at a time (with every post_save handler running) would
+### take all day. So we INSERT them in batches, then tell the caches and
+### indexes that the bug table changed under them.
+
+# Everything we make has this in its name or link, so we can find it again.
+MARKER = u'benchmark'
+
+LANGUAGES = [u'Python', u'C', u'C++', u'Java', u'JavaScript', u'C#', u'Perl',
+             u'PHP', u'Ruby', u'shell script', u'Vala', u'Haskell', u'Lisp',
+             u'Objective-C', u'Tcl', u'']
+
+# Most of these come up in real bug reports; the made-up ones at the end
+# give us a long tail.
+COMMON_WORDS = [u'the', u'a', u'to', u'when', u'crash', u'window', u'should',
+                u'error', u'not', u'fails', u'after', u'open', u'file',
+                u'button', u'dialog', u'python', u'segfault', u'memory',
+                u'leak', u'menu', u'click', u'doesn', u't', u'work', u'with',
+                u'documentation', u'typo', u'translation', u'string',
+                u'preferences', u'plugin', u'import', u'export', u'unicode',
+                u'gtk', u'firefox', u'patch', u'easy', u'bitesize', u'x86_64']
+RARE_WORDS = [u'word%d' % i for i in range(5000)]
+VOCABULARY = COMMON_WORDS + RARE_WORDS
+
+class ZipfChooser(object):
+    '''Pick items from a list, the k-th about 1/k as often as the first.'''
+
+    def __init__(self, items, rng, exponent=1.0):
+        self.items = items
+        self.rng = rng
+        self.cumulative = []
+        total = 0.0
+        for k in range(1, len(items) + 1):
+            total += 1.0 / (k ** exponent)
+            self.cumulative.append(total)
+
+    def choose(self):
+        x = self.rng.random() * self.cumulative[-1]
+        return self.items[bisect.bisect_left(self.cumulative, x)]
+
+def bulk_insert(model, rows, batch_size=1000):
+    """INSERT dicts mapping field names to values into the model's table,
+    batch_size rows per executemany(). Fields a row leaves out get their
+    defaults; none of the model's save() logic or signals run."""
+    fields = [field for field in model._meta.local_fields
+              if not isinstance(field, models.AutoField)]
+    qn = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        qn(model._meta.db_table),
+        ", ".join([qn(field.column) for field in fields]),
+        ", ".join(["%s"] * len(fields)))
+
+    now = datetime.datetime.now()
+    cursor = connection.cursor()
+    batch = []
+    n = 0
+    for row in rows:
+        values = []
+        for field in fields:
+            if field.name in row:
+                value = row[field.name]
+            elif getattr(field, 'auto_now', False) or getattr(
+                field, 'auto_now_add', False):
+                value = now
+            else:
+                value = field.get_default()
+            values.append(field.get_db_prep_save(value))
+        batch.append(values)
+        if len(batch) >= batch_size:
+            cursor.executemany(sql, batch)
+            n += len(batch)
+            batch = []
+            logging.info("Inserted %d rows into %s." % (
+                n, model._meta.db_table))
+    if batch:
+        cursor.executemany(sql, batch)
+    transaction.commit_unless_managed()
+
+def generate_projects(n_projects, rng):
+    languages = ZipfChooser(LANGUAGES, rng)
+    for i in range(n_projects):
+        yield {'name': u'%s-%s-%05d' % (MARKER, rng.choice(COMMON_WORDS), i),
+               'language': languages.choose(),
+               'icon_url': u''}
+
+def make_text(words, n_words):
+    return u' '.join([words.choose() for i in range(n_words)])
+
+def generate_bugs(n_bugs, project_ids, rng):
+    projects = ZipfChooser(project_ids, rng, exponent=0.8)
+    words = ZipfChooser(VOCABULARY, rng)
+    epoch = datetime.datetime(2010, 1, 1)
+    for i in range(n_bugs):
+        last_touched = epoch + datetime.timedelta(
+            seconds=rng.randint(0, 200 * 24 * 3600))
+        yield {'project': projects.choose(),
+               'title': make_text(words, rng.randint(3, 12)),
+               'description': make_text(words, rng.randint(10, 300)),
+               'status': u'NEW',
+               'importance': u'Normal',
+               'people_involved': rng.randint(0, 10),
+               'date_reported': last_touched - datetime.timedelta(days=30),
+               'last_touched': last_touched,
+               'last_polled': last_touched,
+               'submitter_username': u'%s-reporter' % MARKER,
+               'submitter_realname': u'',
+               'canonical_bug_link': u'http://%s.example.com/bug/%d' % (
+                   MARKER, i),
+               'good_for_newcomers': rng.random() < 0.1,
+               'looks_closed': rng.random() < 0.15,
+               'bize_size_tag_name': u'',
+               'concerns_just_documentation': rng.random() < 0.05,
+               'as_appears_in_distribution': u''}
+
+def note_that_the_bugs_changed():
+    """We went around the post_save handlers, so do their job for them."""
+    Epoch = mysite.search.models.Epoch
+    import mysite.search.engines
+    import mysite.search.autocompletion
+    mysite.search.engines.bug_index.rebuild_on_next_sync()
+    Epoch.bump_for_string(mysite.search.engines.EPOCH_NAME)
+    mysite.search.autocompletion.autocompletion_index.rebuild_on_next_use()
+    Epoch.bump_for_string(mysite.search.autocompletion.EPOCH_NAME)
+    Epoch.bump_for_model(mysite.search.models.Bug)
+    mysite.search.models.HitCountCache.clear_cache()
+
+def create(n_bugs, n_projects, seed=0):
+    """Make n_projects projects and n_bugs bugs in them."""
+    rng = random.Random(seed)
+    Project = mysite.search.models.Project
+    bulk_insert(Project, generate_projects(n_projects, rng))
+    project_ids = list(Project.objects.filter(
+        name__startswith=MARKER + u'-').values_list('id', flat=True))
+    bulk_insert(mysite.search.models.Bug,
+                generate_bugs(n_bugs, project_ids, rng))
+    note_that_the_bugs_changed()
+
+def delete():
+    """Throw away everything create() made."""
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM %s WHERE %s LIKE %%s" % (
+        qn(mysite.search.models.Bug._meta.db_table),
+        qn('canonical_bug_link')), ['http://%s.example.com/%%' % MARKER])
+    cursor.execute("DELETE FROM %s WHERE %s LIKE %%s" % (
+        qn(mysite.search.models.Project._meta.db_table),
+        qn('name')), [MARKER + '-%'])
+    transaction.commit_unless_managed()
+    note_that_the_bugs_changed()
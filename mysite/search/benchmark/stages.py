@@ -0,0 +1,141 @@
+import time
+
+import django.core.cache
+import django.db
+from django.conf import settings
+from django.test.client import Client
+
+import mysite.base.unicode_sanity
+import mysite.search.models
+import mysite.search.controllers
+import mysite.search.engines
+import mysite.search.autocompletion
+import mysite.profile.controllers
+
+### Time each stage of a search, cold and warm, and count its queries.
+###
+### "Cold" means every cache we have is empty: the process-local ones (the
+### bug index, the hit count LRU, autocompletion) are told to start over,
+### HitCountCache entries are all made stale, and the Django cache misses
+### (the way base.tests.TwillTests makes it miss). "Warm" is whatever the
+### stage leaves behind after one run.
+
+# A spread of what people search for: common and rare words, facets, and
+# no terms at all.
+QUERIES = [
+    {u'q': u'python'},
+    {u'q': u'crash window'},
+    {u'q': u'word4321'},
+    {u'q': u'"open file"'},
+    {u'q': u'', u'language': u'Python'},
+    {u'q': u'crash', u'toughness': u'bitesize'},
+    {u'q': u'documentation', u'contribution_type': u'documentation',
+     u'language': u'C'},
+]
+
+RECOMMENDATION_TERMS = [u'Python', u'C', u'gtk', u'firefox', u'segfault']
+
+def never_cached(*args, **kwargs):
+    return None
+
+def empty_the_caches():
+    mysite.search.engines.bug_index.rebuild_on_next_sync()
+    mysite.search.autocompletion.autocompletion_index.rebuild_on_next_use()
+    mysite.search.models.HitCountCache.clear_cache()
+
+class Stage(object):
+    '''Something to time, and a name to report it under.'''
+
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+
+    def measure(self):
+        """Run it once; return (seconds, number of queries)."""
+        django.db.reset_queries()
+        start = time.time()
+        self.function()
+        elapsed = time.time() - start
+        return elapsed, len(django.db.connection.queries)
+
+    def run(self, repeat):
+        """Return a dict with the cold run's time and queries, and the
+        median warm time and queries out of repeat runs."""
+        real_get = django.core.cache.cache.get
+        django.core.cache.cache.get = never_cached
+        try:
+            empty_the_caches()
+            cold_seconds, cold_queries = self.measure()
+        finally:
+            django.core.cache.cache.get = real_get
+
+        self.function() # Fill the Django cache, now that it's allowed to hit.
+        warm = [self.measure() for i in range(repeat)]
+        warm.sort()
+        warm_seconds, warm_queries = warm[len(warm) // 2]
+        return dict(name=self.name,
+                    cold_seconds=cold_seconds, cold_queries=cold_queries,
+                    warm_seconds=warm_seconds, warm_queries=warm_queries)
+
+def get_stages():
+    client = Client()
+    stages = []
+    for GET_data in QUERIES:
+        description = mysite.base.unicode_sanity.urlencode(GET_data)
+
+        def get_first_page(GET_data=GET_data):
+            query = mysite.search.controllers.Query.create_from_GET_data(
+                GET_data)
+            bugs = query.get_bugs_unordered()
+            list(mysite.search.controllers.order_bugs(bugs)[:10])
+        stages.append(Stage('get_bugs_unordered ' + description,
+                            get_first_page))
+
+        def get_possible_facets(GET_data=GET_data):
+            query = mysite.search.controllers.Query.create_from_GET_data(
+                GET_data)
+            query.get_possible_facets()
+        stages.append(Stage('get_possible_facets ' + description,
+                            get_possible_facets))
+
+        def fetch_bugs_html(GET_data=GET_data):
+            assert client.get('/search/', GET_data).status_code == 200
+        stages.append(Stage('fetch_bugs ' + description, fetch_bugs_html))
+
+        def fetch_bugs_json(GET_data=GET_data):
+            JSON_GET_data = dict(GET_data, format='json')
+            assert client.get('/search/', JSON_GET_data).status_code == 200
+        stages.append(Stage('fetch_bugs json ' + description,
+                            fetch_bugs_json))
+
+    def recommend():
+        mysite.profile.controllers.RecommendBugs(
+            RECOMMENDATION_TERMS, n=5).recommend()
+    stages.append(Stage('RecommendBugs.recommend', recommend))
+    return stages
+
+def run(repeat=5):
+    """Time every stage. Returns a list of dicts; see Stage.run."""
+    # Django only keeps track of queries when DEBUG is on.
+    old_debug = settings.DEBUG
+    settings.DEBUG = True
+    # And we don't want our pages written out to the static file cache.
+    old_middleware_classes = settings.MIDDLEWARE_CLASSES
+    settings.MIDDLEWARE_CLASSES = [
+        name for name in old_middleware_classes
+        if not name.startswith('staticgenerator.')]
+    try:
+        return [stage.run(repeat) for stage in get_stages()]
+    finally:
+        settings.DEBUG = old_debug
+        settings.MIDDLEWARE_CLASSES = old_middleware_classes
+
+def format_report(results):
+    lines = ['%-60s %10s %8s %10s %8s' % (
+        'stage', 'cold ms', 'queries', 'warm ms', 'queries')]
+    for result in results:
+        lines.append('%-60s %10.1f %8d %10.1f %8d' % (
+            result['name'][:60],
+            result['cold_seconds'] * 1000, result['cold_queries'],
+            result['warm_seconds'] * 1000, result['warm_queries']))
+    return '\n'.join(lines)
@@ -1,19 +1,92 @@
 import mysite.search.models
 import mysite.search.views
+import mysite.search.engines
 import mysite.base.unicode_sanity
 import mysite.base.decorators
+import mysite.base.helpers
 import collections
 import urllib
 import re
 import sha
-from django.db.models import Q
+import base64
+import datetime
+import simplejson
+import random
+import logging
+import django.core.cache
+import django.db
+from django.db.models import Q, Count
 
 def order_bugs(query):
     # Minus sign: reverse order
     # Minus good for newcomers: this means true values
     # (like 1) appear before false values (like 0)
     # Minus last touched: Old bugs last.
-    return query.order_by('-good_for_newcomers', '-last_touched')
+    # Minus id: ties get broken the same way every time, so that a page
+    # cursor (see bug2page_cursor) picks up exactly where its page left off.
+    # search_bug has an index on exactly these columns (search migration
+    # 0060), so MySQL reads a page straight off it instead of sorting.
+    return query.order_by('-good_for_newcomers', '-last_touched', '-id')
+
+### Page cursors let /search/ page through results with a WHERE clause on
+### the sort key, rather than making MySQL count its way through an OFFSET.
+### A cursor is an opaque token for one bug's place in the order_bugs order.
+
+def bug2page_cursor(bug):
+    """Return the cursor for a bug, or for a values() row of one."""
+    if isinstance(bug, dict):
+        bug = mysite.base.helpers.ObjectFromDict(bug)
+    t = bug.last_touched
+    key = [int(bool(bug.good_for_newcomers)),
+           [t.year, t.month, t.day, t.hour, t.minute, t.second, t.microsecond],
+           bug.id]
+    return base64.urlsafe_b64encode(simplejson.dumps(key))
+
+def page_cursor2key(cursor):
+    """Return the (good_for_newcomers, last_touched, id) that the cursor
+    stands for. Raise ValueError if it isn't a cursor we made."""
+    try:
+        good_for_newcomers, last_touched, bug_id = simplejson.loads(
+            base64.urlsafe_b64decode(str(cursor)))
+        return (bool(good_for_newcomers),
+                datetime.datetime(*[int(n) for n in last_touched]),
+                int(bug_id))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError, "Not a page cursor: %r" % (cursor,)
+
+def get_page_of_bugs(bugs, page_size, after=None, before=None):
+    """Return the list of up to page_size bugs that come right after (or
+    right before) the bug the cursor stands for, in the order_bugs order,
+    and whether there are more bugs past the far end of the page. With no
+    cursor, return the first page.
+
+    This costs the same on page 1000 as it does on page 1."""
+    if before is not None:
+        good_for_newcomers, last_touched, bug_id = page_cursor2key(before)
+        bugs = bugs.filter(
+            Q(good_for_newcomers__gt=good_for_newcomers) |
+            Q(good_for_newcomers=good_for_newcomers,
+              last_touched__gt=last_touched) |
+            Q(good_for_newcomers=good_for_newcomers,
+              last_touched=last_touched, id__gt=bug_id))
+        # Walk backwards from the cursor, then put the page right way round.
+        page = list(bugs.order_by('good_for_newcomers', 'last_touched', 'id')[
+            :page_size + 1])
+        has_more = (len(page) > page_size)
+        page = page[:page_size]
+        page.reverse()
+        return page, has_more
+
+    if after is not None:
+        good_for_newcomers, last_touched, bug_id = page_cursor2key(after)
+        bugs = bugs.filter(
+            Q(good_for_newcomers__lt=good_for_newcomers) |
+            Q(good_for_newcomers=good_for_newcomers,
+              last_touched__lt=last_touched) |
+            Q(good_for_newcomers=good_for_newcomers,
+              last_touched=last_touched, id__lt=bug_id))
+    page = list(order_bugs(bugs)[:page_size + 1])
+    return page[:page_size], (len(page) > page_size)
 
 class Query:
     
@@ -68,7 +141,7 @@ class Query:
         return Query(terms=terms, active_facet_options=active_facet_options, terms_string=terms_string)
 
     def get_bugs_unordered(self):
-        return mysite.search.models.Bug.open_ones.filter(self.get_Q())
+        return mysite.search.engines.get_engine().get_bugs_unordered(self)
 
     def __nonzero__(self):
         if self.terms or self.active_facet_options:
@@ -77,6 +150,13 @@ class Query:
 
     def get_Q(self, exclude_active_facets=False):
         """Get a Q object which can be passed to Bug.open_ones.filter()"""
+        q = self.get_facets_Q(exclude_active_facets)
+        for word in self.terms:
+            q &= Query.get_term_Q(word)
+        return q
+
+    def get_facets_Q(self, exclude_active_facets=False):
+        """Get a Q object for just the facets, ignoring the terms."""
 
         # Begin constructing a conjunction of Q objects (filters)
         q = Q()
@@ -112,25 +192,23 @@ class Query:
                 and not exclude_contribution_type):
             q &= Q(concerns_just_documentation=True)
 
-        for word in self.terms:
-            whole_word = "[[:<:]]%s($|[[:>:]])" % (
-                    mysite.base.controllers.mysql_regex_escape(word))
-            terms_disjunction = (
-                    Q(project__language__iexact=word) |
-                    Q(title__iregex=whole_word) |
-                    Q(description__iregex=whole_word) |
-                    Q(as_appears_in_distribution__iregex=whole_word) |
-
-                    # 'firefox' grabs 'mozilla firefox'.
-                    Q(project__name__iregex=whole_word)
-                    )
-            q &= terms_disjunction
-
         return q
 
-    def get_facet_option_data(self, facet_name, option_name):
+    @staticmethod
+    def get_term_Q(word):
+        """Get a Q object that matches bugs containing this one term."""
+        whole_word = "[[:<:]]%s($|[[:>:]])" % (
+                mysite.base.controllers.mysql_regex_escape(word))
+        return (Q(project__language__iexact=word) |
+                Q(title__iregex=whole_word) |
+                Q(description__iregex=whole_word) |
+                Q(as_appears_in_distribution__iregex=whole_word) |
 
-        # Create a Query for this option. 
+                # 'firefox' grabs 'mozilla firefox'.
+                Q(project__name__iregex=whole_word)
+                )
+
+    def get_facet_option_GET_data(self, facet_name, option_name):
 
         # This Query is sensitive to the currently active facet options...
         GET_data = dict(self.active_facet_options)
@@ -140,8 +218,16 @@ class Query:
             u'q': unicode(self.terms_string),
             unicode(facet_name): unicode(option_name),
             })
+        return GET_data
+
+    def get_facet_option_data(self, facet_name, option_name, count=None):
+
+        # Create a Query for this option. 
+        GET_data = self.get_facet_option_GET_data(facet_name, option_name)
         query_string = mysite.base.unicode_sanity.urlencode(GET_data)
         query = Query.create_from_GET_data(GET_data)
+        if count is None:
+            count = query.get_or_create_cached_hit_count()
         the_all_option = u'any' 
         name = option_name or the_all_option
 
@@ -162,7 +248,7 @@ class Query:
 
         return {
                 'name': name,
-                'count': query.get_or_create_cached_hit_count(),
+                'count': count,
                 'query_string': query_string,
                 'is_active': is_active
                 }
@@ -171,7 +257,9 @@ class Query:
         # Assert that there are only unicode strings in this list
         option_names = mysite.base.decorators.no_str_in_the_list(option_names)
 
-        options = [self.get_facet_option_data(facet_name, n) for n in option_names]
+        counts = self.get_facet_option_counts(facet_name, option_names)
+        options = [self.get_facet_option_data(facet_name, n, count=counts[n])
+                   for n in option_names]
         # ^^ that's a list of facet options, where each "option" is a
         # dictionary that looks like this:
         # {
@@ -210,6 +298,100 @@ class Query:
 
         return options
 
+    def get_facet_value_counts(self, facet_name):
+        """Count the bugs this query would find if it ignored facet_name,
+        grouped by their value for facet_name. One query, memoized."""
+        if not hasattr(self, '_facet_value_counts'):
+            self._facet_value_counts = {}
+        if facet_name not in self._facet_value_counts:
+            GET_data = self.get_GET_data()
+            if facet_name in GET_data:
+                del GET_data[facet_name]
+            query_without_this_facet = Query.create_from_GET_data(GET_data)
+            self._facet_value_counts[facet_name] = (
+                mysite.search.engines.get_engine().count_bugs_by_facet_value(
+                    query_without_this_facet, facet_name))
+        return self._facet_value_counts[facet_name]
+
+    @staticmethod
+    def facet_option2value_key(facet_name, option_name):
+        """Which value of the facet's column (bucketed the way
+        mysite.search.engines.facet_value2key does it) does this option
+        select? None means the option doesn't filter anything. This mirrors
+        what get_facets_Q filters on."""
+        if facet_name == u'language':
+            if option_name == 'Unknown':
+                option_name = u''
+            return option_name.lower()
+        if facet_name == u'project':
+            return option_name.lower()
+        if facet_name == u'toughness':
+            if option_name == 'bitesize':
+                return True
+            return None
+        if facet_name == u'contribution_type':
+            if option_name == 'documentation':
+                return True
+            return None
+        return None
+
+    def get_facet_value_keys(self):
+        """Map each active facet to the value key its option selects."""
+        ret = {}
+        for facet_name, option_name in self.active_facet_options.items():
+            key = Query.facet_option2value_key(facet_name, option_name)
+            if key is not None:
+                ret[facet_name] = key
+        return ret
+
+    @staticmethod
+    def get_count_for_facet_option(facet_name, option_name, value2count):
+        """Pick the count for one facet option out of the output of
+        get_facet_value_counts."""
+        key = Query.facet_option2value_key(facet_name, option_name)
+        if not option_name or key is None:
+            return sum(value2count.values())
+        return value2count.get(key, 0)
+
+    def get_facet_option_counts(self, facet_name, option_names):
+        """Return a dictionary mapping each option name to the number of bugs
+        we would find if that option were selected for this facet.
+
+        Counts we already know come out of the HitCountCache in (at most)
+        one query.
+        If any are missing, one GROUP BY query counts every option at once,
+        rather than one COUNT(*) per option, and one INSERT stores them."""
+        option2query = {}
+        names = set()
+        for option_name in option_names:
+            query = Query.create_from_GET_data(
+                self.get_facet_option_GET_data(facet_name, option_name))
+            option2query[option_name] = query
+            names.update(query.get_hit_count_dependency_names())
+        versions = mysite.search.models.HitCountDependency.get_versions(names)
+
+        option2hash = {}
+        for option_name, query in option2query.items():
+            option2hash[option_name] = query.get_hit_count_cache_key(versions)
+
+        HitCountCache = mysite.search.models.HitCountCache
+        hash2count = HitCountCache.get_many(option2hash.values())
+
+        missing = {}
+        for option_name in option_names:
+            hashed_query = option2hash[option_name]
+            if hashed_query in hash2count:
+                continue
+            missing[hashed_query] = Query.get_count_for_facet_option(
+                facet_name, option_name,
+                self.get_facet_value_counts(facet_name))
+        if missing:
+            HitCountCache.store_many(missing)
+            hash2count.update(missing)
+
+        return dict([(option_name, hash2count[option2hash[option_name]])
+                     for option_name in option_names])
+
     def get_possible_facets(self):
 
         bugs = mysite.search.models.Bug.open_ones.filter(self.get_Q())
@@ -330,48 +512,206 @@ class Query:
         # then return a hash of our sorted items self.
         return sha.sha(stringified).hexdigest() # sadly we cause a 2x space blowup here
     
-    def get_or_create_cached_hit_count(self):
-        hashed_query = self.get_sha1()
+    def get_hit_count_dependency_names(self):
+        """Name the HitCountDependencies that a bug has to touch to change
+        this query's hit count. See HitCountDependency.get_names_for_bug."""
+        HitCountDependency = mysite.search.models.HitCountDependency
+        make_name = HitCountDependency.make_name
+        names = set([HitCountDependency.EVERYTHING])
+
+        # A bug only matches a term if it has all of the term's words, or if
+        # its language is the term.
+        for term in self.terms:
+            names.add(make_name(u'word', term.lower()))
+            for word in mysite.search.engines.tokenize(term):
+                names.add(make_name(u'word', word))
+
+        facet2key = self.get_facet_value_keys()
+        for facet_name, key in facet2key.items():
+            names.add(make_name(facet_name, key))
+
+        if not self.terms and not facet2key:
+            names.add(make_name(u'all', u''))
+        return names
+
+    def get_hit_count_cache_key(self, versions=None):
+        """Hash this query together with the versions of the dependencies of
+        its hit count, so that a bug change that could affect the count
+        gives it a new key."""
+        names = self.get_hit_count_dependency_names()
+        if versions is None:
+            versions = mysite.search.models.HitCountDependency.get_versions(
+                names)
+        stamp = sorted([(name, versions[name]) for name in names])
+        return sha.sha(self.get_sha1() + str(stamp)).hexdigest()
 
-        existing_hccs = mysite.search.models.HitCountCache.objects.filter(hashed_query=hashed_query)
-        if existing_hccs:
-            hcc = existing_hccs[0]
-        else:
-            count = self.get_bugs_unordered().count()
-            hcc, _ = mysite.search.models.HitCountCache.objects.get_or_create(
-                    hashed_query=hashed_query,
-                    defaults={'hit_count': count})
-        return hcc.hit_count
+    def get_or_create_cached_hit_count(self):
+        return get_or_create_cached_hit_counts([self])[0]
 
     def get_query_string(self):
         GET_data = self.get_GET_data()
         query_string = mysite.base.unicode_sanity.urlencode(GET_data)
         return query_string
 
+
+def count_bugs_for_each_term(terms):
+    """Return a dict mapping each term to the number of open bugs a search
+    for it alone finds. Plain words are counted in the bug index's word
+    sets; the rest go to MySQL, all of them in one query."""
+    ret = {}
+    plain_terms = [term for term in terms
+                   if mysite.search.engines.term_is_a_plain_word(term)]
+    other_terms = [term for term in terms if term not in plain_terms]
+
+    if plain_terms:
+        bug_index = mysite.search.engines.bug_index
+        bug_index.sync()
+        for term in plain_terms:
+            ret[term] = len(bug_index.bug_ids_matching([term], {}))
+
+    if other_terms:
+        counts = []
+        params = []
+        for i, term in enumerate(other_terms):
+            sql, term_params = mysite.search.models.Bug.open_ones.filter(
+                Query.get_term_Q(term)).values('id').order_by(
+                ).query.as_sql()
+            counts.append('SELECT %d, COUNT(*) FROM (%s) AS term%d' % (
+                    i, sql, i))
+            params.extend(term_params)
+        cursor = django.db.connection.cursor()
+        cursor.execute(' UNION ALL '.join(counts), params)
+        for i, count in cursor.fetchall():
+            ret[other_terms[int(i)]] = int(count)
+    return ret
+
+def get_or_create_cached_hit_counts(queries):
+    """Return the hit count of each of the queries, in order. However many
+    queries there are, this looks up the versions of what their counts
+    depend on once, and the cached counts once. Counts nobody has made
+    since a relevant bug changed get made now: queries for a single term
+    are counted all together by count_bugs_for_each_term, and stored
+    together."""
+    HitCountDependency = mysite.search.models.HitCountDependency
+    HitCountCache = mysite.search.models.HitCountCache
+    names = set()
+    for query in queries:
+        names.update(query.get_hit_count_dependency_names())
+    versions = HitCountDependency.get_versions(names)
+    hashed_queries = [query.get_hit_count_cache_key(versions)
+                      for query in queries]
+    hash2count = HitCountCache.get_many(hashed_queries)
+
+    # We read the versions before counting, so if a bug changes while we
+    # count, we store these under keys nobody will look up again.
+    missing = {}
+    term2hashed_queries = {}
+    engine = mysite.search.engines.get_engine()
+    for query, hashed_query in zip(queries, hashed_queries):
+        if hashed_query in hash2count or hashed_query in missing:
+            continue
+        if len(query.terms) == 1 and not query.active_facet_options:
+            term2hashed_queries.setdefault(query.terms[0], []).append(
+                hashed_query)
+        else:
+            missing[hashed_query] = engine.count_bugs(query)
+    if term2hashed_queries:
+        for term, count in count_bugs_for_each_term(
+            term2hashed_queries.keys()).items():
+            for hashed_query in term2hashed_queries[term]:
+                missing[hashed_query] = count
+    if missing:
+        HitCountCache.store_many(missing)
+        hash2count.update(missing)
+    return [hash2count[hashed_query] for hashed_query in hashed_queries]
+
+def get_terms_with_results(terms):
+    """Return those of the terms that, searched for on their own, find at
+    least one bug."""
+    hit_counts = get_or_create_cached_hit_counts(
+        [Query(terms=[term]) for term in terms])
+    return [term for term, hit_count in zip(terms, hit_counts) if hit_count]
        
 def get_project_count():
     """Retrieve the number of projects currently indexed."""
     bugs = mysite.search.models.Bug.all_bugs.all()
     return bugs.values(u'project').distinct().count()
 
-def get_projects_with_bugs():
+### The sidebar and chrome around the search results (a few projects and
+### contributors to show off, how many projects we index) barely change, so
+### rather than work them out on every /search/ request, we keep a snapshot
+### in the cache. It's keyed by the Bug and Project epochs, so closing or
+### deleting a bug or saving a project makes the next request build a new
+### one. New bugs don't bump the Bug epoch, so search_daily_tasks rebuilds
+### it after crawling the bug trackers.
+
+POPULAR_PROJECT_NAMES = ['Miro', 'GnuCash', 'brasero', 'Evolution Exchange',
+                         'songbird']
+
+# In seconds. Long enough that the background task, not a visitor, is the
+# one who usually pays for the snapshot.
+SEARCH_PAGE_CHROME_TIMEOUT = 2 * 24 * 60 * 60
+
+def get_search_page_chrome_cache_key():
+    epochs = [mysite.search.models.Epoch.get_for_model(
+            mysite.search.models.Bug),
+              mysite.search.models.Epoch.get_for_model(
+            mysite.search.models.Project)]
+    return 'search_page_chrome_' + sha.sha(repr(epochs)).hexdigest()
+
+def build_search_page_chrome():
+    """Work out everything the search page shows that doesn't depend on the
+    query. Returns a dict to merge into the template's context."""
+    Project = mysite.search.models.Project
+    Person = mysite.profile.models.Person
+    chrome = {}
+    chrome['popular_projects'] = list(Project.objects.filter(
+            name__in=POPULAR_PROJECT_NAMES).order_by('name').reverse())
+    chrome['all_projects'] = list(Project.objects.values('pk', 'name').filter(
+            bug__looks_closed=False).annotate(Count('bug')).order_by('name'))
+    random_start = int(random.random() * 700)
+    chrome['contributors'] = list(
+        Person.objects.all()[random_start:random_start+5])
+    chrome['contributors2'] = list(
+        Person.objects.all()[random_start+10:random_start+15])
+    chrome['languages'] = list(Project.objects.all().values_list(
+            'language', flat=True).order_by('language').exclude(
+            language='').distinct()[:4])
+    chrome['project_count'] = get_project_count()
+    return chrome
+
+def refresh_search_page_chrome():
+    """Build a new snapshot and store it, whether or not the old one is
+    still good."""
+    # Read the key first: if something changes while we build, we store
+    # this under a key nobody will look up again.
+    cache_key = get_search_page_chrome_cache_key()
+    logging.info("Building the search page chrome.")
+    chrome = build_search_page_chrome()
+    django.core.cache.cache.set(cache_key, chrome,
+                                SEARCH_PAGE_CHROME_TIMEOUT)
+    return chrome
+
+def get_search_page_chrome():
+    chrome = django.core.cache.cache.get(get_search_page_chrome_cache_key())
+    if chrome is None:
+        chrome = refresh_search_page_chrome()
+    return chrome
+
+def get_ids_of_projects_with_bugs():
     bugs = mysite.search.models.Bug.all_bugs.all()
-    one_bug_dict_per_project = bugs.values(u'project').distinct().order_by(u'project__name')
-    #project_names = [b[u'project__name'] for b in one_bug_dict_per_project]
-    projects = []
-    for bug_dict in one_bug_dict_per_project:
-        pk = bug_dict[u'project']
-        projects.append(mysite.search.models.Project.objects.get(pk=pk))
-    return projects
+    return set(bugs.values_list(u'project', flat=True).order_by().distinct())
+
+def get_projects_with_bugs():
+    # Two queries, however many projects there are: one for the ids, one
+    # for the projects. The database sorts them, the way it always has.
+    return list(mysite.search.models.Project.objects.filter(
+            id__in=get_ids_of_projects_with_bugs()).order_by(u'name'))
 
 def get_cited_projects_lacking_bugs():
     portfolio_entries = mysite.profile.models.PortfolioEntry.published_ones.all()
-    one_pfe_dict_per_project = portfolio_entries.values(u'project').distinct().order_by(u'project__name')
-
-    projects_with_contributors = []
-    for pfe_dict in one_pfe_dict_per_project:
-        pk = pfe_dict[u'project']
-        projects_with_contributors.append(mysite.search.models.Project.objects.get(pk=pk))
-
-    projects_with_bugs = get_projects_with_bugs()
-    return [p for p in projects_with_contributors if p not in projects_with_bugs]
+    cited_project_ids = set(portfolio_entries.values_list(
+            u'project', flat=True).order_by().distinct())
+    lacking_bugs = cited_project_ids - get_ids_of_projects_with_bugs()
+    return list(mysite.search.models.Project.objects.filter(
+            id__in=lacking_bugs).order_by(u'name'))
@@ -0,0 +1,398 @@
+import re
+import datetime
+import logging
+import threading
+
+from django.conf import settings
+from django.db.models import Q, Count
+
+import mysite.search.models
+
+### Search engines for Query.get_bugs_unordered().
+###
+### The regex engine is what we have always done: hand MySQL a REGEXP per
+### field per term and let it scan the whole bug table.
+###
+### The inverted index engine keeps a map from word to the ids of the open
+### bugs that contain that word, so that a conjunction of terms is an
+### intersection of sets. It returns exactly the same hits as the regex
+### engine: terms that are a single plain word are answered by the index
+### alone, and for anything fancier (quoted phrases, "c++") the index only
+### narrows down the candidates and we still ask MySQL to run the regex on
+### those few rows. It also keeps a Bitset of open bugs per facet value, so
+### facet filters and facet counts are intersections too.
+
+# This is what MySQL's [[:<:]] and [[:>:]] consider to be a word.
+WORD_RE = re.compile(r'[A-Za-z0-9_]+')
+PLAIN_WORD_RE = re.compile(r'^[A-Za-z0-9_]+$')
+
+# Bump this Epoch string whenever a Bug or its Project changes, so that every
+# process knows to pull in the changes.
+EPOCH_NAME = u'search.BugIndex'
+
+def tokenize(text):
+    return set([word.lower() for word in WORD_RE.findall(text or u'')])
+
+def term_is_a_plain_word(term):
+    return bool(PLAIN_WORD_RE.match(term))
+
+# The Bug column that each facet looks at.
+FACET2COLUMN = {
+    u'language': u'project__language',
+    u'project': u'project__name',
+    u'toughness': u'good_for_newcomers',
+    u'contribution_type': u'concerns_just_documentation',
+}
+
+def facet_value2key(value):
+    '''Facets compare strings with __iexact, so bucket them lowercased.'''
+    if isinstance(value, basestring):
+        return value.lower()
+    if value is None:
+        return u''
+    return bool(value)
+
+POPCOUNT_16 = [0] * (1 << 16)
+for _i in range(1, 1 << 16):
+    POPCOUNT_16[_i] = POPCOUNT_16[_i >> 1] + (_i & 1)
+
+class Bitset(object):
+    '''A set of bug ids, stored as a dict mapping word number to a 32-bit
+    int. Adding and removing an id is O(1), and intersecting two Bitsets
+    is a word-at-a-time AND over the smaller one.'''
+    WORD_BITS = 32
+
+    def __init__(self, words=None):
+        self.words = words or {}
+
+    @staticmethod
+    def from_ids(ids):
+        ret = Bitset()
+        for i in ids:
+            ret.add(i)
+        return ret
+
+    def copy(self):
+        return Bitset(dict(self.words))
+
+    def add(self, i):
+        word, bit = divmod(i, self.WORD_BITS)
+        self.words[word] = self.words.get(word, 0) | (1 << bit)
+
+    def discard(self, i):
+        word, bit = divmod(i, self.WORD_BITS)
+        bits = self.words.get(word, 0) & ~(1 << bit)
+        if bits:
+            self.words[word] = bits
+        elif word in self.words:
+            del self.words[word]
+
+    def __contains__(self, i):
+        word, bit = divmod(i, self.WORD_BITS)
+        return bool(self.words.get(word, 0) & (1 << bit))
+
+    def __and__(self, other):
+        if len(self.words) > len(other.words):
+            self, other = other, self
+        words = {}
+        for word, bits in self.words.iteritems():
+            both = bits & other.words.get(word, 0)
+            if both:
+                words[word] = both
+        return Bitset(words)
+
+    def __len__(self):
+        return sum([POPCOUNT_16[bits & 0xffff] + POPCOUNT_16[bits >> 16]
+                    for bits in self.words.itervalues()])
+
+    def __iter__(self):
+        for word in sorted(self.words):
+            bits = self.words[word]
+            for bit in range(self.WORD_BITS):
+                if bits & (1 << bit):
+                    yield word * self.WORD_BITS + bit
+
+class BugIndex(object):
+    '''An in-process inverted index over the open bugs, plus a Bitset of
+    open bugs for every value of every facet.
+
+    It stays fresh by checking the EPOCH_NAME Epoch before each use,
+    re-reading only the bugs (and bugs of projects) modified since it last
+    looked, and dropping the bugs that aren't open any more. (Deleted bugs
+    have no modified_date to find them by.)'''
+
+    # How far back to look when re-reading recently modified bugs. MySQL
+    # only stores whole seconds, and a bug saved inside a transaction can
+    # show up a little after its modified_date.
+    RESYNC_MARGIN = datetime.timedelta(seconds=60)
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        self.word2bug_ids = {}
+        self.open_bug_ids = Bitset()
+        self.facet2key2bug_ids = {}
+        for facet_name in FACET2COLUMN:
+            self.facet2key2bug_ids[facet_name] = {}
+        self.bug_id2document = {}
+        self.epoch = None
+        self.synced_at = None
+
+    def rebuild_on_next_sync(self):
+        self.lock.acquire()
+        try:
+            self.synced_at = None
+        finally:
+            self.lock.release()
+
+    def is_fresh(self, epoch):
+        if self.synced_at is None or epoch != self.epoch:
+            return False
+        # If the Epoch was bumped in the same second we last synced, a second
+        # bump within that second would look identical. So don't trust it.
+        return tuple(epoch)[:6] < self.synced_at.timetuple()[:6]
+
+    def sync(self):
+        epoch = mysite.search.models.Epoch.get_for_string(EPOCH_NAME)
+        self.lock.acquire()
+        try:
+            if self.is_fresh(epoch):
+                return
+            now = datetime.datetime.now()
+            Bug = mysite.search.models.Bug
+            if self.synced_at is None:
+                logging.info("Building the bug index from scratch.")
+                self.clear()
+                bugs = Bug.open_ones.all()
+            else:
+                since = self.synced_at - self.RESYNC_MARGIN
+                bugs = Bug.all_bugs.filter(
+                    Q(modified_date__gte=since) |
+                    Q(project__modified_date__gte=since))
+            self.index_bugs(bugs)
+            if self.synced_at is not None:
+                self.remove_bugs_not_in(
+                    Bug.open_ones.values_list('id', flat=True))
+            self.epoch = epoch
+            self.synced_at = now
+        finally:
+            self.lock.release()
+
+    def index_bugs(self, bugs):
+        columns = bugs.values_list('id', 'looks_closed', 'title', 'description',
+                                   'as_appears_in_distribution',
+                                   'project__name', 'project__language',
+                                   'good_for_newcomers',
+                                   'concerns_just_documentation')
+        for row in columns.iterator():
+            bug_id, looks_closed = row[:2]
+            self.remove_bug_id(bug_id)
+            if not looks_closed:
+                self.add_document(bug_id, *row[2:])
+
+    def remove_bugs_not_in(self, open_bug_ids):
+        '''Forget the bugs that aren't among open_bug_ids, like the ones
+        another process has deleted.'''
+        open_bug_ids = set(open_bug_ids)
+        for bug_id in self.bug_id2document.keys():
+            if bug_id not in open_bug_ids:
+                self.remove_bug_id(bug_id)
+
+    def index_bug(self, bug):
+        self.lock.acquire()
+        try:
+            if self.synced_at is None:
+                return # We'll read it in when we build the index.
+            self.remove_bug_id(bug.id)
+            if not bug.looks_closed:
+                self.add_document(bug.id, bug.title, bug.description,
+                                  bug.as_appears_in_distribution,
+                                  bug.project.name, bug.project.language,
+                                  bug.good_for_newcomers,
+                                  bug.concerns_just_documentation)
+        finally:
+            self.lock.release()
+
+    def add_document(self, bug_id, title, description, distribution,
+                     project_name, project_language, good_for_newcomers,
+                     concerns_just_documentation):
+        words = tokenize(title)
+        words.update(tokenize(description))
+        words.update(tokenize(distribution))
+        words.update(tokenize(project_name))
+        facet2key = {
+            u'language': facet_value2key(project_language),
+            u'project': facet_value2key(project_name),
+            u'toughness': facet_value2key(good_for_newcomers),
+            u'contribution_type': facet_value2key(concerns_just_documentation),
+        }
+
+        for word in words:
+            self.word2bug_ids.setdefault(word, set()).add(bug_id)
+        self.open_bug_ids.add(bug_id)
+        for facet_name, key in facet2key.items():
+            self.facet2key2bug_ids[facet_name].setdefault(
+                key, Bitset()).add(bug_id)
+        self.bug_id2document[bug_id] = (words, facet2key)
+
+    def remove_bug_id(self, bug_id):
+        self.lock.acquire()
+        try:
+            document = self.bug_id2document.pop(bug_id, None)
+            if document is None:
+                return
+            words, facet2key = document
+            for word in words:
+                self.word2bug_ids[word].discard(bug_id)
+                if not self.word2bug_ids[word]:
+                    del self.word2bug_ids[word]
+            self.open_bug_ids.discard(bug_id)
+            for facet_name, key in facet2key.items():
+                self.facet2key2bug_ids[facet_name][key].discard(bug_id)
+        finally:
+            self.lock.release()
+
+    def bug_ids_matching_term(self, term):
+        '''Return a superset of the ids of the open bugs that the regex
+        engine would match for this term. If the term is a plain word, it's
+        not a superset; it's exactly right.'''
+        ret = set(self.facet2key2bug_ids[u'language'].get(term.lower(), ()))
+
+        # Every run of word characters in the term has to appear as a whole
+        # word in the bug, or else [[:<:]] and [[:>:]] could not both match.
+        # A term without any word characters can never satisfy [[:<:]].
+        words = list(tokenize(term))
+        if words:
+            postings = [self.word2bug_ids.get(word, set()) for word in words]
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+            ret.update(candidates)
+        return ret
+
+    def bug_ids_matching_terms(self, terms):
+        ret = None
+        self.lock.acquire()
+        try:
+            for term in terms:
+                matching = self.bug_ids_matching_term(term)
+                if ret is None:
+                    ret = matching
+                else:
+                    ret.intersection_update(matching)
+                if not ret:
+                    break
+        finally:
+            self.lock.release()
+        return ret or set()
+
+    def bug_ids_matching(self, terms, facet2key):
+        '''Return a Bitset of the open bugs matching all of the terms (see
+        bug_ids_matching_term) and having all of the facet values. It's
+        always a new Bitset, so the caller can use it after letting go of
+        the lock.'''
+        self.lock.acquire()
+        try:
+            if terms:
+                ret = Bitset.from_ids(self.bug_ids_matching_terms(terms))
+            else:
+                ret = self.open_bug_ids.copy()
+            for facet_name, key in facet2key.items():
+                ret = ret & self.facet2key2bug_ids[facet_name].get(key, Bitset())
+            return ret
+        finally:
+            self.lock.release()
+
+    def count_bug_ids_by_facet_value(self, terms, facet2key, facet_name):
+        self.lock.acquire()
+        try:
+            matching = self.bug_ids_matching(terms, facet2key)
+            ret = {}
+            for key, bug_ids in self.facet2key2bug_ids[facet_name].items():
+                count = len(matching & bug_ids)
+                if count:
+                    ret[key] = count
+            return ret
+        finally:
+            self.lock.release()
+
+bug_index = BugIndex()
+
+class Engine(object):
+    def get_bugs_unordered(self, query):
+        raise NotImplementedError
+
+    def count_bugs(self, query):
+        return self.get_bugs_unordered(query).count()
+
+    def count_bugs_by_facet_value(self, query, facet_name):
+        '''Return a dict mapping each value of the facet's column (see
+        facet_value2key) to the number of bugs the query finds with that
+        value. This is one GROUP BY query, no matter how many values.'''
+        column = FACET2COLUMN[facet_name]
+        rows = self.get_bugs_unordered(query).values(column).annotate(
+            count=Count('id')).order_by()
+        ret = {}
+        for row in rows:
+            key = facet_value2key(row[column])
+            ret[key] = ret.get(key, 0) + row['count']
+        return ret
+
+class RegexEngine(Engine):
+    '''Ask MySQL to regex its way through every open bug.'''
+    def get_bugs_unordered(self, query):
+        return mysite.search.models.Bug.open_ones.filter(query.get_Q())
+
+class InvertedIndexEngine(Engine):
+    '''Intersect posting lists and facet Bitsets in memory, then let MySQL
+    fetch just those bugs (and double-check the terms that aren't plain
+    words).'''
+
+    # Past this many ids, the IN (...) clause costs more than it saves.
+    MAX_BUG_IDS_IN_SQL = 10000
+
+    def __init__(self, index=None):
+        self.index = index or bug_index
+
+    def get_bugs_unordered(self, query):
+        self.index.sync()
+        bug_ids = self.index.bug_ids_matching(query.terms,
+                                              query.get_facet_value_keys())
+        if len(bug_ids) > self.MAX_BUG_IDS_IN_SQL:
+            return RegexEngine().get_bugs_unordered(query)
+
+        q = query.get_facets_Q()
+        for term in query.terms:
+            if not term_is_a_plain_word(term):
+                q &= query.get_term_Q(term)
+        return mysite.search.models.Bug.open_ones.filter(
+            pk__in=list(bug_ids)).filter(q)
+
+    def count_bugs(self, query):
+        # Only plain words are answered exactly by the index.
+        for term in query.terms:
+            if not term_is_a_plain_word(term):
+                return Engine.count_bugs(self, query)
+        self.index.sync()
+        return len(self.index.bug_ids_matching(query.terms,
+                                               query.get_facet_value_keys()))
+
+    def count_bugs_by_facet_value(self, query, facet_name):
+        # Only plain words are answered exactly by the index.
+        for term in query.terms:
+            if not term_is_a_plain_word(term):
+                return Engine.count_bugs_by_facet_value(self, query, facet_name)
+        self.index.sync()
+        return self.index.count_bug_ids_by_facet_value(
+            query.terms, query.get_facet_value_keys(), facet_name)
+
+engines = {
+    'regex': RegexEngine,
+    'inverted_index': InvertedIndexEngine,
+}
+
+def get_engine():
+    return engines[getattr(settings, 'BUG_SEARCH_ENGINE', 'regex')]()
@@ -0,0 +1,41 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+import mysite.search.benchmark.corpus
+import mysite.search.benchmark.stages
+
+class Command(NoArgsCommand):
+    help = ("Time the stages of a bug search, cold and warm, against a "
+            "made-up corpus of bugs. Don't run this against the "
+            "production database.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--bugs', type='int', default=10000,
+                    help='How many bugs to make up.'),
+        make_option('--projects', type='int', default=1000,
+                    help='How many projects to spread them over.'),
+        make_option('--seed', type='int', default=0,
+                    help='Seed for the random number generator.'),
+        make_option('--repeat', type='int', default=5,
+                    help='How many warm runs to take the median of.'),
+        make_option('--keep', action='store_true', default=False,
+                    help="Don't delete the corpus afterwards."),
+        make_option('--reuse', action='store_true', default=False,
+                    help='Use the corpus a --keep run left behind.'),
+    )
+
+    def handle_noargs(self, **options):
+        corpus = mysite.search.benchmark.corpus
+        if not options['reuse']:
+            print "Making up %d bugs in %d projects..." % (
+                options['bugs'], options['projects'])
+            corpus.create(options['bugs'], options['projects'],
+                          seed=options['seed'])
+        try:
+            results = mysite.search.benchmark.stages.run(
+                repeat=options['repeat'])
+            print mysite.search.benchmark.stages.format_report(results)
+        finally:
+            if not options['keep']:
+                corpus.delete()
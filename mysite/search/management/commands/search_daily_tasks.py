@@ -147,5 +147,7 @@ class Command(BaseCommand):
         self.update_trac_instances()
         self.find_and_update_enabled_roundup_trackers()
         self.update_bugzilla_trackers()
+        mysite.search.tasks.garbage_collect_hit_count_cache()
+        mysite.search.tasks.refresh_search_page_chrome()
         
 
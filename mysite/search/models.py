@@ -12,6 +12,8 @@ import urllib
 import random
 from django.db.models import Q
 import mysite.customs
+import mysite.base.helpers
+import mysite.base.image_derivatives
 import mysite.base.unicode_sanity
 from django.core.urlresolvers import reverse
 import voting
@@ -25,28 +27,8 @@ class OpenHatchModel(models.Model):
         abstract = True
 
 def get_image_data_scaled(image_data, width):
-    # scale it
-    image_fd = StringIO.StringIO(image_data)
-    im = Image.open(image_fd)
-    image_fd.seek(0)
-
-    w, h = get_image_dimensions(image_fd)
-
-    new_w = width
-    new_h = (h * 1.0 / w) * width
-
-    smaller = im.resize((new_w, new_h),
-                        Image.ANTIALIAS)
-
-    # "Save" it to memory
-    new_image_fd = StringIO.StringIO()
-    smaller.save(new_image_fd, format='PNG')
-    new_image_fd.seek(0)
-
-    # pull data out
-    image_data = new_image_fd.getvalue()
-    return image_data
-
+    return mysite.base.image_derivatives.scale_to_widths(
+        image_data, [width])[width]
 
 class Project(OpenHatchModel):
 
@@ -183,29 +165,20 @@ class Project(OpenHatchModel):
         else:
             return settings.MEDIA_URL + 'no-project-icon-w=20.png'
 
+    # The scaled-down icons we make from icon_raw, and how wide they are:
+    # one for the profile, one for badges, and one that fits in the search
+    # results.
+    ICON_DERIVATIVES = (('icon_for_profile', 64),
+                        ('icon_smaller_for_badge', 40),
+                        ('icon_for_search_result', 20))
+
     def update_scaled_icons_from_self_icon(self):
         '''This method should be called when you update the Project.icon_raw attribute.
-        Side-effect: Saves a scaled-down version of that icon in the
-        Project.icon_smaller_for_badge field.'''
-        # First of all, do nothing if self.icon_raw is a false value.
-        if not self.icon_raw:
-            return
-        # Okay, now we must have some normal-sized icon. 
-
-        raw_icon_data = self.icon_raw.file.read()
-
-        # Scale raw icon to a size for the profile.
-        profile_icon_data = get_image_data_scaled(raw_icon_data, 64)
-        self.icon_for_profile.save('', ContentFile(profile_icon_data))
-
-        # Scale it down to badge size, which
-        # happens to be width=40
-        badge_icon_data = get_image_data_scaled(raw_icon_data, 40)
-        self.icon_smaller_for_badge.save('', ContentFile(badge_icon_data))
-
-        # Scale normal-sized icon down to a size that fits in the search results--20px by 20px
-        search_result_icon_data = get_image_data_scaled(raw_icon_data, 20)
-        self.icon_for_search_result.save('', ContentFile(search_result_icon_data))
+        Side-effect: Saves scaled-down versions of that icon in the
+        Project.icon_for_profile, icon_smaller_for_badge and
+        icon_for_search_result fields.'''
+        mysite.base.image_derivatives.update(self, 'icon_raw',
+                                             Project.ICON_DERIVATIVES)
 
     def get_contributors(self):
         """Return a list of Person objects who are contributors to
@@ -524,14 +497,176 @@ class WannaHelperNote(OpenHatchModel):
     def template_for_feed(self):
         return 'base/wannahelp-in-feed.html'
 
+class HitCountDependency(OpenHatchModel):
+    # Something a cached hit count depends on: a word that a search term
+    # needs, or a facet value. The version goes up whenever a bug that has
+    # that word or value changes, which changes the key of every hit count
+    # that depends on it. (We don't use Epochs for this, since their
+    # one-second resolution would let two quick bug saves look like one.)
+    name = models.CharField(max_length=255, unique=True)
+    version = models.IntegerField(default=0)
+
+    # Every hit count depends on this one. Bump it to forget them all.
+    EVERYTHING = u'everything:'
+
+    @staticmethod
+    def make_name(kind, value):
+        name = u'%s:%s' % (kind, value)
+        if len(name) > 255:
+            name = u'%s:sha1:%s' % (kind, hashlib.sha1(
+                name.encode('utf-8')).hexdigest())
+        return name
+
+    @staticmethod
+    def get_versions(names):
+        """Return a dict mapping each name to its current version. Create
+        the ones we've never seen, so that bug saves start bumping them."""
+        ret = dict(HitCountDependency.objects.filter(
+            name__in=list(names)).values_list('name', 'version'))
+        missing = [name for name in names if name not in ret]
+        if missing:
+            # One INSERT for all of them; then read them back, in case
+            # somebody made (and bumped) some in the meantime.
+            now = datetime.datetime.now()
+            mysite.base.helpers.insert_ignoring_duplicates(
+                HitCountDependency,
+                ['name', 'version', 'created_date', 'modified_date'],
+                [[name, 0, now, now] for name in missing])
+            ret.update(dict(HitCountDependency.objects.filter(
+                        name__in=missing).values_list('name', 'version')))
+        return ret
+
+    @staticmethod
+    def bump(names):
+        # This only touches names some cached count depends on, so it's one
+        # UPDATE no matter how many words the bug has.
+        if names:
+            HitCountDependency.objects.filter(name__in=list(names)).update(
+                version=models.F('version') + 1)
+
+    @staticmethod
+    def get_names_for_bug_values(title, description, distribution,
+                                 project_name, project_language,
+                                 good_for_newcomers,
+                                 concerns_just_documentation):
+        """Which dependencies could a change to this bug affect? Every query
+        that matches the bug depends on (at least) some of these."""
+        import mysite.search.engines
+        engines = mysite.search.engines
+        make_name = HitCountDependency.make_name
+
+        # A term matches a bug if the bug has all of the term's words, or if
+        # the term is the bug's language. So bump every word, and the
+        # language as a word too.
+        words = engines.tokenize(title)
+        words.update(engines.tokenize(description))
+        words.update(engines.tokenize(distribution))
+        words.update(engines.tokenize(project_name))
+        words.add((project_language or u'').lower())
+        names = set([make_name(u'word', word) for word in words])
+
+        for facet_name, value in [
+            (u'language', project_language),
+            (u'project', project_name),
+            (u'toughness', good_for_newcomers),
+            (u'contribution_type', concerns_just_documentation)]:
+            names.add(make_name(facet_name, engines.facet_value2key(value)))
+
+        # Queries with no terms or facets count every open bug.
+        names.add(make_name(u'all', u''))
+        return names
+
+    @staticmethod
+    def get_names_for_bug(bug):
+        return HitCountDependency.get_names_for_bug_values(
+            bug.title, bug.description, bug.as_appears_in_distribution,
+            bug.project.name, bug.project.language, bug.good_for_newcomers,
+            bug.concerns_just_documentation)
+
+    @staticmethod
+    def get_names_for_project(project):
+        """What depends on the project's bugs having this project's name and
+        language, apart from the words in the bugs themselves."""
+        import mysite.search.engines
+        engines = mysite.search.engines
+        make_name = HitCountDependency.make_name
+        words = engines.tokenize(project.name)
+        words.add((project.language or u'').lower())
+        names = set([make_name(u'word', word) for word in words])
+        names.add(make_name(u'language',
+                            engines.facet_value2key(project.language)))
+        names.add(make_name(u'project', engines.facet_value2key(project.name)))
+        return names
+
 class HitCountCache(OpenHatchModel):
     hashed_query = models.CharField(max_length=40, primary_key=True) # stores a sha1 
     hit_count = models.IntegerField()
 
+    # The hashed_query includes the versions of the HitCountDependencies, so
+    # entries never go stale; they just stop being looked up. That means
+    # this process can remember them without asking the table again.
+    recently_used = mysite.base.helpers.LRUCache(max_size=getattr(
+        settings, 'HIT_COUNT_CACHE_LRU_SIZE', 10000))
+
+    # Entries older than this get garbage collected. (If one was still
+    # current, the next lookup just counts again.)
+    MAX_AGE = datetime.timedelta(days=7)
+
     @staticmethod
     def clear_cache(*args, **kwargs):
         # Ignore arguments passed here by Django signals.
+        HitCountDependency.bump([HitCountDependency.EVERYTHING])
         HitCountCache.objects.all().delete()
+        HitCountCache.recently_used.clear()
+
+    @staticmethod
+    def get_many(hashed_queries):
+        """Return a dict mapping each of the hashed queries we have a count
+        for to that count. At most one query to the table."""
+        ret = {}
+        missing = []
+        for hashed_query in hashed_queries:
+            hit_count = HitCountCache.recently_used.get(hashed_query)
+            if hit_count is None:
+                missing.append(hashed_query)
+            else:
+                ret[hashed_query] = hit_count
+        if missing:
+            rows = HitCountCache.objects.filter(
+                hashed_query__in=missing).values_list(
+                'hashed_query', 'hit_count')
+            for hashed_query, hit_count in rows:
+                HitCountCache.recently_used.set(hashed_query, hit_count)
+                ret[hashed_query] = hit_count
+        return ret
+
+    @staticmethod
+    def store(hashed_query, hit_count):
+        hcc, _ = HitCountCache.objects.get_or_create(
+                hashed_query=hashed_query,
+                defaults={'hit_count': hit_count})
+        HitCountCache.recently_used.set(hashed_query, hcc.hit_count)
+        return hcc.hit_count
+
+    @staticmethod
+    def store_many(hash2count):
+        """Store a count for each hashed query in one INSERT. Entries that
+        somebody else has stored in the meantime are left alone; they
+        counted the same bugs we did."""
+        now = datetime.datetime.now()
+        mysite.base.helpers.insert_ignoring_duplicates(
+            HitCountCache,
+            ['hashed_query', 'hit_count', 'created_date', 'modified_date'],
+            [[hashed_query, hit_count, now, now]
+             for hashed_query, hit_count in hash2count.items()])
+        for hashed_query, hit_count in hash2count.items():
+            HitCountCache.recently_used.set(hashed_query, hit_count)
+
+    @staticmethod
+    def garbage_collect():
+        HitCountCache.objects.filter(
+            modified_date__lt=datetime.datetime.now() -
+            HitCountCache.MAX_AGE).delete()
 
 def post_bug_save_increment_bug_model_epoch(sender, instance, created, **kwargs):
     if created:
@@ -547,9 +682,48 @@ def post_bug_delete_increment_bug_model_epoch(sender, instance, **kwargs):
     # always bump it
     mysite.search.models.Epoch.bump_for_model(sender)
 
-# Clear the cache whenever Bugs are added or removed.
-models.signals.post_save.connect(HitCountCache.clear_cache, Bug)
-models.signals.post_delete.connect(HitCountCache.clear_cache, Bug)
+# When a Bug changes, only the hit counts that depend on the words and facet
+# values it had before or has now go stale.
+def remember_hit_count_dependencies_before_save(sender, instance, **kwargs):
+    instance._hit_count_dependencies_before_save = set()
+    if instance.pk is None or kwargs.get('raw', False):
+        return
+    try:
+        if sender is Bug:
+            before = Bug.all_bugs.select_related('project').get(pk=instance.pk)
+            names = HitCountDependency.get_names_for_bug(before)
+        else:
+            before = Project.objects.get(pk=instance.pk)
+            names = HitCountDependency.get_names_for_project(before)
+    except sender.DoesNotExist:
+        return
+    instance._hit_count_dependencies_before_save = names
+
+def bump_hit_count_dependencies_of_bug(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        # Fixtures may refer to a project that isn't loaded yet.
+        HitCountDependency.bump([HitCountDependency.EVERYTHING])
+        return
+    names = getattr(instance, '_hit_count_dependencies_before_save', set())
+    HitCountDependency.bump(
+        names | HitCountDependency.get_names_for_bug(instance))
+
+def bump_hit_count_dependencies_of_project(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        HitCountDependency.bump([HitCountDependency.EVERYTHING])
+        return
+    names = getattr(instance, '_hit_count_dependencies_before_save', set())
+    HitCountDependency.bump(
+        names | HitCountDependency.get_names_for_project(instance))
+
+models.signals.pre_save.connect(
+    remember_hit_count_dependencies_before_save, Bug)
+models.signals.post_save.connect(bump_hit_count_dependencies_of_bug, Bug)
+models.signals.post_delete.connect(bump_hit_count_dependencies_of_bug, Bug)
+models.signals.pre_save.connect(
+    remember_hit_count_dependencies_before_save, Project)
+models.signals.post_save.connect(bump_hit_count_dependencies_of_project,
+                                 Project)
 
 # Clear all people's recommended bug cache when a bug is deleted
 # (or when it has been modified to say it looks_closed)
@@ -561,12 +735,53 @@ models.signals.post_delete.connect(
     post_bug_delete_increment_bug_model_epoch,
     Bug)
 
+# The search page's chrome (see
+# mysite.search.controllers.get_search_page_chrome) is keyed by this.
+def increment_project_model_epoch(sender, instance, **kwargs):
+    Epoch.bump_for_model(sender)
+
+models.signals.post_save.connect(increment_project_model_epoch, Project)
+models.signals.post_delete.connect(increment_project_model_epoch, Project)
+
+# Tell the bug search index (in every process) to re-read changed bugs.
+def bump_bug_index_epoch(sender, instance, **kwargs):
+    import mysite.search.engines
+    if kwargs.get('raw', False):
+        # Fixtures keep their own modified_date, so only a full rebuild
+        # is sure to notice them.
+        mysite.search.engines.bug_index.rebuild_on_next_sync()
+    Epoch.bump_for_string(mysite.search.engines.EPOCH_NAME)
+
+def update_bug_in_bug_index(sender, instance, **kwargs):
+    # Other processes catch up through the Epoch; this one needn't wait.
+    if kwargs.get('raw', False):
+        return
+    import mysite.search.engines
+    mysite.search.engines.bug_index.index_bug(instance)
+
+def remove_bug_from_bug_index(sender, instance, **kwargs):
+    import mysite.search.engines
+    mysite.search.engines.bug_index.remove_bug_id(instance.id)
+
+models.signals.post_save.connect(bump_bug_index_epoch, Bug)
+models.signals.post_save.connect(update_bug_in_bug_index, Bug)
+models.signals.post_delete.connect(bump_bug_index_epoch, Bug)
+models.signals.post_delete.connect(remove_bug_from_bug_index, Bug)
+models.signals.post_save.connect(bump_bug_index_epoch, Project)
+
+# Autocompletion suggests project names and languages.
+def rebuild_autocompletion_index(sender, instance, **kwargs):
+    import mysite.search.autocompletion
+    mysite.search.autocompletion.autocompletion_index.rebuild_on_next_use()
+    Epoch.bump_for_string(mysite.search.autocompletion.EPOCH_NAME)
+
+models.signals.post_save.connect(rebuild_autocompletion_index, Project)
+models.signals.post_delete.connect(rebuild_autocompletion_index, Project)
+
 # Re-index the person when he says he likes a new project
 def update_the_person_index_from_project(sender, instance, **kwargs):
-    import mysite.profile.tasks
     for person in instance.people_who_wanna_help.all():
-        task = mysite.profile.tasks.ReindexPerson()
-        task.delay(person.id)
+        person.reindex_for_person_search()
 
 models.signals.post_save.connect(update_the_person_index_from_project, sender=Project)
 
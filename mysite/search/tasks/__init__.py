@@ -27,6 +27,12 @@ class PopulateProjectIconFromOhloh(Task):
         project.populate_icon_from_ohloh()
         project.save()
     
+@celery.decorators.task
+def generate_project_icons(project_id):
+    """Make the scaled-down icons of a project's icon, after it changes."""
+    project = mysite.search.models.Project.objects.get(id=project_id)
+    project.update_scaled_icons_from_self_icon()
+
 class PopulateProjectLanguageFromOhloh(Task):
     def run(self, project_id, **kwargs):
         logger = self.get_logger(**kwargs)
@@ -63,3 +69,17 @@ class PopulateProjectLanguageFromOhloh(Task):
 def clear_search_cache():
     logging.info("Clearing the search cache.")
     mysite.base.helpers.clear_static_cache('search')
+
+### HitCountCache entries are keyed by the versions of what they depend on,
+### so stale ones are never read; they just take up space until we do this.
+@celery.decorators.task
+def garbage_collect_hit_count_cache():
+    logging.info("Garbage collecting the hit count cache.")
+    mysite.search.models.HitCountCache.garbage_collect()
+
+### The search page's sidebar comes out of a snapshot; new bugs don't make
+### it stale on their own, so rebuild it once they're in.
+@celery.decorators.task
+def refresh_search_page_chrome():
+    import mysite.search.controllers
+    mysite.search.controllers.refresh_search_page_chrome()
@@ -31,6 +31,7 @@ from django.utils.html import escape
 import lxml.html
 import lxml.html.builder
 import cgi # raffi and asheesh added this
+import mysite.base.helpers
 
 register = template.Library()
 
@@ -45,6 +46,43 @@ SETTINGS_DEFAULTS = {
 def get_setting(name):
     return getattr(settings, SETTINGS_PREFIX + name, SETTINGS_DEFAULTS[name])
 
+# Compiled regexes, keyed by (phrases, ignore_case, word_boundary, grouped).
+# Every result on a page is highlighted with the same search terms, so
+# compile them once.
+matchers = mysite.base.helpers.LRUCache(max_size=200)
+
+def get_matcher(phrases, ignore_case, word_boundary, grouped=False):
+    """Return a compiled regex that matches any of the phrases. If grouped,
+    each phrase gets its own group, so that match.lastindex says which
+    phrase matched; that makes the regex a little slower."""
+    key = (tuple(phrases), bool(ignore_case), bool(word_boundary), grouped)
+    matcher = matchers.get(key)
+    if matcher is None:
+        flags = ignore_case and re.I or 0
+        re_template = word_boundary and r"\b(%s)\b" or r"(%s)"
+        phrases = map(re.escape, phrases)
+        if grouped:
+            re_template = re_template.replace("(%s)", "(?:%s)")
+            phrases = ["(%s)" % p for p in phrases] or ["()"]
+        matcher = re.compile(re_template % "|".join(phrases), flags)
+        matchers.set(key, matcher)
+    return matcher
+
+whitespace = re.compile(r'\s+')
+
+def first_words(text, n):
+    """Split text on whitespace like whitespace.split does, but stop after
+    n words. Return the words, and whether there were more."""
+    words = whitespace.split(text, n)
+    return words[:n], len(words) > n
+
+def last_words(text, n):
+    """Like first_words, but from the end. Runs of whitespace are the same
+    read backwards, so we split the reversed text."""
+    words, more = first_words(text[::-1], n)
+    words.reverse()
+    return [word[::-1] for word in words], more
+
 def searchexcerpt(text, phrases, context_words=None, ignore_case=None, word_boundary=None):
     if isinstance(phrases, basestring):
         phrases = [phrases]
@@ -55,53 +93,52 @@ def searchexcerpt(text, phrases, context_words=None, ignore_case=None, word_boun
     if word_boundary is None:
         word_boundary = get_setting('WORD_BOUNDARY')
 
-    phrases = map(re.escape, phrases)
-    flags = ignore_case and re.I or 0
-    exprs = [re.compile(r"^%s$" % p, flags) for p in phrases]
-    whitespace = re.compile(r'\s+')
-
-    re_template = word_boundary and r"\b(%s)\b" or r"(%s)"
-    pieces = re.compile(re_template % "|".join(phrases), flags).split(text)
-    matches = {}
-    word_lists = []
-    index = {}
-    for i, piece in enumerate(pieces):
-        word_lists.append(whitespace.split(piece))
-        if i % 2:
-            index[i] = expr = ifilter(lambda e: e.match(piece), exprs).next()
-            matches.setdefault(expr, []).append(i)
-
-    def merge(lists):
-        merged = []
-        for words in lists:
-            if merged:
-                merged[-1] += words[0]
-                del words[0]
-            merged.extend(words)
-        return merged
-
-    i = 0
-    merged = []
-    for j in map(min, matches.itervalues()):
-        merged.append(merge(word_lists[i:j]))
-        merged.append(word_lists[j])
-        i = j + 1
-    merged.append(merge(word_lists[i:]))
-
+    # Brian Beck's code split the whole text into words around every hit.
+    # We only need the words around the first hit on each phrase, so we find
+    # those, count the rest, and split just the bits of text we show.
+    first_hits = []
+    phrases_hit = set()
+    hit_count = 0
+    matcher = get_matcher(phrases, ignore_case, word_boundary, grouped=True)
+    for match in matcher.finditer(text):
+        if match.start() == match.end():
+            continue # re.split(), which this used to use, skips these.
+        hit_count += 1
+        if match.lastindex not in phrases_hit:
+            phrases_hit.add(match.lastindex)
+            first_hits.append(match.span())
+            if len(phrases_hit) == len(phrases) and '' not in phrases:
+                # Now we just need to count the rest, and the plain regex
+                # is quicker at that.
+                hit_count += len(get_matcher(
+                    phrases, ignore_case, word_boundary).findall(
+                    text, match.end()))
+                break
+
+    n = context_words + 1
     output = []
-    for i, words in enumerate(merged):
-        omit = None
-        if i == len(merged) - 1:
-            omit = slice(max(1, 2 - i) * context_words + 1, None)
-        elif i == 0:
-            omit = slice(-context_words - 1)
-        elif not i % 2:
-            omit = slice(context_words + 1, -context_words - 1)
-        if omit and words[omit]:
-            words[omit] = ["..."]
-        output.append(" ".join(words))
-
-    return dict(original=text, excerpt="".join(output), hits=len(index))
+    if not first_hits:
+        words, more = first_words(text, 2 * context_words + 1)
+        output.append(" ".join(words + (more and ["..."] or [])))
+    else:
+        # Before the first hit
+        words, more = last_words(text[:first_hits[0][0]], n)
+        output.append(" ".join((more and ["..."] or []) + words))
+        for i, (start, end) in enumerate(first_hits):
+            output.append(" ".join(whitespace.split(text[start:end])))
+            if i + 1 < len(first_hits):
+                # Between this hit and the next
+                between = text[end:first_hits[i + 1][0]]
+                words, more = first_words(between, 2 * n)
+                if more:
+                    words = (first_words(between, n)[0] + ["..."] +
+                             last_words(between, n)[0])
+                output.append(" ".join(words))
+        # After the last hit
+        words, more = first_words(text[first_hits[-1][1]:], n)
+        output.append(" ".join(words + (more and ["..."] or [])))
+
+    return dict(original=text, excerpt="".join(output), hits=hit_count)
 
 class FunctionProxyNode(Node):
     def __init__(self, nodelist, args, variable_name=None):
@@ -168,10 +205,7 @@ def highlight(text, phrases, ignore_case=None, word_boundary=None, class_name=No
     if class_name is None:
         class_name = get_setting('HIGHLIGHT_CLASS')
 
-    phrases = map(re.escape, phrases)
-    flags = ignore_case and re.I or 0
-    re_template = word_boundary and r"\b(%s)\b" or r"(%s)"
-    expr = re.compile(re_template % "|".join(phrases), flags)
+    expr = get_matcher(phrases, ignore_case, word_boundary)
     template = '<span class="%s">%%s</span>' % class_name
     matches = []
 
@@ -230,10 +264,7 @@ def hits(text, phrases, ignore_case=None, word_boundary=None):
     if word_boundary is None:
         word_boundary = get_setting('WORD_BOUNDARY')    
 
-    phrases = map(re.escape, phrases)
-    flags = ignore_case and re.I or 0
-    re_template = word_boundary and r"\b(%s)\b" or r"(%s)"
-    expr = re.compile(re_template % "|".join(phrases), flags)
+    expr = get_matcher(phrases, ignore_case, word_boundary)
     return len(expr.findall(text))
 
 class HitsNode(FunctionProxyNode):
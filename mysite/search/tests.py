@@ -6,6 +6,11 @@ from mysite.profile.models import Person
 import mysite.profile.models
 import mysite.customs.miro
 import mysite.search.controllers
+import mysite.search.engines
+import mysite.search.autocompletion
+import mysite.search.templatetags.search
+import mysite.search.benchmark.corpus
+import mysite.search.benchmark.stages
 from mysite.search.models import Project, Bug, HitCountCache, \
         ProjectInvolvementQuestion, Answer, BugAlert
 from mysite.search import views
@@ -15,6 +20,7 @@ import mysite.search.launchpad_crawl
 import mysite.project.views
 
 import simplejson
+import cgi
 import os
 import mock
 import time
@@ -28,6 +34,9 @@ from django.core.servers.basehttp import AdminMediaHandler
 from django.core.handlers.wsgi import WSGIHandler
 from django.core.urlresolvers import reverse
 from django.core.files.base import ContentFile
+import django.core.serializers
+import django.core.cache
+import django.db
 from django.contrib.auth.models import User
 
 from django.db.models import Q 
@@ -118,6 +127,37 @@ class AutoCompleteTests(SearchTest):
         self.assert_(u'lang:Python' not in lang_C_suggestions)
         self.assert_(u'project:ComicChat' not in lang_C_suggestions)
 
+    def testUnknownFieldGetsNoSuggestionsAndIsForgotten(self):
+        self.assertEqual(views.get_autocompletion_suggestions(u'dep:C'), [])
+        self.assertEqual(views.get_autocompletion_suggestions(u'lang:C'),
+                         [u'lang:C++'])
+
+    def testSuggestionsFollowProjectChanges(self):
+        self.project_kazaa.name = u'Kazoo'
+        self.project_kazaa.save()
+        suggestions = views.get_autocompletion_suggestions(u'kaz')
+        self.assertEqual(suggestions, [u'project:Kazoo'])
+
+    def testSuggestionsDontTouchTheDatabaseEveryTime(self):
+        views.get_autocompletion_suggestions(u'C')
+        mock_values_list = mock.Mock()
+        old_objects = Project.objects
+        try:
+            Project.objects = mock.Mock()
+            Project.objects.values_list = mock_values_list
+            views.get_autocompletion_suggestions(u'Comi')
+        finally:
+            Project.objects = old_objects
+        self.assertFalse(mock_values_list.called)
+
+    def testPrefixIndex(self):
+        index = mysite.search.autocompletion.PrefixIndex(
+            [u'Python', u'perl', u'PHP', u'', u'python', u'Pyrex'])
+        self.assertEqual(index.starting_with(u'PY', 5),
+                         [u'Pyrex', u'Python', u'python'])
+        self.assertEqual(index.starting_with(u'p', 2), [u'perl', u'PHP'])
+        self.assertEqual(index.starting_with(u'q', 5), [])
+
     def testSuggestsCorrectStringsFormattedForJQueryAutocompletePlugin(self):
         suggestions_list = views.get_autocompletion_suggestions(u'')
         suggestions_string = views.list_to_jquery_autocompletion_format(
@@ -139,6 +179,54 @@ class AutoCompleteTests(SearchTest):
         response = self.client.get( u'/search/get_suggestions', {})
         self.assertEquals(response.status_code, 500)
 
+class SearchBenchmark(SearchTest):
+
+    def test_corpus_and_stages(self):
+        corpus = mysite.search.benchmark.corpus
+        corpus.create(n_bugs=50, n_projects=5)
+        self.assertEqual(Project.objects.filter(
+            name__startswith=corpus.MARKER).count(), 5)
+        self.assertEqual(Bug.all_bugs.filter(
+            canonical_bug_link__contains=corpus.MARKER).count(), 50)
+
+        results = mysite.search.benchmark.stages.run(repeat=1)
+        self.assertEqual(len(results),
+                         4 * len(mysite.search.benchmark.stages.QUERIES) + 1)
+        for result in results:
+            self.assert_(result['cold_queries'] > 0)
+        report = mysite.search.benchmark.stages.format_report(results)
+        self.assert_('RecommendBugs.recommend' in report)
+
+        corpus.delete()
+        self.assertFalse(Bug.all_bugs.filter(
+            canonical_bug_link__contains=corpus.MARKER))
+
+class SearchExcerptAndHighlight(TestCase):
+
+    def test_excerpt_shows_context_around_first_hit_on_each_phrase(self):
+        text = u'one two three python four five six seven C++ and python eight'
+        excerpt = mysite.search.templatetags.search.searchexcerpt(
+            text, [u'python', u'seven'], context_words=1)
+        self.assertEqual(excerpt[u'excerpt'],
+                         u'... three python four ... six seven C++ ...')
+        self.assertEqual(excerpt[u'hits'], 3)
+
+    def test_excerpt_without_hits(self):
+        excerpt = mysite.search.templatetags.search.searchexcerpt(
+            u'a  b\nc d e f', [u'python'], context_words=1)
+        self.assertEqual(excerpt[u'excerpt'], u'a b c ...')
+        self.assertEqual(excerpt[u'hits'], 0)
+
+    def test_highlight_reuses_compiled_regex(self):
+        tags = mysite.search.templatetags.search
+        highlighted = tags.highlight(u'Python & python', [u'python'])
+        self.assertEqual(highlighted[u'highlighted'],
+                         u'<span class="highlight">Python</span> &amp; '
+                         u'<span class="highlight">python</span>')
+        self.assertEqual(highlighted[u'hits'], 2)
+        self.assert_(tags.get_matcher([u'python'], True, True) is
+                     tags.get_matcher([u'python'], True, True))
+
 class SearchResultsSpecificBugs(SearchTest):
     fixtures = ['short_list_of_bugs.json']
 
@@ -301,6 +389,104 @@ class SearchResults(TwillTests):
         for bug in bugs:
             tc.find(bug.description)
 
+    def test_json_view_serializes_bugs_like_django_does(self):
+        bugs = list(Bug.open_ones.order_by('id')[:5])
+        self.assert_(bugs)
+
+        # This is how we used to do it: Django's serializer, plus one query
+        # per bug for the project name.
+        serializer = django.core.serializers.get_serializer('python')()
+        expected = serializer.serialize(bugs)
+        for bug in expected:
+            bug['fields']['project'] = Project.objects.get(
+                pk=int(bug['fields']['project'])).name
+        expected = simplejson.loads(simplejson.dumps(
+            expected, default=views.encode_datetime))
+
+        # The page of rows is one query, and the response needs no more.
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        try:
+            django.db.reset_queries()
+            rows = list(views.bugs_as_json_values(
+                    Bug.open_ones.order_by('id'))[:5])
+            response = views.bugs_to_json_response({}, rows, 'callback')
+            self.assertEqual(len(django.db.connection.queries), 1)
+        finally:
+            settings.DEBUG = old_debug
+
+        content = response.content
+        self.assert_(content.startswith('callback('))
+        self.assert_(content.endswith(')'))
+        objects = simplejson.loads(content[len('callback('):-1])
+        self.assertEqual(objects[0][u'bugs'], expected)
+        self.assertEqual(objects[0][u'total_bug_count'], 0)
+
+    def test_json_page_cursor_matches_the_html_one(self):
+        bug = Bug.open_ones.order_by('id')[0]
+        row = views.bugs_as_json_values(Bug.open_ones.filter(id=bug.id))[0]
+        self.assertEqual(mysite.search.controllers.bug2page_cursor(row),
+                         mysite.search.controllers.bug2page_cursor(bug))
+
+    def get_following(self, url):
+        path, query_string = url.split(u'?', 1)
+        return self.client.get(path, dict(cgi.parse_qsl(query_string)))
+
+    def test_cursor_pagination_agrees_with_slicing(self):
+        query = mysite.search.controllers.Query.create_from_GET_data(
+            {u'q': u'python'})
+        expected = [bug.id for bug in mysite.search.controllers.order_bugs(
+            query.get_bugs_unordered())]
+        self.assert_(len(expected) > 10)
+
+        # Page forward with the Next links...
+        response = self.client.get(u'/search/',
+                                   {u'q': u'python', u'start': 1, u'end': 5})
+        pages = []
+        while True:
+            context = response.context[0]
+            pages.append([bug.id for bug in context[u'bunch_of_bugs']])
+            self.assertEqual(context[u'total_bug_count'], len(expected))
+            if not context[u'show_next_page_link']:
+                break
+            self.assert_(u'after=' in context[u'next_page_url'])
+            response = self.get_following(context[u'next_page_url'])
+        self.assertEqual(sum(pages, []), expected)
+
+        # ...and back again with the Prev links.
+        pages.pop()
+        while pages:
+            response = self.get_following(
+                response.context[0][u'prev_page_url'])
+            self.assertEqual(
+                [bug.id for bug in response.context[0][u'bunch_of_bugs']],
+                pages.pop())
+        self.assertFalse(response.context[0][u'show_prev_page_link'])
+
+    def test_json_view_pages_with_cursors(self):
+        response = self.client.get(u'/search/', {
+            u'q': u'python', u'format': u'json', u'jsoncallback': u'callback',
+            u'start': 1, u'end': 5})
+        first_page = simplejson.loads(response.content[len(u'callback('):-1])[0]
+        self.assertEqual(len(first_page[u'bugs']), 5)
+        self.assertFalse(u'prev_page_url' in first_page)
+
+        response = self.get_following(first_page[u'next_page_url'])
+        second_page = simplejson.loads(response.content[len(u'alert('):-1])[0]
+
+        query = mysite.search.controllers.Query.create_from_GET_data(
+            {u'q': u'python'})
+        expected = [bug.id for bug in mysite.search.controllers.order_bugs(
+            query.get_bugs_unordered())[5:10]]
+        self.assertEqual([bug[u'pk'] for bug in second_page[u'bugs']],
+                         expected)
+        self.assertEqual(second_page[u'total_bug_count'], query.get_bugs_unordered().count())
+
+    def test_bad_page_cursor(self):
+        response = self.client.get(u'/search/', {u'q': u'python',
+                                                 u'after': u'not a cursor'})
+        self.assertEqual(response.status_code, 400)
+
     def testPaginationAndChangingSearchQuery(self):
 
         url = u'http://openhatch.org/search/'
@@ -636,6 +822,88 @@ class SearchOnFullWords(SearchTest):
                 terms=['perl']).get_bugs_unordered()
         self.assertEqual(list(results), [perl_bug])
 
+class InvertedIndexEngineAgreesWithRegexEngine(SearchTest):
+    def setUp(self):
+        SearchTest.setUp(self)
+        self.engine = mysite.search.engines.InvertedIndexEngine(
+            index=mysite.search.engines.BugIndex())
+        firefox = Project.create_dummy(name=u'Mozilla Firefox', language=u'C++')
+        do = Project.create_dummy(name=u'GNOME-Do', language=u'C#')
+        Bug.create_dummy(project=firefox, title=u'Crash in the Python bindings')
+        Bug.create_dummy(project=firefox, description=u'properly escape things')
+        Bug.create_dummy(project=do, title=u'Port to c++',
+                         description=u'Write it in Python_3, not python')
+        Bug.create_dummy(project=do, title=u'docs', looks_closed=True)
+
+    def assert_engines_agree(self, terms):
+        query = mysite.search.controllers.Query(terms=terms)
+        regex_bugs = mysite.search.engines.RegexEngine().get_bugs_unordered(query)
+        index_bugs = self.engine.get_bugs_unordered(query)
+        self.assertEqual(sorted([b.id for b in regex_bugs]),
+                         sorted([b.id for b in index_bugs]))
+
+    def test_terms(self):
+        for terms in ([u'python'], [u'PYTHON'], [u'pro'], [u'c++'], [u'c#'],
+                      [u'firefox'], [u'mozilla firefox'], [u'gnome-do'],
+                      [u'python', u'crash'], [u'python_3'], [u'docs'],
+                      [u'++'], [u'python', u'nonexistent']):
+            self.assert_engines_agree(terms)
+
+    def test_index_notices_changes(self):
+        self.assert_engines_agree([u'python'])
+        bug = Bug.create_dummy(title=u'More python, please')
+        self.assert_engines_agree([u'python'])
+        bug.looks_closed = True
+        bug.save()
+        self.assert_engines_agree([u'python'])
+
+    def test_index_notices_deletions(self):
+        bug = Bug.create_dummy(title=u'More python, please')
+        self.assert_engines_agree([u'python'])
+        # As if a bug importer in another process deleted it: our index
+        # only hears about it through the Epoch.
+        bug.delete()
+        query = mysite.search.controllers.Query(terms=[u'python'])
+        self.assertEqual(self.engine.count_bugs(query),
+                         mysite.search.engines.RegexEngine().count_bugs(query))
+        self.assertFalse(bug.id in self.engine.index.bug_id2document)
+
+    def test_facets(self):
+        Bug.create_dummy(title=u'Python docs', good_for_newcomers=True,
+                         concerns_just_documentation=True)
+        facet_options = [{}, {u'language': u'c++'}, {u'language': u'Unknown'},
+                         {u'project': u'gnome-do'}, {u'toughness': u'bitesize'},
+                         {u'contribution_type': u'documentation',
+                          u'language': u'C'}]
+        for terms in ([], [u'python'], [u'c++']):
+            for active_facet_options in facet_options:
+                query = mysite.search.controllers.Query(
+                    terms=terms, active_facet_options=active_facet_options)
+                if query:
+                    regex_bugs = mysite.search.engines.RegexEngine(
+                        ).get_bugs_unordered(query)
+                    index_bugs = self.engine.get_bugs_unordered(query)
+                    self.assertEqual(sorted([b.id for b in regex_bugs]),
+                                     sorted([b.id for b in index_bugs]))
+                for facet_name in mysite.search.engines.FACET2COLUMN:
+                    self.assertEqual(
+                        mysite.search.engines.RegexEngine(
+                            ).count_bugs_by_facet_value(query, facet_name),
+                        self.engine.count_bugs_by_facet_value(query, facet_name))
+
+    def test_matching_ids_are_the_callers_own(self):
+        index = self.engine.index
+        index.sync()
+        matching = index.bug_ids_matching([], {})
+        open_bug_ids = list(index.open_bug_ids)
+        self.assertEqual(list(matching), open_bug_ids)
+
+        # A bug closing later doesn't change what we already got back.
+        bug = Bug.open_ones.order_by('id')[0]
+        index.remove_bug_id(bug.id)
+        self.assert_(bug.id in matching)
+        self.assertEqual(list(matching), open_bug_ids)
+
 class SearchTemplateDecodesQueryString(SearchTest):
     def test_facets_appear_in_search_template_context(self):
         response = self.client.get('/search/', {'language': 'Python'})
@@ -893,6 +1161,67 @@ class SingleFacetOption(SearchTest):
                 languages_option_any,
                 )
 
+class FacetOptionCountsInOneQuery(SearchTest):
+    def test_counts_match_one_query_per_option(self):
+        python = Project.create_dummy(name=u'Exaile', language=u'Python')
+        shouty_python = Project.create_dummy(name=u'Banshee', language=u'PYTHON')
+        unknown = Project.create_dummy(name=u'Mystery', language=u'')
+        Bug.create_dummy(project=python, description=u'bug', good_for_newcomers=True)
+        Bug.create_dummy(project=python, description=u'bug',
+                         concerns_just_documentation=True)
+        Bug.create_dummy(project=shouty_python, description=u'bug')
+        Bug.create_dummy(project=unknown, description=u'bug', good_for_newcomers=True)
+        Bug.create_dummy(project=unknown, description=u'no match here')
+
+        query = mysite.search.controllers.Query(
+                terms=[u'bug'],
+                terms_string=u'bug',
+                active_facet_options={u'toughness': u'bitesize'})
+        facet2option_names = {
+            u'language': [u'Python', u'PYTHON', u'Unknown', u''],
+            u'project': [u'Exaile', u'banshee', u'Mystery', u''],
+            u'toughness': [u'bitesize', u''],
+            u'contribution_type': [u'documentation', u''],
+            }
+        for facet_name, option_names in facet2option_names.items():
+            counts = query.get_facet_option_counts(facet_name, option_names)
+            for option_name in option_names:
+                option_query = mysite.search.controllers.Query.create_from_GET_data(
+                    query.get_facet_option_GET_data(facet_name, option_name))
+                self.assertEqual(counts[option_name],
+                                 option_query.get_bugs_unordered().count())
+
+    def test_missing_counts_are_stored_at_once(self):
+        python = Project.create_dummy(name=u'Exaile', language=u'Python')
+        perl = Project.create_dummy(name=u'Bugzilla', language=u'Perl')
+        Bug.create_dummy(project=python, description=u'bug')
+        Bug.create_dummy(project=perl, description=u'bug')
+        option_names = [u'Python', u'Perl', u'C', u'']
+
+        HitCountCache.clear_cache()
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        try:
+            django.db.reset_queries()
+            counts = mysite.search.controllers.Query(
+                terms=[u'bug'], terms_string=u'bug').get_facet_option_counts(
+                u'language', option_names)
+            inserts = [query for query in django.db.connection.queries
+                       if query['sql'].startswith('INSERT') and
+                       HitCountCache._meta.db_table in query['sql']]
+        finally:
+            settings.DEBUG = old_debug
+        self.assertEqual(counts,
+                         {u'Python': 1, u'Perl': 1, u'C': 0, u'': 2})
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(HitCountCache.objects.count(), 4)
+
+        # Next time, they all come out of the table.
+        HitCountCache.recently_used.clear()
+        self.assertEqual(mysite.search.controllers.Query(
+                terms=[u'bug'], terms_string=u'bug').get_facet_option_counts(
+                u'language', option_names), counts)
+
 class QueryGetToughnessFacetOptions(SearchTest):
     def test_get_toughness_facet_options(self):
         # We create three "bitesize" bugs, but constrain the Query so
@@ -1145,7 +1474,7 @@ class QueryGrabHitCount(SearchTest):
         query = mysite.search.controllers.Query.create_from_GET_data(data)
         stored_hit_count = 10
         HitCountCache.objects.create(
-                hashed_query=query.get_sha1(),
+                hashed_query=query.get_hit_count_cache_key(),
                 hit_count=stored_hit_count)
         self.assertEqual(query.get_or_create_cached_hit_count(), stored_hit_count)
 
@@ -1160,31 +1489,164 @@ class QueryGrabHitCount(SearchTest):
         expected_hit_count = 1
         self.assertEqual(query.get_or_create_cached_hit_count(), expected_hit_count)
 
-        hcc = HitCountCache.objects.get(hashed_query=query.get_sha1())
+        hcc = HitCountCache.objects.get(
+                hashed_query=query.get_hit_count_cache_key())
         self.assertEqual(hcc.hit_count, expected_hit_count)
 
-class ClearCacheWhenBugsChange(SearchTest):
+class ExpireCachedHitCountsWhenBugsChange(SearchTest):
 
-    def test_cached_cleared_after_bug_save_or_delete(self):
+    def test_cached_count_follows_bug_save_and_delete(self):
         data = {u'language': u'shoutNOW'}
         query = mysite.search.controllers.Query.create_from_GET_data(data)
+        self.assertEqual(query.get_or_create_cached_hit_count(), 0)
 
-        # Cache entry created after hit count retrieval
-        query.get_or_create_cached_hit_count()
-        self.assert_(HitCountCache.objects.all())
-
-        # Cache cleared after bug save
+        # Adding a bug in that language changes the count...
         project = Project.create_dummy(language=u'shoutNOW')
         bug = Bug.create_dummy(project=project)
-        self.assertFalse(HitCountCache.objects.all())
+        self.assertEqual(query.get_or_create_cached_hit_count(), 1)
+
+        # ...and so does closing it...
+        bug.looks_closed = True
+        bug.save()
+        self.assertEqual(query.get_or_create_cached_hit_count(), 0)
+
+        # ...re-opening it...
+        bug.looks_closed = False
+        bug.save()
+        self.assertEqual(query.get_or_create_cached_hit_count(), 1)
+
+        # ...and deleting it.
+        bug.delete()
+        self.assertEqual(query.get_or_create_cached_hit_count(), 0)
+
+    def test_cached_count_follows_bug_leaving_the_query(self):
+        data = {u'q': u'shoutnow'}
+        query = mysite.search.controllers.Query.create_from_GET_data(data)
+        bug = Bug.create_dummy_with_project(description=u'shoutnow')
+        self.assertEqual(query.get_or_create_cached_hit_count(), 1)
+
+        # The bug no longer has the word, which only its old version knew.
+        bug.description = u'eventhive'
+        bug.save()
+        self.assertEqual(query.get_or_create_cached_hit_count(), 0)
+
+    def test_cached_count_follows_project_rename(self):
+        data = {u'q': u'shoutnow'}
+        query = mysite.search.controllers.Query.create_from_GET_data(data)
+        bug = Bug.create_dummy_with_project()
+        self.assertEqual(query.get_or_create_cached_hit_count(), 0)
+
+        bug.project.name = u'ShoutNOW'
+        bug.project.save()
+        self.assertEqual(query.get_or_create_cached_hit_count(), 1)
 
-        # Cache entry created after hit count retrieval
+    def test_unrelated_bug_change_keeps_cached_count(self):
+        data = {u'language': u'shoutNOW'}
+        query = mysite.search.controllers.Query.create_from_GET_data(data)
         query.get_or_create_cached_hit_count()
-        self.assert_(HitCountCache.objects.all())
+        key = query.get_hit_count_cache_key()
 
-        # Cache cleared after bug deletion
+        project = Project.create_dummy(language=u'eventhive')
+        bug = Bug.create_dummy(project=project, description=u'python')
         bug.delete()
+        self.assertEqual(query.get_hit_count_cache_key(), key)
+        self.assert_(HitCountCache.objects.filter(hashed_query=key))
+
+    def test_clear_cache(self):
+        data = {u'language': u'shoutNOW'}
+        query = mysite.search.controllers.Query.create_from_GET_data(data)
+        query.get_or_create_cached_hit_count()
+        key = query.get_hit_count_cache_key()
+
+        HitCountCache.clear_cache()
         self.assertFalse(HitCountCache.objects.all())
+        self.assertNotEqual(query.get_hit_count_cache_key(), key)
+
+    def test_garbage_collect_keeps_fresh_counts(self):
+        HitCountCache.store_many({u'stored': 1})
+        HitCountCache.objects.create(hashed_query=u'saved', hit_count=2)
+        HitCountCache.objects.create(hashed_query=u'stale', hit_count=3)
+        HitCountCache.objects.filter(hashed_query=u'stale').update(
+            modified_date=datetime.datetime.now() - HitCountCache.MAX_AGE -
+            datetime.timedelta(days=1))
+        # store_many keeps the same (local) time as auto_now does.
+        stored, saved = [HitCountCache.objects.get(hashed_query=name)
+                         for name in (u'stored', u'saved')]
+        self.assert_(abs(stored.modified_date - saved.modified_date) <
+                     datetime.timedelta(minutes=5))
+
+        HitCountCache.garbage_collect()
+        self.assertEqual(sorted(HitCountCache.objects.values_list(
+                    'hashed_query', flat=True)), [u'saved', u'stored'])
+
+class SearchPageChromeSnapshot(SearchTest):
+
+    def test_snapshot_is_keyed_by_project_and_bug_epochs(self):
+        key = mysite.search.controllers.get_search_page_chrome_cache_key()
+        project = Project.create_dummy()
+        self.assertNotEqual(
+            mysite.search.controllers.get_search_page_chrome_cache_key(), key)
+
+        key = mysite.search.controllers.get_search_page_chrome_cache_key()
+        bug = Bug.create_dummy(project=project)
+        bug.delete()
+        self.assertNotEqual(
+            mysite.search.controllers.get_search_page_chrome_cache_key(), key)
+
+    def test_snapshot(self):
+        Bug.create_dummy_with_project()
+        chrome = mysite.search.controllers.build_search_page_chrome()
+        self.assertEqual(chrome['project_count'], 1)
+        self.assertEqual(chrome['all_projects'][0]['bug__count'], 1)
+
+    @mock.patch('mysite.search.controllers.build_search_page_chrome')
+    def test_search_page_reads_the_snapshot(self, build):
+        # A stored snapshot is all the search page asks for.
+        django.core.cache.cache.get = lambda key, default=None: {
+            'project_count': 31337}
+        response = self.client.get('/search/')
+        self.assertFalse(build.called)
+        self.assertContains(response, '31337')
+
+class ProjectListsInAFewQueries(SearchTest):
+    fixtures = ['user-paulproteus', 'person-paulproteus']
+
+    def count_queries(self, function):
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        try:
+            django.db.reset_queries()
+            value = function()
+            return value, len(django.db.connection.queries)
+        finally:
+            settings.DEBUG = old_debug
+
+    def test(self):
+        paul = Person.get_by_username('paulproteus')
+        with_bugs = [Project.create_dummy(name=name)
+                     for name in (u'Zope', u'Anjuta', u'Miro')]
+        for project in with_bugs:
+            Bug.create_dummy(project=project)
+            Bug.create_dummy(project=project, looks_closed=True)
+        # Cited, with and without bugs...
+        for name in (u'Miro', u'Banshee', u'Exaile', u'Exaile'):
+            project, _ = Project.objects.get_or_create(name=name)
+            mysite.profile.models.PortfolioEntry.create_dummy(
+                person=paul, project=project, is_published=True)
+        # ...but an unpublished citation doesn't count.
+        mysite.profile.models.PortfolioEntry.create_dummy(
+            person=paul, project=Project.create_dummy(name=u'Tomboy'))
+
+        projects, n_queries = self.count_queries(
+            mysite.search.controllers.get_projects_with_bugs)
+        self.assertEqual([p.name for p in projects],
+                         [u'Anjuta', u'Miro', u'Zope'])
+        self.assertEqual(n_queries, 2)
+
+        projects, n_queries = self.count_queries(
+            mysite.search.controllers.get_cited_projects_lacking_bugs)
+        self.assertEqual([p.name for p in projects], [u'Banshee', u'Exaile'])
+        self.assertEqual(n_queries, 3)
 
 class DontRecommendFutileSearchTerms(TwillTests):
 
@@ -1194,6 +1656,57 @@ class DontRecommendFutileSearchTerms(TwillTests):
                 Person.only_terms_with_results([u'useful', u'futile']),
                 [u'useful'])
 
+    def test_terms_are_checked_all_at_once(self):
+        mysite.search.models.Bug.create_dummy_with_project(
+            description=u'useful helpful')
+        terms = [u'useful', u'futile', u'helpful', u'pointless']
+        # Count them once...
+        self.assertEqual(mysite.search.controllers.get_terms_with_results(
+                terms), [u'useful', u'helpful'])
+
+        # ...after which it's one query for the versions, and the counts
+        # are remembered in this process.
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        try:
+            django.db.reset_queries()
+            self.assertEqual(
+                mysite.search.controllers.get_terms_with_results(terms),
+                [u'useful', u'helpful'])
+            self.assertEqual(len(django.db.connection.queries), 1)
+        finally:
+            settings.DEBUG = old_debug
+
+    def test_uncounted_terms_are_counted_all_at_once(self):
+        firefox = Project.create_dummy(name=u'Mozilla Firefox',
+                                       language=u'C++')
+        Bug.create_dummy(project=firefox, description=u'useful helpful')
+        Bug.create_dummy(project=firefox, title=u'Port to c++')
+        terms = [u'useful', u'futile', u'c++', u'mozilla firefox',
+                 u'helpful', u'gnome-do']
+        HitCountCache.clear_cache()
+
+        old_debug = settings.DEBUG
+        settings.DEBUG = True
+        try:
+            django.db.reset_queries()
+            hit_counts = mysite.search.controllers.get_or_create_cached_hit_counts(
+                [mysite.search.controllers.Query(terms=[term])
+                 for term in terms])
+            sqls = [query['sql'] for query in django.db.connection.queries]
+        finally:
+            settings.DEBUG = old_debug
+        self.assertEqual(hit_counts, [1, 0, 2, 2, 1, 0])
+        # One query counts the terms that aren't plain words; the bug index
+        # answers the rest.
+        self.assertEqual(len([sql for sql in sqls if 'COUNT(' in sql]), 1)
+        # One INSERT makes the dependencies, and one stores the counts.
+        self.assertEqual(len([sql for sql in sqls
+                              if sql.startswith('INSERT')]), 2)
+        for term, hit_count in zip(terms, hit_counts):
+            self.assertEqual(hit_count, mysite.search.controllers.Query(
+                    terms=[term]).get_bugs_unordered().count())
+
 
 class PublicizeBugTrackerIndex(SearchTest):
 
@@ -1,5 +1,4 @@
-from django.http import HttpResponse, QueryDict, HttpResponseServerError, HttpResponseRedirect
-from django.core import serializers
+from django.http import HttpResponse, QueryDict, HttpResponseServerError, HttpResponseRedirect, HttpResponseBadRequest
 from django.shortcuts import get_object_or_404
 from django.core.urlresolvers import reverse
 try:
@@ -10,8 +9,10 @@ except ImportError:
 
 from mysite.search.models import Project
 import mysite.search.controllers 
+import mysite.search.autocompletion
 import mysite.base.controllers
 import mysite.base.unicode_sanity
+import mysite.base.helpers
 from mysite.base.helpers import render_response
 
 import datetime
@@ -49,20 +50,44 @@ def fetch_bugs(request, invalid_subscribe_to_alert_form=None):
     format = request.GET.get('format', None)
     start = int(request.GET.get('start', 1))
     end = int(request.GET.get('end', 10))
+    # With a cursor (see mysite.search.controllers.bug2page_cursor), start
+    # and end only number the results; the cursor says where the page is.
+    after = request.GET.get('after', None)
+    before = request.GET.get('before', None)
 
     total_bug_count = 0
+    has_more_after_this_page = False
 
     query = mysite.search.controllers.Query.create_from_GET_data(request.GET)
 
     if query:
         bugs = query.get_bugs_unordered()
-
-        # Sort
-        bugs = mysite.search.controllers.order_bugs(bugs)
-
-        total_bug_count = bugs.count()
-
-        bugs = bugs[start-1:end]
+        if format == 'json':
+            # Fetch the page as rows with just what the JSON needs, in the
+            # same one query that orders and limits it.
+            bugs = bugs_as_json_values(bugs)
+
+        # This count is cached until a bug it depends on changes.
+        total_bug_count = query.get_or_create_cached_hit_count()
+
+        if after or before:
+            try:
+                bugs, has_more = mysite.search.controllers.get_page_of_bugs(
+                    bugs, end - start + 1, after=after, before=before)
+            except ValueError:
+                return HttpResponseBadRequest("Bad page cursor")
+            if before:
+                # Going backwards, we came from the page after this one.
+                has_more_after_this_page = True
+            else:
+                has_more_after_this_page = has_more
+        else:
+            # Old-style links (and the first page) just slice. Grab one
+            # extra bug to learn whether there's a next page.
+            bugs = list(mysite.search.controllers.order_bugs(bugs)[
+                start-1:end+1])
+            has_more_after_this_page = (len(bugs) > end - start + 1)
+            bugs = bugs[:end - start + 1]
 
     else:
         bugs = []
@@ -88,15 +113,26 @@ def fetch_bugs(request, invalid_subscribe_to_alert_form=None):
     prev_page_query_str['end'] = start - 1
     next_page_query_str['start'] = end + 1
     next_page_query_str['end'] = end + diff + 1
+    if bugs:
+        next_page_query_str['after'] = mysite.search.controllers.bug2page_cursor(
+            bugs[-1])
+        # The first page is better off with a plain, bookmarkable URL.
+        if start - diff - 1 > 1:
+            prev_page_query_str['before'] = (
+                mysite.search.controllers.bug2page_cursor(bugs[0]))
+        else:
+            prev_page_query_str['start'] = 1
+            prev_page_query_str['end'] = diff + 1
 
     data['start'] = start
-    data['end'] = min(end, total_bug_count)
+    data['end'] = start + len(bugs) - 1
+    data['total_bug_count'] = total_bug_count
     data['prev_page_url'] = '/search/?' + prev_page_query_str.urlencode()
     data['next_page_url'] = '/search/?' + next_page_query_str.urlencode()
     data['this_page_query_str'] = mysite.base.unicode_sanity.urlencode(request.GET)
 
     is_this_page_1 = (start <= 1)
-    is_this_the_last_page = ( end >= (total_bug_count - 1) )
+    is_this_the_last_page = not has_more_after_this_page
     data['show_prev_page_link'] = not is_this_page_1
     data['show_next_page_link'] = not is_this_the_last_page
 
@@ -127,17 +163,8 @@ def fetch_bugs(request, invalid_subscribe_to_alert_form=None):
         facet2any_query_string[facet] = query.get_facet_options(
             facet, [''])[0]['query_string']
 
-    Bug = mysite.search.models.Bug
-    from django.db.models import Q, Count
-    data['popular_projects'] = list(Project.objects.filter(name__in=['Miro', 'GnuCash', 'brasero', 'Evolution Exchange', 'songbird']).order_by('name').reverse())
-    data['all_projects'] = Project.objects.values('pk','name').filter(bug__looks_closed=False).annotate(Count('bug')).order_by('name')
-
-    Person = mysite.profile.models.Person
-    import random
-    random_start = int(random.random() * 700)
-    data['contributors'] = Person.objects.all()[random_start:random_start+5]
-    data['contributors2'] = Person.objects.all()[random_start+10:random_start+15]
-    data['languages'] = Project.objects.all().values_list('language', flat=True).order_by('language').exclude(language='').distinct()[:4]
+    # Everything that doesn't depend on the query comes out of a snapshot.
+    data.update(mysite.search.controllers.get_search_page_chrome())
 
     if format == 'json':
         # FIXME: Why `alert`?
@@ -148,39 +175,55 @@ def fetch_bugs(request, invalid_subscribe_to_alert_form=None):
         data['suggestions'] = suggestions
         data['bunch_of_bugs'] = bugs
         data['url'] = 'http://launchpad.net/'
-        data['total_bug_count'] = total_bug_count
         data['facet2any_query_string'] = facet2any_query_string
-        data['project_count'] = mysite.search.controllers.get_project_count()
 
         return render_response(request, 'search/search.html', data)
 
-def bugs_to_json_response(data, bunch_of_bugs, callback_function_name=''):
+def get_bug_json_field_names():
+    """The Bug fields that Django's serializer would put in 'fields'."""
+    return [field.name for field in mysite.search.models.Bug._meta.local_fields
+            if field.serialize]
+
+def bugs_as_json_values(bugs):
+    """Turn a query for bugs into one for values() rows with everything
+    the JSON view sends, the project's name included. Ordering and slicing
+    it still work, so a page of them is a single query."""
+    columns = ['id', 'project__name'] + [
+        name for name in get_bug_json_field_names() if name != 'project']
+    return bugs.values(*columns)
+
+def json_values2bug_dicts(bug_rows):
+    """Return the rows from bugs_as_json_values, in order, the way Django's
+    python serializer would have had the bugs, except with the project's
+    name in place of its primary key."""
+    field_names = get_bug_json_field_names()
+    bugs = []
+    for row in bug_rows:
+        fields = {}
+        for name in field_names:
+            fields[name] = row[name]
+        fields['project'] = row['project__name']
+        bugs.append({'pk': row['id'], 'model': u'search.bug',
+                     'fields': fields})
+    return bugs
+
+def bugs_to_json_response(data, bug_rows, callback_function_name=''):
     """ The search results page accesses this view via jQuery's getJSON method, 
-    and loads its results into the DOM."""
-    # Purpose of this code: Serialize the list of bugs
-    # Step 1: Pull the bugs out of the database, getting them back
-    #   as simple Python objects
-    
-    obj_serializer = serializers.get_serializer('python')()
-    bugs = obj_serializer.serialize(bunch_of_bugs)
-
-    # Step 2: With a (tragically) large number of database calls, 
-    # loop over these objects, replacing project primary keys with project names.
-    for bug in bugs:
-        project = Project.objects.get(pk=int(bug['fields']['project']))
-        bug['fields']['project'] = project.name
-
-    # Step 3: Create a JSON-happy list of key-value pairs
-    data_list = [{'bugs': bugs}]
-
-    # Step 4: Create the string form of the JSON
-    json_as_string = simplejson.dumps(data_list, default=encode_datetime)
-
-    # Step 5: Prefix it with the desired callback function name
-    json_string_with_callback = callback_function_name + '(' + json_as_string + ')'
-
-    # Step 6: Return that.
-    return HttpResponse(json_string_with_callback)
+    and loads its results into the DOM.
+
+    bug_rows come from bugs_as_json_values, already fetched, so this makes
+    no queries of its own."""
+    # A JSON-happy list of key-value pairs, with what a client needs to
+    # page through the results
+    page = {'bugs': json_values2bug_dicts(bug_rows),
+            'total_bug_count': data.get('total_bug_count', 0)}
+    for direction in ('prev', 'next'):
+        if data.get('show_%s_page_link' % direction):
+            page['%s_page_url' % direction] = data['%s_page_url' % direction]
+    json_as_string = simplejson.dumps([page], default=encode_datetime)
+
+    # Prefix it with the desired callback function name
+    return HttpResponse(callback_function_name + '(' + json_as_string + ')')
 
 def request_jquery_autocompletion_suggestions(request):
     """
@@ -209,13 +252,10 @@ def list_to_jquery_autocompletion_format(list):
     jQuery's autocomplete plugin."""
     return "\n".join(list)
 
-class SearchableField:
-    "A field in the database you can search."
-    fields_by_prefix = {}
-    def __init__(self, _prefix):
-        self.prefix = _prefix
-        self.is_queried = False
-        self.fields_by_prefix[self.prefix] = self
+# The fields you can ask for suggestions from, as in "lang:Py". So far,
+# only project and lang have any suggestions to give.
+AUTOCOMPLETION_FIELD_PREFIXES = ['project', 'lang', 'dep', 'lib', 'before',
+                                 'after']
 
 def get_autocompletion_suggestions(input):
     """
@@ -228,69 +268,36 @@ def get_autocompletion_suggestions(input):
     Not yet implemented:
       - libraries (frameworks? toolkits?) like Django
       - search by date
-    """
-    sf_project = SearchableField('project')
-    sf_language = SearchableField('lang')
-    sf_dependency = SearchableField('dep')
-    sf_library = SearchableField('lib')
-    sf_date_before = SearchableField('before')
-    sf_date_after = SearchableField('after')
 
+    The names and languages come out of an in-memory index (see
+    mysite.search.autocompletion), not the database.
+    """
     separator = ":"
-    prefix = ''
-    partial_query = ''
 
     if separator in input[1:-1]:
         prefix = input.split(separator)[0]
         partial_query = input.split(separator)[1]
-        sf = SearchableField.fields_by_prefix.get(prefix, None)
-        if sf is not None:
-            sf.is_queried = True
-            # FIXME: What happens when
-            # the user enters a bad prefix?
+        # A prefix we don't know about gets no suggestions.
+        queried_fields = [prefix]
     else:
-        for p in SearchableField.fields_by_prefix:
-            SearchableField.fields_by_prefix[
-                    p].is_queried = True
+        queried_fields = AUTOCOMPLETION_FIELD_PREFIXES
         partial_query = input
 
     project_max = 5
     lang_max = 5
 
+    index = mysite.search.autocompletion.autocompletion_index
     suggestions = []
 
-    if sf_project.is_queried:
-
-        # Compile list of projects
-        projects_by_name = Project.objects.filter(
-                name__istartswith=partial_query)
-        # FIXME: Is __istartswith faster than
-        # lowercasing and using startswith?
-
-        # Produce a list of names like ['Exaile', 'GNOME-DO', ...]
-        project_names = projects_by_name.values_list('name', flat=True)
-
-        # Limit
-        project_names = project_names[:project_max]
-
-        suggestions += [sf_project.prefix + separator + name
-                for name in project_names]
-
-    if sf_language.is_queried:
-
-        # For languages, get projects first
-        projects_by_lang = Project.objects.filter(
-                language__istartswith=partial_query)
-
-        # Then use bugs to compile a list of languages.
-        langs = projects_by_lang.values_list(
-                'language', flat=True).order_by(
-                        'language')[:lang_max]
-
-        if langs:
+    if 'project' in queried_fields:
+        suggestions += ['project' + separator + name
+                for name in index.project_names_starting_with(
+                    partial_query, project_max)]
 
-            suggestions += [sf_language.prefix + separator + lang
-                    for lang in langs]
+    if 'lang' in queried_fields:
+        suggestions += ['lang' + separator + lang
+                for lang in index.languages_starting_with(
+                    partial_query, lang_max)]
 
     return suggestions
 
@@ -123,6 +123,14 @@ SESSION_ENGINE="django.contrib.sessions.backends.file"
 HAYSTACK_SITECONF='mysite.haystack_configuration'
 HAYSTACK_SEARCH_ENGINE='solr'
 HAYSTACK_SOLR_URL='http://127.0.0.1:8983/solr'
+## ...or, with no Solr around, an index kept in memory and in a local file
+## (see mysite/profile/local_search_backend.py):
+#HAYSTACK_SEARCH_ENGINE='mysite.profile.local_search'
+#LOCAL_SEARCH_INDEX_PATH='/tmp/openhatch_local_search.index'
+
+## Bug search: 'regex' (MySQL REGEXP over every bug) or 'inverted_index'
+## (see mysite/search/engines.py)
+BUG_SEARCH_ENGINE='inverted_index'
 
 INSTALLED_APPS = (
     'ghettoq',
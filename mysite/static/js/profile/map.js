@@ -319,9 +319,90 @@ PeopleMapController.prototype.initialize = function(options) {
             create_a_callback(this, name, person_id));
     } // end for loop
 
-    google.maps.event.addListener(this.map,
-        'bounds_changed',
-        update_all_markers_eventually);
+    if (options['clusters_url']) {
+        // Nobody's listed; draw everybody in clusters instead.
+        this.showClusters(options['clusters_url']);
+    }
+    else {
+        google.maps.event.addListener(this.map,
+            'bounds_changed',
+            update_all_markers_eventually);
+    }
+};
+
+/*
+ * Rather than a marker per person, draw a marker per cluster of people,
+ * asking the server (see people_map_clusters in profile/views.py) for the
+ * clusters in view whenever the map stops moving.
+ */
+PeopleMapController.prototype.showClusters = function(clusters_url) {
+    var me = this;
+    var cluster_markers = [];
+    var latest_request = 0;
+
+    var make_cluster_marker = function(cluster) {
+        var marker = new google.maps.Marker({
+                'map': me.map,
+                'title': cluster['count'] + (cluster['count'] == 1 ?
+                    ' person' : ' people'),
+                'position': new google.maps.LatLng(cluster['latitude'],
+                    cluster['longitude'])
+        });
+        // Clicking a cluster zooms in on it, so it comes apart.
+        google.maps.event.addListener(marker, 'click', function() {
+            me.map.setCenter(marker.getPosition());
+            me.map.setZoom(me.map.getZoom() + 2);
+        });
+        return marker;
+    };
+
+    var update_visible_count = function(clusters) {
+        var visible = 0;
+        for (var i = 0; i < clusters.length; i++) {
+            visible += clusters[i]['count'];
+        }
+        var str = (visible == 0) ? "Nobody" : visible;
+        str = "<strong>" + str + "</strong>";
+        str += (visible == 0 || visible == 1) ? " is" : " are";
+        $('.dont_show_until_map_loads').show();
+        $('#show_everybody').hide();
+        $('#how_many_people_are_visible_label').show();
+        $('#how_many_people_are_visible').html(str);
+    };
+
+    var update_clusters = function() {
+        var bounds = me.map.getBounds();
+        if (typeof bounds == 'undefined') {
+            return;
+        }
+        latest_request += 1;
+        var this_request = latest_request;
+        $('#thinking').show();
+        $.getJSON(clusters_url, {
+                'zoom': me.map.getZoom(),
+                'south': bounds.getSouthWest().lat(),
+                'west': bounds.getSouthWest().lng(),
+                'north': bounds.getNorthEast().lat(),
+                'east': bounds.getNorthEast().lng()
+            }, function(data) {
+                // The map may have moved on while we waited.
+                if (this_request != latest_request) {
+                    return;
+                }
+                for (var i = 0; i < cluster_markers.length; i++) {
+                    cluster_markers[i].setMap(null);
+                }
+                cluster_markers = [];
+                for (var j = 0; j < data['clusters'].length; j++) {
+                    cluster_markers.push(make_cluster_marker(
+                        data['clusters'][j]));
+                }
+                update_visible_count(data['clusters']);
+                $('#thinking').hide();
+            });
+    };
+
+    google.maps.event.addListener(this.map, 'idle', update_clusters);
 };
 
 //this gets called when you click a marker on the map
@@ -65,6 +65,9 @@ urlpatterns = patterns('',
         (r'^people/$',
             'mysite.profile.views.people'),
 
+        (r'^people/map/clusters/$',
+            'mysite.profile.views.people_map_clusters'),
+
         (r'^\+people/list/$', lambda x: HttpResponsePermanentRedirect('/people/')),
 
         (r'^account/forgot_pass/$',